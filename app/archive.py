@@ -0,0 +1,135 @@
+import os
+import time
+import asyncio
+import logging
+from datetime import date
+from typing import Optional
+
+import aiosqlite
+
+import config
+from app.database import get_async_sqlite_session, get_shard_write_lock
+from app.migrations import run_migrations
+from app.sharding import all_shards, archive_path
+
+logger = logging.getLogger(__name__)
+
+# """
+# Архив закрытых лет (холодные данные).
+# Записи старше границы hot_cutoff() переносятся из таблицы 'out' в такую же таблицу
+# в отдельном файле архива, который подключается через ATTACH как схема 'archive'.
+# Основная таблица и ее индексы остаются небольшими и помещаются в кэш.
+# """
+
+# Имя схемы подключенного архива в SQL-запросах.
+ARCHIVE_SCHEMA = "archive"
+
+# Размер пачки переноса и пауза между пачками, чтобы не мешать add_note.
+ARCHIVE_BATCH_SIZE = 500
+ARCHIVE_BATCH_PAUSE = 0.05
+
+# Колонки, которые переносятся в архив (rowid в архиве свой).
+ARCHIVE_COLUMNS = "user_tg_id, category, sub_category, summ, description, date, date_iso, recurring_id, currency"
+
+
+def hot_cutoff(today: Optional[date] = None) -> str:
+    """
+    Граница горячих данных в формате date_iso.
+    В основной таблице остается год предыдущего месяца и все, что позже:
+    в январе прошлый год еще нужен для отчета за декабрь.
+    """
+    today = today or date.today()
+    previous_month_year = today.year - 1 if today.month == 1 else today.year
+    return f"{previous_month_year:04d}-01-01"
+
+
+async def attach_archive(connection: aiosqlite.Connection, shard: int) -> bool:
+    """
+    Подключает архив шарда к соединению как схему 'archive'.
+    :return: True, если архив существует и подключен.
+    """
+    path = archive_path(shard)
+    if not os.path.exists(path):
+        return False
+    cursor = await connection.execute("PRAGMA database_list")
+    attached = {row[1] for row in await cursor.fetchall()}
+    await cursor.close()
+    if ARCHIVE_SCHEMA not in attached:
+        await connection.execute(f"ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}", (path,))
+    return True
+
+
+async def archive_shard(shard: int, cutoff: Optional[str] = None, batch_size: int = ARCHIVE_BATCH_SIZE,
+                        pause: float = ARCHIVE_BATCH_PAUSE) -> int:
+    """
+    Переносит записи шарда с date_iso < cutoff в архив.
+    Идет по диапазонам rowid, каждая пачка - отдельная транзакция (вставка в архив и
+    удаление из основной таблицы фиксируются вместе), между пачками блокировка записи
+    освобождается.
+    :return: Количество перенесенных записей.
+    """
+    cutoff = cutoff or hot_cutoff()
+
+    # Создаем/обновляем схему архива теми же миграциями, что и основную БД.
+    async with aiosqlite.connect(archive_path(shard)) as archive_conn:
+        await run_migrations(archive_conn)
+
+    moved = 0
+    async with get_async_sqlite_session(shard=shard) as connection:
+        cursor = await connection.execute("SELECT MIN(rowid), MAX(rowid) FROM out WHERE date_iso < ?", (cutoff,))
+        min_rowid, max_rowid = await cursor.fetchone()
+        await cursor.close()
+        if min_rowid is None:
+            return 0
+
+        await attach_archive(connection, shard)
+        start = min_rowid
+        while start <= max_rowid:
+            params = (start, start + batch_size, cutoff)
+            async with get_shard_write_lock(shard=shard):
+                await connection.execute("BEGIN IMMEDIATE")
+                try:
+                    await connection.execute(
+                        f"INSERT INTO {ARCHIVE_SCHEMA}.out ({ARCHIVE_COLUMNS}) "
+                        f"SELECT {ARCHIVE_COLUMNS} FROM main.out "
+                        "WHERE rowid >= ? AND rowid < ? AND date_iso < ? ORDER BY rowid",
+                        params
+                    )
+                    cursor = await connection.execute(
+                        "DELETE FROM main.out WHERE rowid >= ? AND rowid < ? AND date_iso < ?", params
+                    )
+                    moved += cursor.rowcount
+                    await cursor.close()
+                    await connection.commit()
+                except Exception:
+                    await connection.rollback()
+                    raise
+            start += batch_size
+            await asyncio.sleep(pause)
+
+    logger.info("В архив %s перенесено %d записей (до %s).", archive_path(shard), moved, cutoff)
+    return moved
+
+
+async def archive_closed_years(cutoff: Optional[str] = None) -> int:
+    """Переносит закрытые годы в архив на всех шардах по очереди."""
+    started = time.perf_counter()
+    moved = 0
+    for shard in all_shards():
+        try:
+            moved += await archive_shard(shard, cutoff)
+        except Exception as ex:
+            logger.error("Ошибка архивации шарда %s: %s", shard, ex, exc_info=True)
+    logger.info("Архивация завершена за %.1f сек., перенесено %d записей.", time.perf_counter() - started, moved)
+    return moved
+
+
+async def archive_worker(interval: Optional[float] = None):
+    """
+    Фоновая задача: периодически переносит закрытые годы в архив.
+    Интервал в секундах берется из config.ARCHIVE_INTERVAL (по умолчанию раз в сутки).
+    """
+    interval = interval or getattr(config, "ARCHIVE_INTERVAL", 24 * 60 * 60)
+    while True:
+        await archive_closed_years()
+        await asyncio.sleep(interval)
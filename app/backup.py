@@ -0,0 +1,136 @@
+import os
+import glob
+import time
+import sqlite3
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Optional
+
+import config
+from app.sharding import all_shards, archive_path, shard_path
+
+logger = logging.getLogger(__name__)
+
+# """
+# Онлайн-резервные копии через SQLite backup API.
+# Копия снимается небольшими шагами (BACKUP_PAGES_PER_STEP страниц) с паузой между шагами:
+# блокировка чтения источника держится только на время шага, и add_note не ждет долго.
+# """
+
+# Страниц за один шаг и пауза между шагами (сек.).
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_STEP_SLEEP = 0.01
+
+
+@dataclass
+class BackupResult:
+    """Итог резервного копирования одного файла БД."""
+    source: str
+    path: Optional[str]     # Файл копии (None, если копия не прошла проверку)
+    size: int               # Размер копии в байтах
+    duration: float         # Длительность в секундах
+    ok: bool                # Копия прошла PRAGMA integrity_check
+
+
+def get_backup_dir() -> str:
+    """Каталог копий из config.BACKUP_DIR (по умолчанию "backups")."""
+    return getattr(config, "BACKUP_DIR", "backups")
+
+
+def _backup_name(source: str, stamp: str) -> str:
+    base = os.path.splitext(os.path.basename(source))[0]
+    return os.path.join(get_backup_dir(), f"{base}.{stamp}.bak.db")
+
+
+def _backup_file(source: str, target: str, pages: int, step_sleep: float) -> bool:
+    """
+    Копирует source в target по шагам и проверяет копию.
+    Выполняется в отдельном потоке (asyncio.to_thread), поэтому time.sleep не блокирует цикл событий.
+    """
+    def progress(status, remaining, total):
+        # Между шагами источник не заблокирован, писатели успевают закоммитить.
+        time.sleep(step_sleep)
+
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(target)
+    try:
+        src.backup(dst, pages=pages, progress=progress)
+        result = dst.execute("PRAGMA integrity_check").fetchone()[0]
+        return result == "ok"
+    finally:
+        dst.close()
+        src.close()
+
+
+def rotate_backups(source: str, keep: int) -> List[str]:
+    """Удаляет старые копии файла source, оставляя keep последних. Возвращает удаленные пути."""
+    base = os.path.splitext(os.path.basename(source))[0]
+    # Метка времени в имени сортируется лексикографически.
+    # Шаблон требует цифру после имени, чтобы копии "bot.db" не путались с копиями "bot.archive.db".
+    pattern = os.path.join(glob.escape(get_backup_dir()), f"{glob.escape(base)}.[0-9]*.bak.db")
+    backups = sorted(glob.glob(pattern))
+    removed = backups[:-keep] if keep > 0 else backups
+    for path in removed:
+        os.remove(path)
+    return removed
+
+
+async def backup_database(source: str, pages: int = BACKUP_PAGES_PER_STEP,
+                          step_sleep: float = BACKUP_STEP_SLEEP, keep: Optional[int] = None) -> BackupResult:
+    """
+    Делает онлайн-копию файла БД, проверяет ее и удаляет старые копии.
+    Копия сначала пишется во временный файл и переименовывается только после проверки.
+    """
+    keep = keep if keep is not None else getattr(config, "BACKUP_KEEP", 7)
+    os.makedirs(get_backup_dir(), exist_ok=True)
+    target = _backup_name(source, datetime.now().strftime("%Y%m%d-%H%M%S-%f"))
+    temp_target = target + ".tmp"
+
+    started = time.perf_counter()
+    replaced = False
+    try:
+        ok = await asyncio.to_thread(_backup_file, source, temp_target, pages, step_sleep)
+        duration = time.perf_counter() - started
+        if not ok:
+            logger.error("Копия %s не прошла проверку целостности и удалена.", source)
+            return BackupResult(source=source, path=None, size=0, duration=duration, ok=False)
+        os.replace(temp_target, target)
+        replaced = True
+    finally:
+        # Недописанная или непроверенная копия (ошибка диска, блокировка источника) не остается в каталоге:
+        # rotate_backups удаляет только готовые копии.
+        if not replaced and os.path.exists(temp_target):
+            os.remove(temp_target)
+
+    size = os.path.getsize(target)
+    removed = rotate_backups(source, keep)
+    logger.info("Резервная копия %s -> %s: %d байт за %.2f сек., удалено старых копий: %d",
+                source, target, size, duration, len(removed))
+    return BackupResult(source=source, path=target, size=size, duration=duration, ok=True)
+
+
+async def backup_all() -> List[BackupResult]:
+    """Копирует все шарды и их архивы по очереди (не параллельно, чтобы не нагружать диск)."""
+    results = []
+    for shard in all_shards():
+        for source in (shard_path(shard), archive_path(shard)):
+            if not os.path.exists(source):
+                continue
+            try:
+                results.append(await backup_database(source))
+            except Exception as ex:
+                logger.error("Ошибка резервного копирования %s: %s", source, ex, exc_info=True)
+    return results
+
+
+async def backup_worker(interval: Optional[float] = None):
+    """
+    Фоновая задача: резервные копии по расписанию.
+    Интервал в секундах из config.BACKUP_INTERVAL (по умолчанию раз в сутки).
+    """
+    interval = interval or getattr(config, "BACKUP_INTERVAL", 24 * 60 * 60)
+    while True:
+        await asyncio.sleep(interval)
+        await backup_all()
@@ -0,0 +1,161 @@
+import io
+import asyncio
+import logging
+import importlib.util
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import config
+from app.money import to_major
+
+logger = logging.getLogger(__name__)
+
+# """
+# Графики к отчетам (PNG).
+# Рисование matplotlib занимает процессор на сотни миллисекунд, поэтому выполняется
+# в пуле процессов, а не на цикле событий. Готовые картинки кэшируются по ключу
+# (пользователь, период, версия данных), повторный запрос отчета их не перерисовывает.
+# """
+
+
+def render_category_pie(data: Dict[str, Any]) -> bytes:
+    """Круговая диаграмма расходов по категориям. Выполняется в процессе пула."""
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib import pyplot as plt
+
+    labels = [category for category, _ in data["categories"]]
+    sizes = [summ for _, summ in data["categories"]]
+    fig, ax = plt.subplots(figsize=(6, 6))
+    ax.pie(sizes, labels=labels, autopct="%1.0f%%", startangle=90, counterclock=False)
+    ax.set_title(f"Расходы по категориям: {data['title']}")
+    return _figure_to_png(fig)
+
+
+def render_daily_line(data: Dict[str, Any]) -> bytes:
+    """График расходов по дням. Выполняется в процессе пула."""
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib import pyplot as plt
+
+    days = [day for day, _ in data["daily"]]
+    sums = [to_major(summ) for _, summ in data["daily"]]
+    fig, ax = plt.subplots(figsize=(8, 4))
+    ax.plot(days, sums, marker="o")
+    ax.set_title(f"Расходы по дням: {data['title']}")
+    ax.set_ylabel("руб.")
+    fig.autofmt_xdate()
+    return _figure_to_png(fig)
+
+
+def _figure_to_png(fig) -> bytes:
+    from matplotlib import pyplot as plt
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", dpi=100, bbox_inches="tight")
+    plt.close(fig)
+    return buffer.getvalue()
+
+
+# Виды графиков отчета. Функции должны быть на уровне модуля, чтобы их можно было передать в процесс.
+RENDERERS: Dict[str, Callable[[Dict[str, Any]], bytes]] = {
+    "categories": render_category_pie,
+    "daily": render_daily_line,
+}
+
+
+def charts_available() -> bool:
+    """matplotlib - необязательная зависимость, без нее отчеты отправляются без графиков."""
+    return importlib.util.find_spec("matplotlib") is not None
+
+
+class ChartRenderer:
+    """
+    Очередь рисования графиков в пуле процессов.
+    Одновременно ожидающих задач не больше max_pending (лишние отклоняются, отчет уходит без графика),
+    каждая задача ограничена timeout секунд.
+    """
+
+    def __init__(self, executor: Optional[Executor] = None, max_pending: Optional[int] = None,
+                 timeout: Optional[float] = None, cache_size: Optional[int] = None):
+        self._executor = executor
+        self._max_pending = max_pending or getattr(config, "CHART_MAX_PENDING", 8)
+        self._timeout = timeout or getattr(config, "CHART_TIMEOUT", 10.0)
+        self._cache_size = cache_size or getattr(config, "CHART_CACHE_SIZE", 128)
+        self._pending = 0
+        self._cache: "OrderedDict[Tuple, bytes]" = OrderedDict()
+
+    def _get_executor(self) -> Executor:
+        # Пул создается при первом графике, а не при старте бота.
+        # Процессы запускаются через spawn, а не fork: к этому моменту в боте работают поток логов
+        # и потоки aiosqlite, и копия их блокировок в дочернем процессе может остаться занятой навсегда.
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=getattr(config, "CHART_WORKERS", 2),
+                                                 mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    async def render(self, key: Tuple, kind: str, data: Dict[str, Any]) -> Optional[bytes]:
+        """
+        Рисует график вида kind или берет его из кэша.
+        :return: PNG или None, если очередь переполнена, истек таймаут или произошла ошибка.
+        """
+        cache_key = key + (kind,)
+        image = self._cache.get(cache_key)
+        if image is not None:
+            self._cache.move_to_end(cache_key)
+            return image
+
+        if self._pending >= self._max_pending:
+            logger.warning("Очередь графиков заполнена (%d), график %s пропущен.", self._pending, kind)
+            return None
+
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self._get_executor(), RENDERERS[kind], data)
+            image = await asyncio.wait_for(future, self._timeout)
+        except asyncio.TimeoutError:
+            # Процесс пула доработает задачу сам, результат будет отброшен.
+            logger.warning("График %s не построен за %.1f сек.", kind, self._timeout)
+            return None
+        except Exception as ex:
+            logger.error("Ошибка построения графика %s: %s", kind, ex, exc_info=True)
+            return None
+        finally:
+            self._pending -= 1
+
+        self._cache[cache_key] = image
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return image
+
+    async def render_report(self, user_id: Union[int, Tuple[str, str]], period: Tuple[int, int], data_version: int,
+                            chart_data: Dict[str, Any]) -> List[bytes]:
+        """
+        Все графики отчета. Версия данных в ключе кэша меняется при каждой новой записи пользователя.
+        user_id - ид пользователя или ("group", название) для отчета группы (app.groups).
+        """
+        if not charts_available():
+            return []
+        key = (user_id, period, data_version)
+        images = await asyncio.gather(*(self.render(key, kind, chart_data) for kind in RENDERERS))
+        return [image for image in images if image]
+
+    def shutdown(self):
+        """Останавливает пул процессов."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+_renderer: Optional[ChartRenderer] = None
+
+
+def get_chart_renderer() -> ChartRenderer:
+    """Общий для процесса рендерер графиков."""
+    global _renderer
+    if _renderer is None:
+        _renderer = ChartRenderer()
+    return _renderer
@@ -1,104 +1,173 @@
-
 import logging
-from csv import excel
-from datetime import datetime
-from typing import List, Dict, Any, Optional
-
-import aiosqlite
+from datetime import date, datetime
+from typing import List, Dict, Any, AsyncIterator, Iterable, Optional
 
-import config
-from app.database import get_async_sqlite_session
+from app.currency import get_rate_cache
+from app.groups import GroupTotals, get_groups, group_totals
+from app.logging_setup import SAMPLED
+from app.periods import Period, month_period
+from app.storage import NoteRecord, get_storage
+from app.suggestions import CategoryIndex, category_suggestions
+from app.summary import MonthSummary, build_month_summary, month_summaries
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# """Операции с записями. Работают через интерфейс хранилища app.storage.Storage."""
 
-async def add_note(user_tg_id: int, category: str, sub_category: str, summ: int, description: str) -> bool:
-    """
-    Асинхронно добавляет новую запись в базу данных SQLite.
-    Использует aiosqlite для неблокирующих операций.
-    """
-    logger.info("Запуск асинхронной функции add_note")
-
-    # 1. Получаем соединение
-    async with get_async_sqlite_session() as connection:
-        if connection is None:
-            logger.error("Не удалось получить соединение с БД.")
-            return False
+# Версия данных пользователя: увеличивается при каждой новой записи.
+# Входит в ключ кэша графиков (app.charts), поэтому новая запись делает старые графики неактуальными.
+_data_versions: Dict[int, int] = {}
 
-        try:
-            date = datetime.now().strftime("%d.%m.%Y")  # Формат даты: день, месяц, год
 
-            # Асинхронное выполнение SQL-запроса
-            # В aiosqlite можно использовать .execute() прямо на объекте connection
-            await connection.execute(
-                "INSERT INTO out (user_tg_id, category, sub_category, summ, description, date) VALUES (?, ?, ?, ?, ?, ?)",
-                (user_tg_id, category, sub_category, summ, description, date)
-            )
+def get_data_version(user_tg_id: int) -> int:
+    """Текущая версия данных пользователя в этом процессе."""
+    return _data_versions.get(user_tg_id, 0)
 
-            # Асинхронное подтверждение транзакции (commit)
-            await connection.commit()
 
-            logger.info(f"Запись успешно добавлена для пользователя ID: {user_tg_id}.")
-            return True
+def bump_data_versions(user_tg_ids: Iterable[int]):
+    """Увеличивает версию данных пользователей, записи которых добавлены в обход add_note (регулярные расходы)."""
+    for user_tg_id in user_tg_ids:
+        _data_versions[user_tg_id] = get_data_version(user_tg_id) + 1
 
-        except Exception as ex:
-            # Обработка любых исключений (например, ошибок БД или подключения)
-            logger.error(f"Ошибка добавления данных в БД для пользователя ID {user_tg_id}: {ex}", exc_info=True)
-            return False
 
+async def add_note(user_tg_id: int, category: str, sub_category: str, summ: int, description: str,
+                   currency: Optional[str] = None) -> bool:
+    """
+    Асинхронно добавляет новую запись в текущее хранилище.
+    Дата записи - текущий момент. currency - код валюты суммы (None - базовая валюта).
+    """
+    logger.info("Запуск асинхронной функции add_note", extra=SAMPLED)
+    now = datetime.now()
+    added = await get_storage().add_note(
+        user_tg_id=user_tg_id,
+        category=category,
+        sub_category=sub_category,
+        summ=summ,
+        description=description,
+        date=now,
+        currency=currency
+    )
+    if added:
+        bump_data_versions([user_tg_id])
+        # Сводка за месяц (inline-запросы) дополняется без чтения записей из хранилища.
+        month_summaries.note_added(
+            user_tg_id, category, get_rate_cache().convert(summ, currency, now.strftime("%Y-%m-%d")), now.date(),
+            get_data_version(user_tg_id)
+        )
+        # Подсказки категорий (app.suggestions) учитывают запись без повторного чтения истории.
+        category_suggestions.note_added(user_tg_id, category, sub_category, now.date())
+    return added
+
+
+async def get_category_index(user_tg_id: int) -> CategoryIndex:
+    """
+    Индекс категорий пользователя для подсказок (app.suggestions).
+    Заполняется из хранилища при первом обращении, дальше обновляется в add_note.
+    """
+    return await category_suggestions.get(user_tg_id, lambda user: get_storage().get_category_usage(user_tg_id=user))
 
 
-async def get_notes_by_user_and_month(conn: aiosqlite.Connection, user_tg_id: int, month: int, year: int):
+async def get_month_summary(user_tg_id: int) -> MonthSummary:
+    """
+    Сводка расходов пользователя за текущий месяц из памяти (app.summary).
+    При промахе кэша строится одним потоковым чтением записей месяца.
     """
-            Асинхронно получает все записи для указанного пользователя за определенный месяц и год
-            с использованием уже установленного асинхронного соединения (aiosqlite.Connection).
+    today = date.today()
+    version = get_data_version(user_tg_id)
+    summary = month_summaries.get(user_tg_id, today, version)
+    if summary is not None:
+        return summary
+
+    logger.info("Построение сводки за месяц для user_tg_id=%s", user_tg_id, extra=SAMPLED)
+    period = month_period(today.month, today.year)
+    summary = await build_month_summary(
+        get_storage().iter_notes_by_user_and_period(user_tg_id=user_tg_id, start_date=period.start,
+                                                    end_date=period.end),
+        today.year, today.month
+    )
+    # Запись, добавленная во время построения, могла не попасть в сводку: такую сводку не кэшируем.
+    if get_data_version(user_tg_id) == version:
+        month_summaries.put(user_tg_id, summary, version)
+    return summary
+
+
+def get_group_data_version(group: str) -> int:
+    """Версия данных группы (app.groups): растет при каждой новой записи любого участника."""
+    return sum(get_data_version(user_tg_id) for user_tg_id in get_groups().get(group, ()))
+
+
+async def get_group_totals(group: str, period: Period) -> GroupTotals:
+    """
+    Итоги группы за период по участникам, категориям и дням.
+    Берутся из кэша, пока у участников нет новых записей, иначе - одним запросом к хранилищу.
+    """
+    version = get_group_data_version(group)
+    totals = group_totals.get(group, period, version)
+    if totals is not None:
+        return totals
+
+    logger.info("Расчет итогов группы %s за период с %s", group, period.start, extra=SAMPLED)
+    totals = GroupTotals()
+    for row in await get_storage().get_group_totals(group=group, start_date=period.start, end_date=period.end):
+        totals.add(row["user_tg_id"], row["category"], row["date"], row["total"], row["notes"])
+    # Запись, добавленная во время запроса, могла не попасть в итоги: такие итоги не кэшируем.
+    if get_group_data_version(group) == version:
+        group_totals.put(group, period, version, totals)
+    return totals
+
+
+async def add_income(user_tg_id: int, category: str, summ: int, description: str) -> bool:
+    """
+    Асинхронно добавляет запись о доходе. Баланс пользователя обновляется в той же транзакции.
+    Дата записи - текущий момент.
+    """
+    logger.info("Запуск асинхронной функции add_income", extra=SAMPLED)
+    return await get_storage().add_income(
+        user_tg_id=user_tg_id,
+        category=category,
+        summ=summ,
+        description=description,
+        date=datetime.now()
+    )
 
-            :param conn: Асинхронное соединение с базой данных (aiosqlite.Connection).
-            :param user_tg_id: Telegram ID пользователя.
-            :param month: Номер месяца (1-12).
-            :param year: Год.
-            :return: Список словарей с записями или пустой список, если записей нет/произошла ошибка.
-            """
-    logger.info(
-        f"Запуск асинхронной функции get_notes_by_user_and_month для user_tg_id={user_tg_id}, month={month}, year={year}")
 
-    notes: List[Dict[str, Any]] = []
+async def get_balance(user_tg_id: int) -> Dict[str, int]:
+    """Баланс пользователя: {"income", "expense", "balance"} (одна строка в БД, без сумм по истории)."""
+    logger.info("Запуск асинхронной функции get_balance для user_tg_id=%s", user_tg_id, extra=SAMPLED)
+    return await get_storage().get_balance(user_tg_id=user_tg_id)
 
-    # SQL-запрос для выбора записей.
-    # Используется логика преобразования строки даты "ДД.ММ.ГГГГ" в формат YYYY-MM-DD
-    # для корректного использования функций STRFTIME в SQLite.
-    query = """
-                SELECT user_tg_id, category, summ, description, date
-                FROM out
-                WHERE user_tg_id = ?
-                  AND STRFTIME('%m', SUBSTR(date, 7, 4) || '-' || SUBSTR(date, 4, 2) || '-' || SUBSTR(date, 1, 2)) = ?
-                  AND STRFTIME('%Y', SUBSTR(date, 7, 4) || '-' || SUBSTR(date, 4, 2) || '-' || SUBSTR(date, 1, 2)) = ?;
-            """
-    # Преобразуем month в строку с ведущим нулем (например, '01' вместо '1')
-    month_str = f"{month:02d}"
-    year_str = str(year)
-    params = (user_tg_id, month_str, year_str)
 
-    try:
-        # 1. Асинхронное создание курсора и выполнение запроса.
-        # Используем async with для управления курсором, хотя conn.execute/fetchall тоже можно.
-        async with conn.cursor() as cur:
-            await cur.execute(query, params)
+async def get_notes_by_user_and_month(user_tg_id: int, month: int, year: int) -> List[Dict[str, Any]]:
+    """
+    Асинхронно получает все записи для указанного пользователя за определенный месяц и год.
 
-            # 2. Асинхронное получение всех результатов
-            rows = await cur.fetchall()
+    :param user_tg_id: Telegram ID пользователя.
+    :param month: Номер месяца (1-12).
+    :param year: Год.
+    :return: Список словарей с записями или пустой список, если записей нет/произошла ошибка.
+    """
+    logger.info("Запуск асинхронной функции get_notes_by_user_and_month для user_tg_id=%s, month=%s, year=%s",
+                user_tg_id, month, year, extra=SAMPLED)
+    return await get_storage().get_notes_by_user_and_month(user_tg_id=user_tg_id, month=month, year=year)
 
-        for row in rows:
-            # Поскольку в get_async_sqlite_session() установлено conn.row_factory = aiosqlite.Row,
-            # row ведет себя как словарь, поэтому преобразуем его для явности.
-            notes.append(dict(row))
 
-        logger.info(f"Получено {len(notes)} записей для user_tg_id={user_tg_id} за {month}.{year}.")
-        return notes
+async def iter_notes_by_user_and_period(user_tg_id: int, start_date: str, end_date: str) -> AsyncIterator[NoteRecord]:
+    """
+    Записи пользователя за период [start_date, end_date) по одной, без загрузки всего списка в память.
+    Использование: async for note in iter_notes_by_user_and_period(...): note.summ, note.category
+    """
+    logger.info("Запуск асинхронной функции iter_notes_by_user_and_period для user_tg_id=%s, %s - %s",
+                user_tg_id, start_date, end_date, extra=SAMPLED)
+    async for note in get_storage().iter_notes_by_user_and_period(
+            user_tg_id=user_tg_id, start_date=start_date, end_date=end_date):
+        yield note
 
-    except Exception as ex:
-        logger.error(f"Ошибка асинхронного получения данных из БД для user_tg_id {user_tg_id}: {ex}", exc_info=True)
-        return []
 
+async def get_all_users_totals_by_month(month: int, year: int) -> Dict[int, int]:
+    """
+    Административный запрос: суммы расходов всех пользователей за месяц.
+    В SQLite выполняется параллельно на всех шардах, результаты объединяются.
+    :return: Словарь {user_tg_id: сумма}. При ошибке БД - app.storage.StorageError.
+    """
+    logger.info("Запуск функции get_all_users_totals_by_month за %s.%s", month, year)
+    return await get_storage().get_totals_by_month(month=month, year=year)
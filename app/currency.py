@@ -0,0 +1,146 @@
+import os
+import csv
+import math
+import logging
+from bisect import bisect_right
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# """
+# Валюты записей и курсы к базовой валюте.
+# Курсы берутся из локального файла (без обращения к сети), хранятся в памяти процесса
+# и копируются в таблицу 'rates' каждого шарда, чтобы отчеты пересчитывали суммы в самом SQL.
+# """
+
+# Базовая валюта отчетов и баланса. В 'out.currency' для нее хранится NULL.
+BASE_CURRENCY: str = getattr(config, "BASE_CURRENCY", "RUB")
+
+# Суффикс суммы в сообщении ("25eur", "25€") -> код валюты.
+CURRENCY_ALIASES: Dict[str, str] = {
+    "rub": "RUB", "руб": "RUB", "р": "RUB", "₽": "RUB",
+    "eur": "EUR", "евро": "EUR", "€": "EUR",
+    "usd": "USD", "долл": "USD", "$": "USD",
+    "gel": "GEL", "лари": "GEL", "₾": "GEL",
+}
+
+# Курс: (валюта, date_iso, сколько единиц базовой валюты стоит единица валюты с этой даты).
+RateRow = Tuple[str, str, float]
+
+
+def currency_by_suffix(suffix: str) -> Optional[str]:
+    """Код валюты по суффиксу суммы или None, если суффикс не валюта."""
+    return CURRENCY_ALIASES.get(suffix.lower())
+
+
+def base_summ_sql(alias: str) -> str:
+    """
+    SQL-выражение суммы записи alias в базовой валюте (целое, с округлением как ROUND).
+    Курс - последний на дату записи (или самый ранний, если запись старше всех курсов);
+    валюта без курсов считается один к одному. Поиск курса идет по первичному ключу 'rates'.
+    """
+    rate = (
+        f"COALESCE("
+        f"(SELECT rate FROM rates WHERE rates.currency = {alias}.currency AND rates.date_iso <= {alias}.date_iso "
+        f"ORDER BY rates.date_iso DESC LIMIT 1), "
+        f"(SELECT rate FROM rates WHERE rates.currency = {alias}.currency ORDER BY rates.date_iso LIMIT 1), 1)"
+    )
+    return (
+        f"(CASE WHEN {alias}.currency IS NULL THEN {alias}.summ "
+        f"ELSE CAST(ROUND({alias}.summ * {rate}) AS INTEGER) END)"
+    )
+
+
+def get_rates_path() -> str:
+    """Файл курсов из config.RATES_FILE (по умолчанию rates.csv рядом с ботом)."""
+    return getattr(config, "RATES_FILE", "rates.csv")
+
+
+def load_rates_file(path: Optional[str] = None) -> List[RateRow]:
+    """
+    Читает курсы из CSV-файла со строками "ГГГГ-ММ-ДД,ВАЛЮТА,курс".
+    Строки с ошибками и комментарии (#) пропускаются. Нет файла - нет курсов.
+    """
+    path = path or get_rates_path()
+    if not os.path.exists(path):
+        logger.info("Файл курсов %s не найден, суммы в валюте не пересчитываются.", path)
+        return []
+
+    rows: List[RateRow] = []
+    with open(path, encoding="utf-8", newline="") as file:
+        for line_number, line in enumerate(csv.reader(file), start=1):
+            if not line or line[0].strip().startswith("#"):
+                continue
+            try:
+                day, currency, rate = (value.strip() for value in line)
+                rows.append((currency.upper(), date.fromisoformat(day).isoformat(), float(rate)))
+            except ValueError:
+                logger.warning("Файл курсов %s, строка %d пропущена: %s", path, line_number, line)
+    logger.info("Загружено %d курсов из %s.", len(rows), path)
+    return rows
+
+
+class RateCache:
+    """Курсы в памяти: по каждой валюте даты по возрастанию и курсы, курс на дату ищется бисекцией."""
+    __slots__ = ("_dates", "_rates")
+
+    def __init__(self, rows: Iterable[RateRow] = ()):
+        self._dates: Dict[str, List[str]] = {}
+        self._rates: Dict[str, List[float]] = {}
+        for currency, date_iso, rate in sorted(rows):
+            dates = self._dates.setdefault(currency, [])
+            rates = self._rates.setdefault(currency, [])
+            # Повторная дата в файле заменяет курс.
+            if dates and dates[-1] == date_iso:
+                rates[-1] = rate
+            else:
+                dates.append(date_iso)
+                rates.append(rate)
+
+    def currencies(self) -> Set[str]:
+        return set(self._dates)
+
+    def rows(self) -> List[RateRow]:
+        """Все курсы для записи в таблицу 'rates'."""
+        return [
+            (currency, date_iso, rate)
+            for currency, dates in self._dates.items()
+            for date_iso, rate in zip(dates, self._rates[currency])
+        ]
+
+    def rate_on(self, currency: str, date_iso: str) -> Optional[float]:
+        """Курс на дату (как в base_summ_sql) или None, если курсов валюты нет."""
+        dates = self._dates.get(currency)
+        if not dates:
+            return None
+        return self._rates[currency][max(bisect_right(dates, date_iso) - 1, 0)]
+
+    def convert(self, summ: int, currency: Optional[str], date_iso: str) -> int:
+        """Сумма в базовой валюте, округленная так же, как ROUND в SQLite."""
+        if currency is None or currency == BASE_CURRENCY:
+            return summ
+        rate = self.rate_on(currency, date_iso)
+        if rate is None:
+            return summ
+        return math.floor(summ * rate + 0.5)
+
+
+# Курсы процесса.
+_rate_cache: Optional[RateCache] = None
+
+
+def get_rate_cache() -> RateCache:
+    """Курсы из файла (читается при первом обращении)."""
+    global _rate_cache
+    if _rate_cache is None:
+        _rate_cache = RateCache(load_rates_file())
+    return _rate_cache
+
+
+def set_rate_cache(cache: Optional[RateCache]):
+    """Подменяет курсы процесса (None - перечитать файл при следующем обращении)."""
+    global _rate_cache
+    _rate_cache = cache
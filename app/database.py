@@ -1,38 +1,49 @@
 
-import sqlite3
+import os
+import asyncio
 import logging
-from typing import Optional, AsyncGenerator
+from typing import Optional, AsyncContextManager, AsyncGenerator, Awaitable, Callable, Dict, List, TypeVar
 from contextlib import asynccontextmanager
 
 import aiosqlite
 
-import config
+from app.migrations import run_migrations
+from app.sharding import shard_for_user, shard_path, archive_path, all_shards
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+# Блокировки записи по шардам: записи в один файл идут по очереди внутри процесса,
+# записи в разные шарды не ждут друг друга.
+_shard_write_locks: Dict[int, asyncio.Lock] = {}
+
 
 # """Модуль для создания соединения с БД"""
 @asynccontextmanager
-async def get_async_sqlite_session() -> AsyncGenerator[aiosqlite.Connection, None]:
+async def get_async_sqlite_session(user_tg_id: Optional[int] = None,
+                                   shard: Optional[int] = None) -> AsyncGenerator[aiosqlite.Connection, None]:
     """
     Асинхронный контекстный менеджер для соединения с БД.
     Гарантирует, что соединение будет закрыто.
+    Файл БД выбирается по шарду пользователя (user_tg_id) или явно по номеру шарда.
+    Без аргументов используется шард 0 (при одном шарде это config.DATABASE_NAME).
     """
+    if shard is None:
+        shard = shard_for_user(user_tg_id) if user_tg_id is not None else 0
     connection = None
     try:
         # Создаем асинхронное соединение с базой данных
         # Если здесь ошибка, исключение будет поднято,
         # yield connection не выполнится, блок 'async with' не запустится.
-        connection = await aiosqlite.connect(config.DATABASE_NAME)
+        connection = await aiosqlite.connect(shard_path(shard))
         # Устанавливаем row_factory для вывода данных в виде словаря
         connection.row_factory = aiosqlite.Row
         logger.debug("Асинхронное соединение с БД установлено.")
         yield connection # Возвращаем соединение для использования в блоке 'async with'
     # Если исключение возникло до yield, finally все равно выполнится
     except Exception as e:
-        logger.error(f"Ошибка асинхронного соединения с БД: {e}")
+        logger.error("Ошибка асинхронного соединения с БД: %s", e)
         raise  # Переподнимаем исключение, чтобы вызывающий код мог его обработать
         # yield None
     finally:
@@ -41,27 +52,57 @@ async def get_async_sqlite_session() -> AsyncGenerator[aiosqlite.Connection, Non
             logger.debug("Асинхронное соединение с БД закрыто.")
 
 
+def get_shard_write_lock(user_tg_id: Optional[int] = None, shard: Optional[int] = None) -> asyncio.Lock:
+    """Блокировка записи для шарда, в котором хранятся данные пользователя (или для шарда по номеру)."""
+    if shard is None:
+        shard = shard_for_user(user_tg_id) if user_tg_id is not None else 0
+    lock = _shard_write_locks.get(shard)
+    if lock is None:
+        lock = _shard_write_locks[shard] = asyncio.Lock()
+    return lock
+
+
+async def wait_for_writes():
+    """Дожидается записей, начатых во всех шардах (по очереди занимает блокировки записи)."""
+    for lock in list(_shard_write_locks.values()):
+        async with lock:
+            pass
+
+
+async def fan_out(func: Callable[..., Awaitable[T]], *args,
+                  session_factory: Optional[Callable[..., AsyncContextManager[aiosqlite.Connection]]] = None,
+                  **kwargs) -> List[T]:
+    """
+    Выполняет func(connection, shard, *args, **kwargs) параллельно на всех шардах.
+    Используется для запросов по всем пользователям (администрирование, статистика).
+    :param session_factory: Фабрика соединений, по умолчанию get_async_sqlite_session.
+    :return: Список результатов в порядке номеров шардов.
+    """
+    factory = session_factory or get_async_sqlite_session
+
+    async def run_on_shard(shard: int) -> T:
+        async with factory(shard=shard) as connection:
+            return await func(connection, shard, *args, **kwargs)
+
+    return list(await asyncio.gather(*(run_on_shard(shard) for shard in all_shards())))
+
+
 async def update_tables():
     """
-    Асинхронное создание таблиц, если они не существуют,
-    с использованием контекстного менеджера.
+    Асинхронное приведение схемы всех шардов БД к актуальной версии
+    с использованием контекстного менеджера и миграций из app.migrations.
+    Ошибка миграции прерывает запуск: бот не должен работать с наполовину обновленной схемой.
     """
-    try:
-        async with get_async_sqlite_session() as connection:
-            # Асинхронное выполнение SQL-запроса
-            await connection.execute("""
-                CREATE TABLE IF NOT EXISTS "out" (
-                    rowid INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_tg_id INTEGER NOT NULL,
-                    category TEXT,
-                    sub_category TEXT,
-                    summ INTEGER,
-                    description TEXT,
-                    date TEXT
-                );
-            """)
-            logger.info("Таблица 'out' проверена/создана.")
-            # Асинхронный commit
-            await connection.commit()
-    except Exception as e:
-        logger.error(f"Ошибка при создании таблиц: {e}")
+    for shard in all_shards():
+        try:
+            async with get_async_sqlite_session(shard=shard) as connection:
+                version = await run_migrations(connection)
+                logger.info("Схема БД %s проверена/обновлена, версия %d.", shard_path(shard), version)
+            # Архив закрытых лет (app.archive) должен иметь ту же схему, что и основная БД.
+            if os.path.exists(archive_path(shard)):
+                async with aiosqlite.connect(archive_path(shard)) as connection:
+                    version = await run_migrations(connection)
+                    logger.info("Схема архива %s проверена/обновлена, версия %d.", archive_path(shard), version)
+        except Exception as e:
+            logger.error("Ошибка при обновлении схемы БД %s: %s", shard_path(shard), e, exc_info=True)
+            raise
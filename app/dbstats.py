@@ -0,0 +1,202 @@
+import re
+import time
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncContextManager, AsyncIterator, Callable, Deque, Dict, Iterable, List, Optional
+
+import aiosqlite
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# """
+# Учет SQL-запросов хранилища: время выполнения, число строк и ожидание соединения.
+# Все запросы SQLiteStorage выполняются через execute/execute_many/fetch_all/iterate этого модуля.
+# Статистика хранится в памяти процесса по имени запроса (имя константы SQL_* в SQLiteStorage).
+# """
+
+# Сколько последних выполнений запроса учитывается в среднем и p95.
+ROLLING_WINDOW = 1000
+
+# Ожидание соединения/блокировки записи, еще не отнесенное к запросу.
+# Относится к первому запросу, выполненному после получения соединения.
+_pending_wait: ContextVar[float] = ContextVar("pending_wait", default=0.0)
+
+# Даты в параметрах не скрываются: по ним видно, за какой период был медленный запрос.
+_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+class StatementStats:
+    """Статистика одного запроса: накопленные итоги и окно последних выполнений."""
+    __slots__ = ("name", "calls", "total_time", "total_rows", "total_wait", "max_time", "recent")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.total_time = 0.0       # сек.
+        self.total_rows = 0
+        self.total_wait = 0.0       # сек.
+        self.max_time = 0.0
+        self.recent: Deque[float] = deque(maxlen=ROLLING_WINDOW)
+
+    def add(self, duration: float, rows: int, wait: float):
+        self.calls += 1
+        self.total_time += duration
+        self.total_rows += rows
+        self.total_wait += wait
+        self.max_time = max(self.max_time, duration)
+        self.recent.append(duration)
+
+    def percentile(self, percent: float) -> float:
+        """Процентиль времени выполнения (сек.) по окну последних выполнений."""
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+_stats: Dict[str, StatementStats] = {}
+
+
+def get_slow_query_threshold() -> float:
+    """Порог медленного запроса в секундах из config.SLOW_QUERY_MS (по умолчанию 100 мс)."""
+    return getattr(config, "SLOW_QUERY_MS", 100) / 1000
+
+
+def redact_params(params: Any) -> Any:
+    """
+    Параметры запроса для лога без данных пользователя:
+    числа и строки заменяются типом (строки - с длиной), даты ГГГГ-ММ-ДД остаются.
+    """
+    def redact(value):
+        if value is None:
+            return None
+        if isinstance(value, str):
+            return value if _DATE_RE.match(value) else f"<str:{len(value)}>"
+        return f"<{type(value).__name__}>"
+
+    if isinstance(params, dict):
+        return {key: redact(value) for key, value in params.items()}
+    return [redact(value) for value in params]
+
+
+def record(name: str, duration: float, rows: int, params: Any = ()):
+    """Учитывает выполнение запроса name и пишет в лог медленные запросы."""
+    wait = _pending_wait.get()
+    _pending_wait.set(0.0)
+
+    stats = _stats.get(name)
+    if stats is None:
+        stats = _stats[name] = StatementStats(name)
+    stats.add(duration, rows, wait)
+
+    if duration >= get_slow_query_threshold():
+        logger.warning(
+            "Медленный запрос %s: %.1f мс, строк %d, ожидание соединения %.1f мс, параметры %s",
+            name, duration * 1000, rows, wait * 1000, redact_params(params)
+        )
+
+
+@asynccontextmanager
+async def track_wait(context: AsyncContextManager):
+    """
+    Входит в context (соединение, блокировка записи) и запоминает время ожидания входа.
+    Оно учитывается в статистике следующего запроса.
+    """
+    started = time.perf_counter()
+    async with context as value:
+        _pending_wait.set(_pending_wait.get() + time.perf_counter() - started)
+        yield value
+
+
+async def execute(connection: aiosqlite.Connection, name: str, sql: str, params: Any = ()) -> aiosqlite.Cursor:
+    """
+    Выполняет изменяющий запрос. Строками считается rowcount.
+    Курсор (для lastrowid/rowcount) закрывает вызывающий код.
+    """
+    started = time.perf_counter()
+    cursor = await connection.execute(sql, params)
+    record(name, time.perf_counter() - started, max(cursor.rowcount, 0), params)
+    return cursor
+
+
+async def execute_many(connection: aiosqlite.Connection, name: str, sql: str,
+                       seq_of_params: Iterable[Any]) -> aiosqlite.Cursor:
+    """Пакетное выполнение (executemany). В лог медленных запросов попадает только число пакетов."""
+    seq_of_params = list(seq_of_params)
+    started = time.perf_counter()
+    cursor = await connection.executemany(sql, seq_of_params)
+    record(name, time.perf_counter() - started, max(cursor.rowcount, 0), [f"<{len(seq_of_params)} rows>"])
+    return cursor
+
+
+async def fetch_all(connection: aiosqlite.Connection, name: str, sql: str, params: Any = ()) -> List[Any]:
+    """Выполняет запрос и возвращает все строки. Время включает чтение строк."""
+    started = time.perf_counter()
+    cursor = await connection.execute(sql, params)
+    try:
+        rows = await cursor.fetchall()
+    finally:
+        await cursor.close()
+    record(name, time.perf_counter() - started, len(rows), params)
+    return rows
+
+
+async def iterate(connection: aiosqlite.Connection, name: str, sql: str, params: Any = (), chunk_size: int = 500,
+                  row_factory: Optional[Callable[[tuple], Any]] = None) -> AsyncIterator[Any]:
+    """
+    Выполняет запрос и отдает строки по одной, читая их пачками fetchmany(chunk_size).
+    row_factory(кортеж значений) строит запись вместо aiosqlite.Row.
+    Учитывается только время в SQLite, без времени обработки строк вызывающим кодом.
+    """
+    started = time.perf_counter()
+    cursor = await connection.execute(sql, params)
+    if row_factory is not None:
+        cursor.row_factory = lambda _, row: row_factory(row)
+    elapsed = time.perf_counter() - started
+    rows = 0
+    try:
+        while True:
+            started = time.perf_counter()
+            chunk = await cursor.fetchmany(chunk_size)
+            elapsed += time.perf_counter() - started
+            if not chunk:
+                break
+            rows += len(chunk)
+            for row in chunk:
+                yield row
+    finally:
+        await cursor.close()
+        record(name, elapsed, rows, params)
+
+
+def get_stats(limit: Optional[int] = None) -> List[StatementStats]:
+    """Статистика запросов по убыванию суммарного времени."""
+    ordered = sorted(_stats.values(), key=lambda stats: stats.total_time, reverse=True)
+    return ordered[:limit] if limit else ordered
+
+
+def reset_stats():
+    """Сбрасывает накопленную статистику."""
+    _stats.clear()
+
+
+def format_stats(limit: int = 10) -> str:
+    """Текст для команды /dbstats: самые затратные запросы по суммарному времени."""
+    top = get_stats(limit)
+    if not top:
+        return "Статистика запросов пока пуста."
+
+    text = f"📊 Запросы к БД (топ {len(top)} по суммарному времени):\n\n"
+    for stats in top:
+        text += (
+            f"{stats.name}\n"
+            f"    вызовов: {stats.calls}, всего: {stats.total_time * 1000:.1f} мс, "
+            f"сред.: {stats.total_time / stats.calls * 1000:.2f} мс\n"
+            f"    p95: {stats.percentile(95) * 1000:.2f} мс, макс.: {stats.max_time * 1000:.2f} мс, "
+            f"строк: {stats.total_rows}, ожидание соединения: {stats.total_wait * 1000:.1f} мс\n"
+        )
+    return text
@@ -0,0 +1,132 @@
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import Message
+
+import config
+from app.logging_setup import SAMPLED
+from app.storage import Storage, StorageError, get_storage
+
+logger = logging.getLogger(__name__)
+
+# """
+# Защита от повторной доставки сообщений.
+# После сбоев сети или перезапуска Telegram может прислать то же сообщение еще раз,
+# и расход записался бы дважды. Ключ сообщения (chat_id, message_id) запоминается
+# в LRU-кэше в памяти и в таблице processed_updates (переживает перезапуск).
+# В таблицу ключ пишется только после успешной обработки: если обработчик упал
+# (или бот остановился до записи), повторная доставка запишет расход.
+# Ключи старше DEDUPE_TTL удаляются фоновой задачей: Telegram хранит неподтвержденные обновления сутки.
+# """
+
+MessageKey = Tuple[int, int]
+
+
+def get_dedupe_ttl() -> int:
+    """Срок хранения ключей в секундах из config.DEDUPE_TTL (по умолчанию двое суток)."""
+    return getattr(config, "DEDUPE_TTL", 2 * 24 * 60 * 60)
+
+
+class UpdateDeduplicator:
+    """
+    Проверка "сообщение еще не обрабатывалось": сначала LRU в памяти, при промахе - ключ в хранилище.
+    Ключ в хранилище записывается после обработки (complete); одновременный повтор в этом процессе
+    отклоняет LRU, в другом процессе - первичный ключ таблицы.
+    """
+
+    def __init__(self, storage: Optional[Storage] = None, cache_size: Optional[int] = None):
+        # Если хранилище не передано, используется текущее (app.storage.get_storage).
+        self._storage = storage
+        self._cache_size = cache_size or getattr(config, "DEDUPE_CACHE_SIZE", 10000)
+        self._recent: "OrderedDict[MessageKey, None]" = OrderedDict()
+
+    def _remember(self, key: MessageKey):
+        self._recent[key] = None
+        self._recent.move_to_end(key)
+        if len(self._recent) > self._cache_size:
+            self._recent.popitem(last=False)
+
+    async def claim(self, chat_id: int, message_id: int) -> bool:
+        """
+        Отмечает сообщение как обрабатываемое (только в памяти, до complete или release).
+        :return: True - сообщение новое, False - повторная доставка.
+        """
+        key = (chat_id, message_id)
+        if key in self._recent:
+            self._recent.move_to_end(key)
+            return False
+        # Ключ попадает в LRU до обращения к БД: одновременный повтор отклоняется без второй проверки.
+        self._remember(key)
+        storage = self._storage or get_storage()
+        try:
+            return not await storage.is_processed(chat_id, message_id)
+        except Exception:
+            self._recent.pop(key, None)
+            raise
+
+    async def complete(self, chat_id: int, message_id: int):
+        """Записывает ключ успешно обработанного сообщения в хранилище: повтор после перезапуска отклоняется."""
+        storage = self._storage or get_storage()
+        if not await storage.mark_processed(chat_id, message_id, int(time.time())):
+            logger.warning("Сообщение %s в чате %s уже обработано другим процессом.", message_id, chat_id)
+
+    def clear(self):
+        """
+        Забывает ключи в памяти (таблица processed_updates не меняется), например перед повторным
+        прогоном нагрузочного теста (app.loadtest) с теми же сообщениями на новом хранилище.
+        """
+        self._recent.clear()
+
+    def release(self, chat_id: int, message_id: int):
+        """Забывает сообщение, обработка которого не удалась: повторная доставка обработает его снова."""
+        self._recent.pop((chat_id, message_id), None)
+
+
+class DedupeMiddleware(BaseMiddleware):
+    """
+    Внешний middleware сообщений: повторно доставленные сообщения не передаются обработчикам.
+    Сообщения пользователей не из config.USERS не запоминаются: обработчики их только логируют.
+    """
+
+    def __init__(self, deduplicator: UpdateDeduplicator):
+        self.deduplicator = deduplicator
+
+    async def __call__(self, handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]], event: Message,
+                       data: Dict[str, Any]) -> Any:
+        if event.from_user is None or event.from_user.id not in config.USERS:
+            return await handler(event, data)
+        if not await self.deduplicator.claim(event.chat.id, event.message_id):
+            logger.info("Повторная доставка сообщения %s в чате %s пропущена.", event.message_id, event.chat.id,
+                        extra=SAMPLED)
+            return None
+        try:
+            result = await handler(event, data)
+        except Exception:
+            self.deduplicator.release(event.chat.id, event.message_id)
+            raise
+        try:
+            await self.deduplicator.complete(event.chat.id, event.message_id)
+        except StorageError:
+            # Расход уже записан: ошибку записи ключа не показываем пользователю (она в логе).
+            # Повтор в этом процессе отклонит LRU.
+            pass
+        return result
+
+
+async def dedupe_expiry_worker(storage: Storage, interval: Optional[float] = None):
+    """
+    Фоновая задача: периодически удаляет ключи старше config.DEDUPE_TTL.
+    Интервал в секундах - config.DEDUPE_EXPIRY_INTERVAL (по умолчанию раз в час).
+    """
+    interval = interval or getattr(config, "DEDUPE_EXPIRY_INTERVAL", 60 * 60)
+    while True:
+        try:
+            expired = await storage.expire_processed(int(time.time()) - get_dedupe_ttl())
+            logger.info("Удалено %d устаревших ключей обработанных сообщений.", expired)
+        except Exception as ex:
+            logger.error("Ошибка удаления устаревших ключей сообщений: %s", ex, exc_info=True)
+        await asyncio.sleep(interval)
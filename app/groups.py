@@ -0,0 +1,81 @@
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import config
+from app.periods import Period
+
+logger = logging.getLogger(__name__)
+
+# """
+# Общие группы учета (семья): отчет по записям всех участников группы.
+# Состав групп задается в config.GROUPS ({"Семья": [id1, id2]}) и при старте копируется
+# в таблицу group_members каждого шарда (Storage.sync_groups), чтобы записи участников
+# выбирались одним запросом по индексу (user_tg_id, date_iso).
+# Итоги группы за месяц кэшируются (crud.get_group_totals): версия данных группы - сумма версий участников,
+# поэтому повторный отчет группы без новых записей не обращается к БД.
+# """
+
+
+def get_groups() -> Dict[str, List[int]]:
+    """Группы из config.GROUPS: {название: [user_tg_id участников]}."""
+    return getattr(config, "GROUPS", {})
+
+
+def find_group(user_tg_id: int, name: str) -> Optional[str]:
+    """Название группы пользователя по введенному слову (без учета регистра) или None."""
+    key = name.strip().casefold()
+    for group, members in get_groups().items():
+        if group.casefold() == key and user_tg_id in members:
+            return group
+    return None
+
+
+def member_name(user_tg_id: int) -> str:
+    """Имя участника для отчета из config.USER_NAMES ({user_tg_id: имя}), по умолчанию ид."""
+    return getattr(config, "USER_NAMES", {}).get(user_tg_id, str(user_tg_id))
+
+
+class GroupTotals:
+    """Итоги группы за период (в копейках базовой валюты): по участникам, категориям и дням."""
+    __slots__ = ("members", "categories", "daily", "count")
+
+    def __init__(self):
+        self.members: Dict[int, int] = {}
+        self.categories: Dict[str, int] = {}
+        self.daily: Dict[str, int] = {}
+        self.count = 0
+
+    def add(self, user_tg_id: int, category: str, date: str, summ: int, count: int):
+        self.members[user_tg_id] = self.members.get(user_tg_id, 0) + summ
+        self.categories[category] = self.categories.get(category, 0) + summ
+        self.daily[date] = self.daily.get(date, 0) + summ
+        self.count += count
+
+    @property
+    def total(self) -> int:
+        return sum(self.members.values())
+
+
+class GroupTotalsCache:
+    """Итоги групп по периодам. Запись актуальна, пока не изменилась версия данных группы."""
+
+    def __init__(self):
+        self._totals: Dict[Tuple[str, str], Tuple[int, GroupTotals]] = {}
+
+    def get(self, group: str, period: Period, version: int) -> Optional[GroupTotals]:
+        cached = self._totals.get((group, period.start))
+        if cached is None or cached[0] != version:
+            return None
+        return cached[1]
+
+    def put(self, group: str, period: Period, version: int, totals: GroupTotals):
+        self._totals[(group, period.start)] = (version, totals)
+
+    def clear(self):
+        """Сбрасывает все итоги."""
+        self._totals.clear()
+
+
+# Итоги групп процесса.
+group_totals = GroupTotalsCache()
+
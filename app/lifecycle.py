@@ -0,0 +1,171 @@
+import os
+import time
+import asyncio
+import logging
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Coroutine, Dict, Optional, Set
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# """
+# Запуск и остановка процесса бота.
+# Бот создается при запуске (create_bot), а не при импорте модуля. Хуки startup/shutdown
+# регистрируются в Dispatcher (Lifecycle.setup): при старте - схема БД, фоновые задачи и отложенный
+# прогрев кэшей, при остановке - дожидаемся обработчиков и записей в БД, затем освобождаем ресурсы.
+# Время каждого этапа и время от запуска процесса до первого обновления пишутся в лог.
+# """
+
+# Момент запуска процесса (первый импорт модуля) для замера времени до первого обновления.
+PROCESS_STARTED = time.perf_counter()
+
+
+def get_shutdown_timeout() -> float:
+    """Сколько секунд ждать незавершенные обработчики при остановке, из config.SHUTDOWN_TIMEOUT (по умолчанию 30)."""
+    return getattr(config, "SHUTDOWN_TIMEOUT", 30)
+
+
+def create_bot() -> Bot:
+    """Бот с токеном из переменной окружения BOT_TOKEN (или файла .env)."""
+    # Импорт здесь: python-dotenv нужен только при запуске бота, не при импорте обработчиков.
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    return Bot(token=os.getenv("BOT_TOKEN"))
+
+
+@contextmanager
+def timed(stage: str):
+    """Пишет в лог длительность этапа запуска или остановки."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        logger.info("%s: %.3f сек.", stage, time.perf_counter() - started)
+
+
+class Lifecycle:
+    """Этапы запуска и остановки бота и учет обновлений, которые обрабатываются прямо сейчас."""
+
+    def __init__(self):
+        self.first_update_at: Optional[float] = None
+        self._in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        # Ссылки на фоновые задачи, чтобы их не удалил сборщик мусора и чтобы остановить их при выходе.
+        self._background_tasks: Set[asyncio.Task] = set()
+
+    def setup(self, dp: Dispatcher):
+        """Регистрирует учет обновлений и хуки запуска и остановки в диспетчере."""
+        dp.update.outer_middleware(self.track_update)
+        dp.startup.register(self.on_startup)
+        dp.shutdown.register(self.on_shutdown)
+
+    @property
+    def in_flight(self) -> int:
+        """Количество обновлений в обработке."""
+        return self._in_flight
+
+    async def track_update(self, handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]], event: Update,
+                           data: Dict[str, Any]) -> Any:
+        """Внешний middleware обновлений: считает обработчики в работе и замеряет время до первого обновления."""
+        if self.first_update_at is None:
+            self.first_update_at = time.perf_counter()
+            logger.info("Первое обновление через %.3f сек. после запуска процесса.",
+                        self.first_update_at - PROCESS_STARTED)
+        self._in_flight += 1
+        self._idle.clear()
+        try:
+            return await handler(event, data)
+        finally:
+            self._in_flight -= 1
+            if not self._in_flight:
+                self._idle.set()
+
+    async def wait_idle(self, timeout: float) -> bool:
+        """Ждет завершения обработчиков. :return: False, если за timeout секунд они не завершились."""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def start_background(self, job: Coroutine[Any, Any, None]):
+        task = asyncio.create_task(job)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    async def on_startup(self, bot: Bot):
+        """
+        Хук запуска: до приема обновлений выполняется только необходимое (схема БД, вебхук),
+        фоновые задачи и прогрев кэшей запускаются отдельно и первое обновление не задерживают.
+        """
+        # Импорт здесь: хранилище и фоновые задачи нужны только работающему боту.
+        from app.dedupe import dedupe_expiry_worker
+        from app.recurring import recurring_worker
+        from app.storage import get_storage
+
+        with timed("Запуск: схема БД, курсы и группы"):
+            # Миграции уже примененных версий пропускаются по PRAGMA user_version.
+            await get_storage().prepare()
+
+        # Фоновое обслуживание хранилища (архивация и т.п.), планировщик регулярных расходов
+        # и удаление устаревших ключей обработанных сообщений.
+        storage = get_storage()
+        for job in [*storage.background_jobs(), recurring_worker(storage), dedupe_expiry_worker(storage)]:
+            self.start_background(job)
+        self.start_background(self.warm_up())
+
+        with timed("Запуск: удаление вебхука"):
+            # Удаляем вебхук, если он был установлен
+            await bot.delete_webhook(drop_pending_updates=True)
+        logger.info("Бот запущен через %.3f сек. после запуска процесса.", time.perf_counter() - PROCESS_STARTED)
+
+    async def warm_up(self):
+        """
+        Отложенный прогрев: сводки за месяц (inline-запросы) и индексы категорий (подсказки)
+        пользователей из config.USERS строятся в фоне, пока бот уже принимает обновления.
+        """
+        from app import crud
+
+        with timed("Прогрев кэшей"):
+            for user_tg_id in config.USERS:
+                try:
+                    await crud.get_month_summary(user_tg_id)
+                    await crud.get_category_index(user_tg_id)
+                except Exception as ex:
+                    logger.error("Ошибка прогрева кэшей пользователя %s: %s", user_tg_id, ex, exc_info=True)
+
+    async def on_shutdown(self):
+        """
+        Хук остановки (поллинг уже остановлен): дожидаемся обработчиков, останавливаем фоновые задачи,
+        дожидаемся записей в БД и освобождаем ресурсы.
+        """
+        from app.charts import get_chart_renderer
+        from app.storage import get_storage
+
+        started = time.perf_counter()
+        logger.info("Поллинг остановлен, обновлений в обработке: %d.", self._in_flight)
+
+        with timed("Остановка: завершение обработчиков"):
+            if not await self.wait_idle(get_shutdown_timeout()):
+                logger.warning("Обработчики не завершились за %s сек.: %d в обработке.",
+                               get_shutdown_timeout(), self._in_flight)
+
+        with timed("Остановка: фоновые задачи"):
+            tasks = list(self._background_tasks)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        with timed("Остановка: записи в БД и соединения"):
+            await get_storage().close()
+
+        with timed("Остановка: пул графиков"):
+            get_chart_renderer().shutdown()
+
+        logger.info("Бот остановлен за %.3f сек.", time.perf_counter() - started)
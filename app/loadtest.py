@@ -0,0 +1,230 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import argparse
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import TelegramMethod, SendMessage
+from aiogram.types import Chat, Message, Update
+
+import config
+from app.logging_setup import setup_logging
+
+logger = logging.getLogger(__name__)
+
+# """
+# Нагрузочный тест бота: синтетические Update подаются в dp.feed_update,
+# исходящие запросы к Telegram перехватываются заглушкой без сети.
+#
+# Пример: python -m app.loadtest --updates 5000 --concurrency 50 --db loadtest.db
+# """
+
+# Токен-заглушка для Bot теста: aiogram проверяет формат токена, запросы в сеть не уходят (RecordingSession).
+LOADTEST_TOKEN = "42:LOADTEST"
+
+# Сообщения о расходах для генерации нагрузки.
+EXPENSE_TEMPLATES = (
+    "{summ} Еда Обед",
+    "{summ} Продукты Магазин молоко хлеб",
+    "Кофе Завтрак {summ}",
+    "{summ} Транспорт Метро",
+    "{summ} Развлечения Кино",
+)
+
+
+class RecordingSession(BaseSession):
+    """
+    Сессия Bot без сети: запоминает исходящие методы и возвращает правдоподобный ответ.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.calls: List[TelegramMethod] = []
+        self._message_id = 0
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: Optional[int] = None) -> Any:
+        self.calls.append(method)
+        if isinstance(method, SendMessage):
+            self._message_id += 1
+            return Message(
+                message_id=self._message_id,
+                date=datetime.now(),
+                chat=Chat(id=method.chat_id, type="private"),
+                text=method.text,
+            )
+        return True
+
+    async def stream_content(self, url: str, headers: Optional[Dict[str, Any]] = None, timeout: int = 30,
+                             chunk_size: int = 65536, raise_for_status: bool = True) -> AsyncGenerator[bytes, None]:
+        yield b""
+
+    async def close(self) -> None:
+        pass
+
+
+@dataclass
+class LoadTestResult:
+    """Итоги нагрузочного теста. Задержки в миллисекундах."""
+    updates: int
+    concurrency: int
+    elapsed: float
+    errors: int
+    outgoing_calls: int
+    latencies_ms: List[float] = field(repr=False, default_factory=list)
+
+    @property
+    def throughput(self) -> float:
+        """Обработанных обновлений в секунду."""
+        return self.updates / self.elapsed if self.elapsed else 0.0
+
+    def percentile(self, percent: float) -> float:
+        """Перцентиль задержки по методу ближайшего ранга."""
+        if not self.latencies_ms:
+            return 0.0
+        ordered = sorted(self.latencies_ms)
+        rank = max(1, round(percent / 100 * len(ordered)))
+        return ordered[min(rank, len(ordered)) - 1]
+
+    def summary(self) -> str:
+        return (
+            f"Обновлений: {self.updates}, параллельность: {self.concurrency}, ошибок: {self.errors}\n"
+            f"Время: {self.elapsed:.2f} сек., пропускная способность: {self.throughput:.1f} обновл./сек.\n"
+            f"Задержка p50/p95/p99: {self.percentile(50):.1f} / {self.percentile(95):.1f} / "
+            f"{self.percentile(99):.1f} мс\n"
+            f"Исходящих запросов к Telegram: {self.outgoing_calls}"
+        )
+
+
+def build_updates(count: int, users: List[int], report_ratio: float, seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    Готовит данные синтетических обновлений: сообщения о расходах и команды /report.
+    Возвращает словари, из которых Update создается с привязкой к боту.
+    """
+    rnd = random.Random(seed)
+    now = int(time.time())
+    updates = []
+    for update_id in range(1, count + 1):
+        user_id = rnd.choice(users)
+        if rnd.random() < report_ratio:
+            text = "/report"
+        else:
+            text = rnd.choice(EXPENSE_TEMPLATES).format(summ=rnd.randint(50, 5000))
+        updates.append({
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": now,
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": "Load"},
+                "text": text,
+            },
+        })
+    return updates
+
+
+async def run_load_test(updates: int = 1000, concurrency: int = 20, users: int = 10, report_ratio: float = 0.1,
+                        db_path: Optional[str] = "loadtest.db", storage: str = "sqlite",
+                        seed: int = 0) -> LoadTestResult:
+    """
+    Прогоняет обновления через Dispatcher бота с заданной параллельностью.
+    :param db_path: Файл SQLite для хранилища "sqlite" (пересоздается перед тестом).
+    :param storage: "sqlite" или "memory" (без ввода-вывода).
+    """
+    user_ids = [900000 + i for i in range(users)]
+    # Настройки процесса меняются только на время прогона (тесты и REPL продолжают работать со своими).
+    original_users, original_database = config.USERS, config.DATABASE_NAME
+    config.USERS = user_ids
+
+    # Импорт здесь: диспетчер с обработчиками нужен только при прогоне (Bot создается в app.main.main()).
+    from app.main import deduplicator, dp
+    from app.storage import create_storage, get_storage, set_storage
+    from app.sharding import all_shards, shard_path
+
+    try:
+        if storage == "sqlite":
+            config.DATABASE_NAME = db_path
+            for shard in all_shards():
+                if os.path.exists(shard_path(shard)):
+                    os.remove(shard_path(shard))
+        set_storage(create_storage(storage))
+        # Прогон повторяет те же (chat_id, message_id): ключи прошлого прогона в памяти не должны их отбросить.
+        deduplicator.clear()
+        await get_storage().prepare()
+
+        session = RecordingSession()
+        bot = Bot(token=LOADTEST_TOKEN, session=session)
+        raw_updates = build_updates(updates, user_ids, report_ratio, seed)
+
+        queue: asyncio.Queue = asyncio.Queue()
+        for raw in raw_updates:
+            queue.put_nowait(Update.model_validate(raw, context={"bot": bot}))
+
+        latencies: List[float] = []
+        errors = 0
+
+        async def worker():
+            nonlocal errors
+            while True:
+                try:
+                    update = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                started = time.perf_counter()
+                try:
+                    await dp.feed_update(bot, update)
+                except Exception as ex:
+                    errors += 1
+                    logger.error("Ошибка обработки обновления %s: %s", update.update_id, ex)
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    finally:
+        await get_storage().close()
+        set_storage(None)
+        config.USERS, config.DATABASE_NAME = original_users, original_database
+
+    return LoadTestResult(
+        updates=updates,
+        concurrency=concurrency,
+        elapsed=elapsed,
+        errors=errors,
+        outgoing_calls=len(session.calls),
+        latencies_ms=latencies,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота через Dispatcher.feed_update")
+    parser.add_argument("--updates", type=int, default=1000, help="количество обновлений")
+    parser.add_argument("--concurrency", type=int, default=20, help="одновременно обрабатываемых обновлений")
+    parser.add_argument("--users", type=int, default=10, help="количество синтетических пользователей")
+    parser.add_argument("--report-ratio", type=float, default=0.1, help="доля команд /report")
+    parser.add_argument("--db", default="loadtest.db", help="файл SQLite для теста")
+    parser.add_argument("--storage", choices=("sqlite", "memory"), default="sqlite")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # Логи каждого обновления искажают замер, оставляем только предупреждения.
+    setup_logging(level=logging.WARNING)
+    result = asyncio.run(run_load_test(
+        updates=args.updates,
+        concurrency=args.concurrency,
+        users=args.users,
+        report_ratio=args.report_ratio,
+        db_path=args.db,
+        storage=args.storage,
+        seed=args.seed,
+    ))
+    print(result.summary())
+
+
+if __name__ == "__main__":
+    main()
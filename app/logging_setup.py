@@ -0,0 +1,130 @@
+import sys
+import json
+import queue
+import atexit
+import logging
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional, Tuple
+
+import config
+
+# """
+# Единая настройка логирования процесса.
+# Обработчики на цикле событий только кладут запись в очередь, форматирование в JSON
+# и запись в поток выполняет отдельный поток QueueListener.
+# """
+
+# Пометка для логов, которые пишутся на каждое сообщение пользователя:
+#   logger.info("Запись добавлена для %s", user_id, extra=SAMPLED)
+# Такие записи уровня INFO прореживаются (см. SamplingFilter).
+SAMPLED = {"sampled": True}
+
+# Логгеры, все INFO-записи которых относятся к отдельным обновлениям.
+SAMPLED_LOGGERS: Tuple[str, ...] = ("aiogram.event",)
+
+# Стандартные атрибуты LogRecord; все остальные (из extra) попадают в JSON как поля.
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+_listener: Optional[QueueListener] = None
+_setup_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна строка JSON на запись: время, уровень, логгер, сообщение и поля из extra."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            # Аргументы подставляются здесь, в потоке записи, а не в обработчике сообщения.
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and key != "sampled":
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Пропускает только каждую N-ю INFO-запись из потока сообщений пользователей
+    (помеченную SAMPLED или из SAMPLED_LOGGERS). Счет ведется по шаблону сообщения,
+    поэтому разные события прореживаются независимо. WARNING и выше проходят всегда.
+    """
+
+    def __init__(self, every: int):
+        super().__init__()
+        self.every = max(1, every)
+        self._counters: Dict[Tuple[str, str], int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno != logging.INFO or self.every == 1:
+            return True
+        if not getattr(record, "sampled", False) and not record.name.startswith(SAMPLED_LOGGERS):
+            return True
+        key = (record.name, str(record.msg))
+        count = self._counters.get(key, 0)
+        self._counters[key] = count + 1
+        return count % self.every == 0
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    QueueHandler без форматирования в вызывающем потоке.
+    Стандартный prepare() форматирует сообщение до постановки в очередь, то есть на цикле событий.
+    Очередь внутрипроцессная, поэтому запись можно передать как есть.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def setup_logging(level: Optional[int] = None, stream=None) -> QueueListener:
+    """
+    Настраивает логирование процесса (повторные вызовы ничего не меняют).
+    Уровень - config.LOG_LEVEL (по умолчанию INFO), прореживание -
+    config.LOG_SAMPLE_EVERY (по умолчанию каждая 10-я запись).
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return _listener
+
+        level = level if level is not None else getattr(config, "LOG_LEVEL", logging.INFO)
+        log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+
+        stream_handler = logging.StreamHandler(stream or sys.stderr)
+        stream_handler.setFormatter(JsonFormatter())
+
+        queue_handler = LazyQueueHandler(log_queue)
+        queue_handler.addFilter(SamplingFilter(getattr(config, "LOG_SAMPLE_EVERY", 10)))
+
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        root.addHandler(queue_handler)
+        root.setLevel(level)
+
+        _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+        return _listener
+
+
+def stop_logging():
+    """Останавливает поток записи логов, дописав очередь."""
+    global _listener
+    with _setup_lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            if isinstance(handler, LazyQueueHandler):
+                root.removeHandler(handler)
+        _listener = None
@@ -1,30 +1,36 @@
-import os
 import asyncio
 import logging
-from datetime import datetime
 
-from dotenv import load_dotenv
-from aiogram import Bot, Dispatcher, types
-from aiogram.filters import Command
+from aiogram import Dispatcher, types
+from aiogram.filters import Command, ExceptionTypeFilter
+from aiogram.types import BufferedInputFile, ErrorEvent, InputMediaPhoto
 
 import config
 # import app.crud
 
 from app import crud
-from app.parser import split_message
-from app.report_handler import ReportHandler
-from app.database import get_async_sqlite_session
+from app.currency import get_rate_cache
+from app.dbstats import format_stats
+from app.dedupe import DedupeMiddleware, UpdateDeduplicator
+from app.lifecycle import Lifecycle, create_bot
+from app.logging_setup import SAMPLED, setup_logging, stop_logging
+from app.money import format_money, parse_amount
+from app.parser import split_currency, split_income_message, split_message
+from app.storage import StorageError, get_storage
+from app.suggestions import category_suggestions
+from app.summary import format_summary
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-load_dotenv()
-BOT_API_TOKEN = os.getenv("BOT_TOKEN")
-
-# Инициализация бота и диспетчера
-bot = Bot(token=BOT_API_TOKEN)
+# Инициализация диспетчера. Бот (токен, сессия) создается при запуске в main().
 dp = Dispatcher()
+# Повторно доставленные Telegram сообщения (после сбоя сети или перезапуска) не обрабатываются дважды.
+# Дедупликатор доступен модулю нагрузочного теста: повторный прогон сбрасывает его ключи в памяти.
+deduplicator = UpdateDeduplicator()
+dp.message.outer_middleware(DedupeMiddleware(deduplicator))
+# Хуки запуска и остановки (схема БД, фоновые задачи, завершение обработчиков и записей).
+lifecycle = Lifecycle()
+lifecycle.setup(dp)
 
 
 # Тестовый обработчик команды /start
@@ -34,7 +40,7 @@ async def cmd_start(message: types.Message):
     user_id = message.from_user.id
     # Авторизация
     if user_id in config.USERS:
-        logger.info(f"Запрос от пользователя {user_id}")
+        logger.info("Запрос от пользователя %s", user_id, extra=SAMPLED)
         await message.answer("Привет! Я бот...")
 
 
@@ -44,25 +50,163 @@ async def cmd_report(message: types.Message):
     user_id = message.from_user.id
     # Авторизация
     if user_id in config.USERS:
-        logger.info(f"Запрос от пользователя {user_id}")
+        logger.info("Запрос от пользователя %s", user_id, extra=SAMPLED)
+        # Отчеты и графики (пул процессов) импортируются при первой команде, а не при запуске бота.
+        from app.charts import get_chart_renderer
+        from app.report_handler import ReportHandler
 
-        async with get_async_sqlite_session() as db_conn:
-            if db_conn is None:
-                await message.reply("Не удалось подключиться к базе данных.")
-                return
+        report_handler = ReportHandler(message=message, storage=get_storage())
+        report_result = await report_handler.get_month_report()
 
-            report_handler = ReportHandler(message=message, db_conn=db_conn, crud_func=crud.get_notes_by_user_and_month)
-            report_result = await report_handler.get_month_report()
+        # Графики к отчету рисуются в пуле процессов; если не получилось, остается текстовый отчет.
+        if report_result:
+            images = await get_chart_renderer().render_report(
+                user_id=report_handler.chart_owner,
+                period=(report_handler.current_year, report_handler.month_number),
+                data_version=report_handler.data_version,
+                chart_data=report_handler.get_chart_data()
+            )
+            if images:
+                await message.answer_media_group([
+                    InputMediaPhoto(media=BufferedInputFile(image, filename=f"report_{number}.png"))
+                    for number, image in enumerate(images)
+                ])
 
-            # TODO дописать какую-то реакцию, получен отчет или нет.
-            # await message.reply(report_result)
+        # TODO дописать какую-то реакцию, получен отчет или нет.
+        # await message.reply(report_result)
 
     else: # Добавим проверку доступа, если ее нет
-        logger.info(f"Запрос от не авторизованного пользователя {user_id}")
+        logger.info("Запрос от не авторизованного пользователя %s", user_id, extra=SAMPLED)
         # await message.reply("У вас нет доступа к этой функции.")
         # return
 
 
+@dp.message(Command("compare", "сравнение"))
+async def cmd_compare(message: types.Message):
+    # Узнаем ид пользователя.
+    user_id = message.from_user.id
+    # Авторизация
+    if user_id in config.USERS:
+        logger.info("Запрос сравнения от пользователя %s", user_id, extra=SAMPLED)
+        from app.report_handler import ReportHandler
+        report_handler = ReportHandler(message=message, storage=get_storage())
+        await report_handler.get_compare_report()
+    else:
+        logger.info("Запрос от не авторизованного пользователя %s", user_id, extra=SAMPLED)
+
+
+@dp.message(Command("search", "поиск"))
+async def cmd_search(message: types.Message):
+    # Узнаем ид пользователя.
+    user_id = message.from_user.id
+    # Авторизация
+    if user_id in config.USERS:
+        logger.info("Запрос поиска от пользователя %s", user_id, extra=SAMPLED)
+        from app.search_handler import SearchHandler
+        search_handler = SearchHandler(message=message, storage=get_storage())
+        await search_handler.search()
+    else:
+        logger.info("Запрос от не авторизованного пользователя %s", user_id, extra=SAMPLED)
+
+
+@dp.message(Command("recurring", "регулярные"))
+async def cmd_recurring(message: types.Message):
+    # Узнаем ид пользователя.
+    user_id = message.from_user.id
+    # Авторизация
+    if user_id in config.USERS:
+        logger.info("Запрос регулярных расходов от пользователя %s", user_id, extra=SAMPLED)
+        from app.recurring_handler import RecurringHandler
+        recurring_handler = RecurringHandler(message=message, storage=get_storage())
+        await recurring_handler.handle()
+    else:
+        logger.info("Запрос от не авторизованного пользователя %s", user_id, extra=SAMPLED)
+
+
+@dp.message(Command("balance", "баланс"))
+async def cmd_balance(message: types.Message):
+    # Узнаем ид пользователя.
+    user_id = message.from_user.id
+    # Авторизация
+    if user_id in config.USERS:
+        logger.info("Запрос баланса от пользователя %s", user_id, extra=SAMPLED)
+        balance = await crud.get_balance(user_tg_id=user_id)
+        await message.answer(
+            f"💰 Баланс: {format_money(balance['balance'])} руб.\n\n"
+            f"Доходы: {format_money(balance['income'])} руб.\n"
+            f"Расходы: {format_money(balance['expense'])} руб."
+        )
+    else:
+        logger.info("Запрос от не авторизованного пользователя %s", user_id, extra=SAMPLED)
+
+
+# Inline-запрос "@бот" в любом чате: сводка за текущий месяц.
+# Приходит на каждое нажатие клавиши, поэтому отвечаем из сводки в памяти (crud.get_month_summary),
+# а Telegram кэширует ответ на INLINE_CACHE_TIME секунд.
+@dp.inline_query()
+async def inline_month_summary(inline_query: types.InlineQuery):
+    user_id = inline_query.from_user.id
+    cache_time = getattr(config, "INLINE_CACHE_TIME", 10)
+    if user_id not in config.USERS:
+        logger.info("Inline-запрос от не авторизованного пользователя %s", user_id, extra=SAMPLED)
+        await inline_query.answer([], cache_time=cache_time, is_personal=True)
+        return
+
+    summary = await crud.get_month_summary(user_tg_id=user_id)
+    text = format_summary(summary)
+    top = ", ".join(f"{category} {format_money(summ)}" for category, summ in summary.top_categories())
+    result = types.InlineQueryResultArticle(
+        id=f"summary-{summary.year}-{summary.month}-{summary.count}",
+        title=f"{summary.name}: {format_money(summary.total)} руб.",
+        description=top or "Записей пока нет",
+        input_message_content=types.InputTextMessageContent(message_text=text),
+    )
+    # is_personal: у каждого пользователя своя сводка, кэш Telegram не общий.
+    await inline_query.answer([result], cache_time=cache_time, is_personal=True)
+
+
+# Статистика запросов к БД (только для администраторов из config.ADMINS).
+@dp.message(Command("dbstats"))
+async def cmd_dbstats(message: types.Message):
+    user_id = message.from_user.id
+    if user_id in getattr(config, "ADMINS", ()):
+        logger.info("Запрос статистики БД от администратора %s", user_id)
+        await message.answer(format_stats())
+    else:
+        logger.info("Запрос статистики БД от пользователя без прав %s", user_id, extra=SAMPLED)
+
+
+def category_keyboard(amount: str, categories: list) -> types.ReplyKeyboardMarkup:
+    """Кнопки "<сумма> <категория>": нажатие отправляет готовое сообщение для записи."""
+    return message_keyboard([f"{amount} {category}" for category in categories])
+
+
+def message_keyboard(texts: list) -> types.ReplyKeyboardMarkup:
+    """Кнопки с готовыми сообщениями: нажатие отправляет текст кнопки."""
+    buttons = [types.KeyboardButton(text=text) for text in texts]
+    return types.ReplyKeyboardMarkup(
+        keyboard=[buttons[i:i + 2] for i in range(0, len(buttons), 2)],
+        resize_keyboard=True,
+        one_time_keyboard=True,
+    )
+
+
+def replace_words(text: str, replacements: list) -> str:
+    """
+    Текст сообщения, в котором введенные слова заменены подсказками по порядку:
+    replacements - пары (слово, замена), слово ищется без учета регистра после предыдущего.
+    """
+    words = text.split()
+    start = 0
+    for typed, suggested in replacements:
+        for i in range(start, len(words)):
+            if words[i].casefold() == typed.casefold():
+                words[i] = suggested
+                start = i + 1
+                break
+    return " ".join(words)
+
+
 # Основной обработчик сообщений от пользователя.
 # !!! Функция должна располагаться снизу от других запросов.
 @dp.message()
@@ -71,29 +215,85 @@ async def echo_mess(message: types.Message):
     user_id = message.from_user.id
     # Авторизация
     if user_id in config.USERS:
-        logger.info(f"Запрос от пользователя {user_id}")
+        logger.info("Запрос от пользователя %s", user_id, extra=SAMPLED)
         # TODO написать отдельную функцию после теста
         # 1. Получим сообщение для дальнейшей обработки
         msg = message.text
+        # Доход: "+5000 Зарплата"
+        income_summ, income_cat, income_descr = await split_income_message(msg)
+        if income_summ:
+            await crud.add_income(user_tg_id=user_id, category=income_cat, summ=income_summ, description=income_descr)
+            return
+        # Сумма в валюте: "25eur Кофе"
+        msg, currency = await split_currency(msg)
         summ, cat, sub_cat, descr = await split_message(msg)
         # 2. Передадим на запись
-        if summ:
-            await crud.add_note(user_tg_id=user_id, category=cat, sub_category=sub_cat, summ=summ, description=descr)
+        if summ and currency and currency not in get_rate_cache().currencies():
+            logger.info("Нет курса валюты %s", currency, extra=SAMPLED)
+            await message.answer(f"Нет курса валюты {currency}, запись не сохранена.")
+        elif summ:
+            # Написание приводится к уже известным категориям пользователя (индекс в памяти) только
+            # при точном совпадении. Префикс или опечатка не записываются: предложим кнопками исправленное
+            # сообщение и сообщение как есть (повтор того же сообщения записывается без вопроса).
+            text = message.text.strip()
+            as_typed = category_suggestions.confirmed(user_id, text)
+            categories = await crud.get_category_index(user_id)
+            category = categories.exact(cat) or cat
+            sub_category = category if sub_cat == cat else categories.exact_sub(category, sub_cat) or sub_cat
+            suggested = categories.resolve(cat) or category
+            suggested_sub = suggested if sub_cat == cat else categories.resolve_sub(suggested, sub_cat) or sub_cat
+            if not as_typed and (suggested, suggested_sub) != (category, sub_category):
+                replacements = [(cat, suggested)] if sub_cat == cat else [(cat, suggested), (sub_cat, suggested_sub)]
+                logger.info("Предложена категория %s вместо %s", suggested, cat, extra=SAMPLED)
+                category_suggestions.ask(user_id, text)
+                await message.answer(f"Записать в категорию {suggested}? Чтобы оставить {category}, "
+                                     f"отправьте сообщение как есть.",
+                                     reply_markup=message_keyboard([replace_words(text, replacements), text]))
+                return
+            await crud.add_note(user_tg_id=user_id, category=category, sub_category=sub_category, summ=summ,
+                                description=descr, currency=currency)
+            if category != cat:
+                await message.answer(f"Записано в категорию {category}")
+        elif parse_amount(msg.strip()) is not None:
+            # Только сумма: предложим частые категории кнопками.
+            categories = (await crud.get_category_index(user_id)).top(getattr(config, "SUGGESTION_BUTTONS", 6))
+            if categories:
+                await message.answer("Выберите категорию:",
+                                     reply_markup=category_keyboard(message.text.strip(), categories))
+            else:
+                await message.answer(f"Укажите категорию: {message.text.strip()} Еда")
         else:
-            logger.info(f"Сообщение не для записи: {msg}")
-            await message.answer(f"Сообщение не для записи: {msg}")
+            logger.info("Сообщение не для записи: %s", message.text, extra=SAMPLED)
+            await message.answer(f"Сообщение не для записи: {message.text}")
     else:
-        logger.info(f"Запрос от неавторизованного пользователя {user_id}")
+        logger.info("Запрос от неавторизованного пользователя %s", user_id, extra=SAMPLED)
+
+
+# Ошибка хранилища в любом обработчике (app.storage.StorageError): ошибка уже записана в лог,
+# пользователю отвечаем, что запрос не выполнен, вместо пустого отчета или молча потерянной записи.
+@dp.errors(ExceptionTypeFilter(StorageError))
+async def storage_error(event: ErrorEvent):
+    if event.update.message is not None:
+        await event.update.message.answer("Не удалось обратиться к базе данных, попробуйте позже.")
+    elif event.update.inline_query is not None:
+        # Пустой ответ не кэшируется: следующий запрос снова обратится к хранилищу.
+        await event.update.inline_query.answer([], cache_time=0, is_personal=True)
+    return True
 
 
 # Основная функция запуска бота
 async def main():
-    # Удаляем вебхук, если он был установлен
-    await bot.delete_webhook(drop_pending_updates=True)
+    # Логирование настраивается один раз при запуске (запись в отдельном потоке).
+    setup_logging()
+    bot = create_bot()
 
-    # Запускаем поллинг
-    logger.info("Бот запущен")
-    await dp.start_polling(bot)
+    # Подготовка хранилища и фоновые задачи - в хуке запуска (Lifecycle.on_startup),
+    # остановка по SIGINT/SIGTERM - в хуке остановки (Lifecycle.on_shutdown).
+    try:
+        await dp.start_polling(bot)
+    finally:
+        # Дописываем очередь логов (в том числе время этапов остановки).
+        stop_logging()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,476 @@
+import os
+import time
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional, Tuple
+
+import aiosqlite
+
+from app.currency import base_summ_sql
+from app.money import MINOR_UNITS
+
+logger = logging.getLogger(__name__)
+
+# Размер пачки для заполнения данных (backfill).
+# Каждая пачка коммитится отдельно, чтобы не держать блокировку записи долго.
+BACKFILL_BATCH_SIZE = 5000
+
+# Преобразование строки "ДД.ММ.ГГГГ" в "ГГГГ-ММ-ДД" средствами SQLite.
+DATE_ISO_EXPR = "SUBSTR({col}, 7, 4) || '-' || SUBSTR({col}, 4, 2) || '-' || SUBSTR({col}, 1, 2)"
+
+
+# Таблицы с суммами, которые миграция 12 переводит из рублей в копейки.
+MINOR_UNIT_TABLES = ("out", "income", "recurring")
+
+
+@dataclass(frozen=True)
+class Migration:
+    """
+    Одна миграция схемы.
+    statements выполняются в одной транзакции вместе с обновлением user_version.
+    backfill (если есть) выполняется до statements пачками со своими коммитами.
+    """
+    version: int
+    description: str
+    statements: Tuple[str, ...] = ()
+    backfill: Optional[Callable[[aiosqlite.Connection], Awaitable[int]]] = None
+
+
+async def backfill_date_iso(conn: aiosqlite.Connection, batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """
+    Заполняет колонку date_iso для старых записей.
+    Идет по диапазонам rowid, а не по "WHERE date_iso IS NULL LIMIT",
+    чтобы каждая пачка не сканировала уже обработанные строки.
+    :return: Количество обновленных строк.
+    """
+    cursor = await conn.execute("SELECT MIN(rowid), MAX(rowid) FROM out")
+    min_rowid, max_rowid = await cursor.fetchone()
+    await cursor.close()
+    if min_rowid is None:
+        return 0
+
+    query = (
+        f"UPDATE out SET date_iso = {DATE_ISO_EXPR.format(col='date')} "
+        "WHERE rowid >= ? AND rowid < ? AND date_iso IS NULL"
+    )
+    updated = 0
+    start = min_rowid
+    while start <= max_rowid:
+        cursor = await conn.execute(query, (start, start + batch_size))
+        updated += cursor.rowcount
+        await cursor.close()
+        await conn.commit()
+        start += batch_size
+        # Отдаем управление циклу событий между пачками.
+        await asyncio.sleep(0)
+
+    logger.info("Заполнено date_iso для %d записей.", updated)
+    return updated
+
+
+async def backfill_out_fts(conn: aiosqlite.Connection, batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """
+    Заполняет полнотекстовый индекс out_fts существующими записями пачками по rowid.
+    Индекс сначала очищается, поэтому прерванное заполнение безопасно запускать повторно.
+    :return: Количество проиндексированных строк.
+    """
+    await conn.execute("INSERT INTO out_fts(out_fts) VALUES('delete-all')")
+    await conn.commit()
+
+    cursor = await conn.execute("SELECT MIN(rowid), MAX(rowid) FROM out")
+    min_rowid, max_rowid = await cursor.fetchone()
+    await cursor.close()
+    if min_rowid is None:
+        return 0
+
+    indexed = 0
+    start = min_rowid
+    while start <= max_rowid:
+        cursor = await conn.execute(
+            "INSERT INTO out_fts(rowid, description, category, sub_category) "
+            "SELECT rowid, description, category, sub_category FROM out WHERE rowid >= ? AND rowid < ?",
+            (start, start + batch_size)
+        )
+        indexed += cursor.rowcount
+        await cursor.close()
+        await conn.commit()
+        start += batch_size
+        await asyncio.sleep(0)
+
+    logger.info("В полнотекстовый индекс добавлено %d записей.", indexed)
+    return indexed
+
+
+async def backfill_balance(conn: aiosqlite.Connection) -> int:
+    """
+    Пересчитывает таблицу balance по всей истории: доходы из 'income', расходы из 'out'
+    и из архива закрытых лет рядом с файлом БД (app.archive), если он есть.
+    Строки пересчитываются целиком, поэтому повторный запуск безопасен.
+    :return: Количество пользователей с балансом.
+    """
+    cursor = await conn.execute("PRAGMA database_list")
+    main_file = next((row[2] for row in await cursor.fetchall() if row[1] == "main"), "")
+    await cursor.close()
+
+    expense_sources = "SELECT user_tg_id, summ FROM out"
+    base, ext = os.path.splitext(main_file)
+    archive_file = f"{base}.archive{ext or '.db'}"
+    with_archive = bool(main_file) and os.path.exists(archive_file)
+    if with_archive:
+        await conn.execute("ATTACH DATABASE ? AS balance_archive", (archive_file,))
+        expense_sources += " UNION ALL SELECT user_tg_id, summ FROM balance_archive.out"
+
+    try:
+        cursor = await conn.execute(
+            f"""
+            INSERT OR REPLACE INTO balance (user_tg_id, income, expense)
+            SELECT user_tg_id, SUM(income), SUM(expense) FROM (
+                SELECT user_tg_id, summ AS income, 0 AS expense FROM income
+                UNION ALL
+                SELECT user_tg_id, 0, summ FROM ({expense_sources})
+            )
+            GROUP BY user_tg_id
+            """
+        )
+        users = cursor.rowcount
+        await cursor.close()
+        await conn.commit()
+    finally:
+        if with_archive:
+            await conn.execute("DETACH DATABASE balance_archive")
+
+    logger.info("Баланс пересчитан для %d пользователей.", users)
+    return users
+
+
+async def _get_progress(conn: aiosqlite.Connection, name: str) -> Optional[int]:
+    cursor = await conn.execute("SELECT last_rowid FROM migration_progress WHERE name = ?", (name,))
+    row = await cursor.fetchone()
+    await cursor.close()
+    return row[0] if row else None
+
+
+async def scale_amounts_to_minor_units(conn: aiosqlite.Connection, batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """
+    Переводит суммы из рублей в копейки (умножение на MINOR_UNITS) пачками по rowid:
+    'out', 'income', 'recurring' и затем строки 'balance'.
+    Граница обработанных строк хранится в migration_progress и фиксируется одной транзакцией
+    с пачкой: прерванный перевод продолжается с места остановки и не умножает строку дважды.
+    :return: Количество переведенных строк (без balance).
+    """
+    await conn.execute(
+        "CREATE TABLE IF NOT EXISTS migration_progress (name TEXT PRIMARY KEY, last_rowid INTEGER NOT NULL)"
+    )
+    await conn.commit()
+
+    scaled = 0
+    for table in MINOR_UNIT_TABLES:
+        name = f"minor_units:{table}"
+        cursor = await conn.execute(f"SELECT MIN(rowid), MAX(rowid) FROM {table}")
+        min_rowid, max_rowid = await cursor.fetchone()
+        await cursor.close()
+        if max_rowid is None:
+            continue
+
+        last_rowid = await _get_progress(conn, name)
+        last_rowid = min_rowid - 1 if last_rowid is None else last_rowid
+        while last_rowid < max_rowid:
+            end = min(last_rowid + batch_size, max_rowid)
+            cursor = await conn.execute(
+                f"UPDATE {table} SET summ = summ * {MINOR_UNITS} WHERE rowid > ? AND rowid <= ?", (last_rowid, end)
+            )
+            scaled += cursor.rowcount
+            await cursor.close()
+            await conn.execute(
+                "INSERT OR REPLACE INTO migration_progress (name, last_rowid) VALUES (?, ?)", (name, end)
+            )
+            await conn.commit()
+            last_rowid = end
+            # Отдаем управление циклу событий между пачками.
+            await asyncio.sleep(0)
+
+    # Строк баланса по одной на пользователя: переводятся одной транзакцией.
+    if await _get_progress(conn, "minor_units:balance") is None:
+        await conn.execute(f"UPDATE balance SET income = income * {MINOR_UNITS}, expense = expense * {MINOR_UNITS}")
+        await conn.execute("INSERT INTO migration_progress (name, last_rowid) VALUES ('minor_units:balance', 0)")
+        await conn.commit()
+
+    logger.info("Суммы %d записей переведены в копейки.", scaled)
+    return scaled
+
+
+# Упорядоченный список миграций. Номера версий идут подряд, начиная с 1.
+# !!! Уже выпущенные миграции не меняются, только добавляются новые.
+MIGRATIONS: Tuple[Migration, ...] = (
+    Migration(
+        version=1,
+        description="Таблица расходов 'out'",
+        statements=(
+            """
+            CREATE TABLE IF NOT EXISTS "out" (
+                rowid INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_tg_id INTEGER NOT NULL,
+                category TEXT,
+                sub_category TEXT,
+                summ INTEGER,
+                description TEXT,
+                date TEXT
+            );
+            """,
+        ),
+    ),
+    Migration(
+        version=2,
+        description="Колонка date_iso (ГГГГ-ММ-ДД) для выборок по диапазону дат",
+        statements=(
+            "ALTER TABLE out ADD COLUMN date_iso TEXT;",
+            # Записи, добавленные в обход add_note (вручную или старой версией бота),
+            # получают date_iso автоматически.
+            f"""
+            CREATE TRIGGER IF NOT EXISTS out_date_iso_ai AFTER INSERT ON out
+            WHEN NEW.date_iso IS NULL
+            BEGIN
+                UPDATE out SET date_iso = {DATE_ISO_EXPR.format(col='NEW.date')} WHERE rowid = NEW.rowid;
+            END;
+            """,
+        ),
+    ),
+    Migration(
+        version=3,
+        description="Заполнение date_iso и индекс (user_tg_id, date_iso)",
+        statements=(
+            "CREATE INDEX IF NOT EXISTS idx_out_user_date_iso ON out (user_tg_id, date_iso);",
+        ),
+        backfill=backfill_date_iso,
+    ),
+    Migration(
+        version=4,
+        description="Полнотекстовый индекс FTS5 по описанию и категориям",
+        statements=(
+            # external content: текст хранится только в 'out', индекс ссылается на rowid.
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS out_fts USING fts5(
+                description, category, sub_category,
+                content='out', content_rowid='rowid',
+                tokenize='unicode61 remove_diacritics 2'
+            );
+            """,
+        ),
+    ),
+    Migration(
+        version=5,
+        description="Заполнение FTS5 и триггеры синхронизации с 'out'",
+        statements=(
+            """
+            CREATE TRIGGER IF NOT EXISTS out_fts_ai AFTER INSERT ON out BEGIN
+                INSERT INTO out_fts(rowid, description, category, sub_category)
+                VALUES (NEW.rowid, NEW.description, NEW.category, NEW.sub_category);
+            END;
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS out_fts_ad AFTER DELETE ON out BEGIN
+                INSERT INTO out_fts(out_fts, rowid, description, category, sub_category)
+                VALUES ('delete', OLD.rowid, OLD.description, OLD.category, OLD.sub_category);
+            END;
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS out_fts_au AFTER UPDATE OF description, category, sub_category ON out BEGIN
+                INSERT INTO out_fts(out_fts, rowid, description, category, sub_category)
+                VALUES ('delete', OLD.rowid, OLD.description, OLD.category, OLD.sub_category);
+                INSERT INTO out_fts(rowid, description, category, sub_category)
+                VALUES (NEW.rowid, NEW.description, NEW.category, NEW.sub_category);
+            END;
+            """,
+        ),
+        backfill=backfill_out_fts,
+    ),
+    Migration(
+        version=6,
+        description="Регулярные расходы: правила 'recurring' и связь записей с правилом",
+        statements=(
+            # day_of_month - ежемесячное правило, weekday (0 - понедельник) - еженедельное.
+            # last_date - дата, по которую платежи уже перенесены в 'out'.
+            """
+            CREATE TABLE IF NOT EXISTS recurring (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_tg_id INTEGER NOT NULL,
+                category TEXT,
+                sub_category TEXT,
+                summ INTEGER,
+                description TEXT,
+                day_of_month INTEGER,
+                weekday INTEGER,
+                last_date TEXT NOT NULL
+            );
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_recurring_user ON recurring (user_tg_id);",
+            "ALTER TABLE out ADD COLUMN recurring_id INTEGER;",
+            # Один платеж правила за дату: повторный запуск планировщика ничего не дублирует.
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_out_recurring_date
+            ON out (recurring_id, date_iso) WHERE recurring_id IS NOT NULL;
+            """,
+        ),
+    ),
+    Migration(
+        version=7,
+        description="Покрывающий индекс (date_iso, user_tg_id, summ) для сумм по всем пользователям",
+        statements=(
+            # get_totals_by_month фильтрует только по дате: без этого индекса - полный просмотр 'out'.
+            "CREATE INDEX IF NOT EXISTS idx_out_date_iso_user_summ ON out (date_iso, user_tg_id, summ);",
+        ),
+    ),
+    Migration(
+        version=8,
+        description="Доходы 'income' и баланс пользователя 'balance'",
+        statements=(
+            """
+            CREATE TABLE IF NOT EXISTS income (
+                rowid INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_tg_id INTEGER NOT NULL,
+                category TEXT,
+                summ INTEGER,
+                description TEXT,
+                date TEXT,
+                date_iso TEXT
+            );
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_income_user_date_iso ON income (user_tg_id, date_iso);",
+            # Одна строка на пользователя: /balance читает ее вместо сумм по всей истории.
+            """
+            CREATE TABLE IF NOT EXISTS balance (
+                user_tg_id INTEGER PRIMARY KEY,
+                income INTEGER NOT NULL DEFAULT 0,
+                expense INTEGER NOT NULL DEFAULT 0
+            );
+            """,
+            # Баланс меняется в той же транзакции, что и вставка дохода или расхода (любым путем:
+            # add_note, регулярные расходы, перенос по шардам). Удаление при архивации баланс не меняет.
+            """
+            CREATE TRIGGER IF NOT EXISTS out_balance_ai AFTER INSERT ON out BEGIN
+                INSERT INTO balance (user_tg_id, expense) VALUES (NEW.user_tg_id, NEW.summ)
+                ON CONFLICT (user_tg_id) DO UPDATE SET expense = expense + excluded.expense;
+            END;
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS income_balance_ai AFTER INSERT ON income BEGIN
+                INSERT INTO balance (user_tg_id, income) VALUES (NEW.user_tg_id, NEW.summ)
+                ON CONFLICT (user_tg_id) DO UPDATE SET income = income + excluded.income;
+            END;
+            """,
+        ),
+    ),
+    Migration(
+        version=9,
+        description="Начальный баланс по истории расходов (включая архив)",
+        backfill=backfill_balance,
+    ),
+    Migration(
+        version=10,
+        description="Валюта записи и курсы 'rates' для пересчета в базовую валюту",
+        statements=(
+            # NULL - базовая валюта (app.currency.BASE_CURRENCY), старые записи не меняются.
+            "ALTER TABLE out ADD COLUMN currency TEXT;",
+            # Курсы копируются из файла при старте (SQLiteStorage.sync_rates).
+            """
+            CREATE TABLE IF NOT EXISTS rates (
+                currency TEXT NOT NULL,
+                date_iso TEXT NOT NULL,
+                rate REAL NOT NULL,
+                PRIMARY KEY (currency, date_iso)
+            ) WITHOUT ROWID;
+            """,
+            # Суммы по всем пользователям пересчитывают валюту: индекс остается покрывающим.
+            "DROP INDEX IF EXISTS idx_out_date_iso_user_summ;",
+            "CREATE INDEX IF NOT EXISTS idx_out_date_iso_user_currency ON out (date_iso, user_tg_id, summ, currency);",
+            # Баланс ведется в базовой валюте.
+            "DROP TRIGGER IF EXISTS out_balance_ai;",
+            f"""
+            CREATE TRIGGER out_balance_ai AFTER INSERT ON out BEGIN
+                INSERT INTO balance (user_tg_id, expense) VALUES (NEW.user_tg_id, {base_summ_sql('NEW')})
+                ON CONFLICT (user_tg_id) DO UPDATE SET expense = expense + excluded.expense;
+            END;
+            """,
+        ),
+    ),
+    Migration(
+        version=11,
+        description="Обработанные сообщения 'processed_updates' для защиты от повторной доставки",
+        statements=(
+            # Ключ (chat_id, message_id) - первичный ключ без rowid: повтор отклоняется поиском по ключу.
+            # processed_at - unix-время, по нему удаляются устаревшие ключи (app.dedupe).
+            """
+            CREATE TABLE IF NOT EXISTS processed_updates (
+                chat_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                processed_at INTEGER NOT NULL,
+                PRIMARY KEY (chat_id, message_id)
+            ) WITHOUT ROWID;
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_processed_updates_at ON processed_updates (processed_at);",
+        ),
+    ),
+    Migration(
+        version=12,
+        description="Суммы в копейках (целые минимальные единицы) вместо рублей",
+        backfill=scale_amounts_to_minor_units,
+    ),
+    Migration(
+        version=13,
+        description="Таблица участников общих групп учета group_members",
+        statements=(
+            """
+            CREATE TABLE IF NOT EXISTS group_members (
+                group_name TEXT NOT NULL,
+                user_tg_id INTEGER NOT NULL,
+                PRIMARY KEY (group_name, user_tg_id)
+            ) WITHOUT ROWID;
+            """,
+        ),
+    ),
+)
+
+
+async def get_schema_version(conn: aiosqlite.Connection) -> int:
+    """Текущая версия схемы из PRAGMA user_version."""
+    cursor = await conn.execute("PRAGMA user_version")
+    row = await cursor.fetchone()
+    await cursor.close()
+    return row[0]
+
+
+async def run_migrations(conn: aiosqlite.Connection) -> int:
+    """
+    Применяет по порядку все миграции с версией выше текущей.
+    Каждая миграция фиксируется отдельно, поэтому прерванный запуск
+    продолжится с той же миграции при следующем старте.
+    :return: Версия схемы после применения миграций.
+    """
+    current_version = await get_schema_version(conn)
+
+    for migration in MIGRATIONS:
+        if migration.version <= current_version:
+            continue
+
+        started = time.perf_counter()
+        logger.info("Применяется миграция %d: %s", migration.version, migration.description)
+
+        if migration.backfill is not None:
+            await migration.backfill(conn)
+
+        await conn.execute("BEGIN")
+        try:
+            for statement in migration.statements:
+                await conn.execute(statement)
+            # PRAGMA не поддерживает параметры, версия - целое число из кода.
+            await conn.execute(f"PRAGMA user_version = {int(migration.version)}")
+            await conn.commit()
+        except Exception:
+            await conn.rollback()
+            raise
+
+        current_version = migration.version
+        logger.info("Миграция %d применена за %.3f сек.", migration.version, time.perf_counter() - started)
+
+    return current_version
@@ -0,0 +1,39 @@
+import re
+from typing import Optional
+
+# """
+# Денежные суммы. Хранятся и складываются целыми числами в копейках (минимальных единицах валюты),
+# в рубли переводятся только при выводе пользователю.
+# """
+
+# Копеек в рубле.
+MINOR_UNITS = 100
+
+# "149", "149.90", "149,9" - рубли и до двух знаков копеек через точку или запятую.
+_AMOUNT_RE = re.compile(r"^(\d+)(?:[.,](\d{1,2}))?$")
+
+
+def parse_amount(text: str) -> Optional[int]:
+    """Сумма в копейках из текста или None, если текст не сумма."""
+    match = _AMOUNT_RE.match(text)
+    if match is None:
+        return None
+    rubles, kopecks = match.groups()
+    return int(rubles) * MINOR_UNITS + int((kopecks or "0").ljust(2, "0"))
+
+
+def format_money(minor: int, signed: bool = False) -> str:
+    """
+    Сумма в копейках для вывода: "2800" для целых рублей, "149.90" с копейками.
+    signed - со знаком, для разниц ("+300", "-12.50").
+    """
+    sign = "-" if minor < 0 else ("+" if signed else "")
+    rubles, kopecks = divmod(abs(minor), MINOR_UNITS)
+    if kopecks:
+        return f"{sign}{rubles}.{kopecks:02d}"
+    return f"{sign}{rubles}"
+
+
+def to_major(minor: int) -> float:
+    """Сумма в рублях (для осей графиков)."""
+    return minor / MINOR_UNITS
@@ -1,23 +1,31 @@
+import re
+
+from app.currency import BASE_CURRENCY, currency_by_suffix
+from app.money import parse_amount
+
+# Сумма с суффиксом валюты: "25eur", "25€", "12,50лари".
+_CURRENCY_AMOUNT_RE = re.compile(r"^(\d+(?:[.,]\d{1,2})?)(\D+)$")
+
 
 # Парсер основного сообщения.
 async def split_message(msg: str) -> tuple[int | None, str, str, str | None]:
     """
     Парсит сообщение пользователя в сумму, категорию, подкатегорию и описание.
+    Сумма - рубли с копейками или без ("149", "149.90", "149,9"), возвращается в копейках.
     Возвращает (summ, cat, sub_cat, descr) или None, если парсинг не удался.
     """
     msg_list = msg.split()
     if not msg_list:
         return None, "", "", ""
 
-    summ = None
     # 1. Поиск суммы
-    if msg_list[0].isdigit():
-        summ = int(msg_list[0])
+    summ = parse_amount(msg_list[0])
+    if summ is not None:
         data_list = msg_list[1:]
-    elif msg_list[-1].isdigit():
-        summ = int(msg_list[-1])
-        data_list = msg_list[:-1]
     else:
+        summ = parse_amount(msg_list[-1])
+        data_list = msg_list[:-1]
+    if summ is None:
         return None, "", "", ""  # Сумма не найдена
 
     if summ < 0:
@@ -44,3 +52,51 @@ async def split_message(msg: str) -> tuple[int | None, str, str, str | None]:
 
     # print(summ, category, sub_category, description)
     return summ, category, sub_category, description
+
+
+# Парсер сообщения о доходе.
+async def split_income_message(msg: str) -> tuple[int | None, str, str]:
+    """
+    Парсит сообщение о доходе: сумма со знаком "+" в начале или в конце,
+    например "+5000 Зарплата" или "Зарплата аванс +5000,50". Сумма возвращается в копейках.
+    Возвращает (summ, category, description) или (None, "", ""), если это не доход.
+    """
+    msg_list = msg.split()
+    if not msg_list:
+        return None, "", ""
+
+    summ = parse_amount(msg_list[0][1:]) if msg_list[0].startswith("+") else None
+    if summ is not None:
+        data_list = msg_list[1:]
+    else:
+        summ = parse_amount(msg_list[-1][1:]) if msg_list[-1].startswith("+") else None
+        data_list = msg_list[:-1]
+    if summ is None:
+        return None, "", ""
+
+    if not data_list or summ == 0:
+        return None, "", ""
+
+    category = data_list[0].capitalize()
+    description = " ".join(data_list)
+    return summ, category, description
+
+
+# Валюта суммы в сообщении.
+async def split_currency(msg: str) -> tuple[str, str | None]:
+    """
+    Находит сумму с суффиксом валюты в начале или в конце сообщения ("25eur Кофе", "Такси 40gel")
+    и убирает суффикс, чтобы сообщение разобрал split_message.
+    Возвращает (сообщение, код валюты) или (msg, None) для базовой валюты и неизвестных суффиксов.
+    """
+    msg_list = msg.split()
+    if not msg_list:
+        return msg, None
+
+    for position in (0, -1):
+        match = _CURRENCY_AMOUNT_RE.match(msg_list[position])
+        currency = currency_by_suffix(match.group(2)) if match else None
+        if currency is not None:
+            msg_list[position] = match.group(1)
+            return " ".join(msg_list), None if currency == BASE_CURRENCY else currency
+    return msg, None
@@ -0,0 +1,153 @@
+import re
+from dataclasses import dataclass
+from datetime import date
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+
+from config import MONTH_MAP
+
+# """
+# Разбор периода из текста команды: "март", "марта 2024", "мар", "03", "3.2024", "2024", "прошлый месяц".
+# Результат - Period с границами [start, end) в формате date_iso, общий для /report, /compare и /search.
+# Таблицы форм названий месяцев строятся один раз при импорте.
+# """
+
+# Названия месяцев в именительном падеже (для ответов пользователю).
+MONTH_NAMES: Tuple[str, ...] = (
+    "январь", "февраль", "март", "апрель", "май", "июнь",
+    "июль", "август", "сентябрь", "октябрь", "ноябрь", "декабрь",
+)
+
+# Остальные формы: родительный ("за марта" / "1 марта"), предложный ("в марте") и сокращения.
+_MONTH_FORMS: Tuple[Tuple[str, ...], ...] = (
+    ("января", "январе", "янв"),
+    ("февраля", "феврале", "фев", "февр"),
+    ("марта", "марте", "мар"),
+    ("апреля", "апреле", "апр"),
+    ("мая", "мае"),
+    ("июня", "июне", "июн"),
+    ("июля", "июле", "июл"),
+    ("августа", "августе", "авг"),
+    ("сентября", "сентябре", "сен", "сент"),
+    ("октября", "октябре", "окт"),
+    ("ноября", "ноябре", "ноя", "нояб"),
+    ("декабря", "декабре", "дек"),
+)
+
+# Любая форма названия месяца -> номер месяца (1-12).
+MONTH_BY_NAME: Dict[str, int] = {
+    form: number
+    for number, forms in enumerate(zip(MONTH_NAMES, _MONTH_FORMS), start=1)
+    for form in (forms[0], *forms[1])
+}
+# Названия из config.MONTH_MAP тоже принимаются, как раньше.
+for _name, _number in MONTH_MAP.items():
+    MONTH_BY_NAME.setdefault(_name.lower(), _number)
+# Номер месяца -> название для ответа.
+MONTH_NAME_BY_NUMBER: Dict[int, str] = {number: name for number, name in enumerate(MONTH_NAMES, start=1)}
+
+# Относительные периоды: (сдвиг, единица). Сдвиг в месяцах или годах от текущего.
+RELATIVE_PERIODS: Dict[str, Tuple[int, str]] = {
+    "этот месяц": (0, "month"), "текущий месяц": (0, "month"), "этом месяце": (0, "month"),
+    "прошлый месяц": (-1, "month"), "прошлом месяце": (-1, "month"), "предыдущий месяц": (-1, "month"),
+    "этот год": (0, "year"), "текущий год": (0, "year"), "этом году": (0, "year"),
+    "прошлый год": (-1, "year"), "прошлом году": (-1, "year"), "предыдущий год": (-1, "year"),
+}
+
+# Слово "год" после года: "март 2024 года", "2024 г".
+_YEAR_SUFFIX_RE = re.compile(r"\s+(?:г|год|года|году)$")
+_MONTH_YEAR_RE = re.compile(r"^(\d{1,2})[./-](\d{4})$")     # 3.2024, 03/2024
+_YEAR_MONTH_RE = re.compile(r"^(\d{4})-(\d{1,2})$")         # 2024-03
+_NAME_YEAR_RE = re.compile(r"^([а-я]+)(?:\s+(\d{4}))?$")    # март, марта 2024
+
+
+def month_bounds(month: int, year: int) -> Tuple[str, str]:
+    """
+    Границы месяца в формате date_iso: [первый день месяца, первый день следующего месяца).
+    """
+    if month == 12:
+        return f"{year:04d}-12-01", f"{year + 1:04d}-01-01"
+    return f"{year:04d}-{month:02d}-01", f"{year:04d}-{month + 1:02d}-01"
+
+
+@dataclass(frozen=True)
+class Period:
+    """Период отчета: [start, end) в формате date_iso. month is None - период в целый год."""
+    start: str
+    end: str
+    year: int
+    month: Optional[int] = None
+
+    @property
+    def month_name(self) -> Optional[str]:
+        """Название месяца в именительном падеже (строчными)."""
+        return MONTH_NAME_BY_NUMBER.get(self.month)
+
+    @property
+    def name(self) -> str:
+        """Название периода для ответа: "Март 2025 года" или "2024 год"."""
+        if self.month is None:
+            return f"{self.year} год"
+        return f"{self.month_name.capitalize()} {self.year} года"
+
+
+def month_period(month: int, year: int) -> Period:
+    return Period(*month_bounds(month, year), year=year, month=month)
+
+
+def year_period(year: int) -> Period:
+    return Period(f"{year:04d}-01-01", f"{year + 1:04d}-01-01", year=year)
+
+
+def normalize(text: str) -> str:
+    """Нижний регистр, ё -> е, без точек в конце сокращений ("мар.") и лишних пробелов."""
+    words = text.lower().replace("ё", "е").split()
+    return " ".join(word.rstrip(".") for word in words)
+
+
+@lru_cache(maxsize=1024)
+def _parse_normalized(text: str, today: date) -> Optional[Period]:
+    relative = RELATIVE_PERIODS.get(text)
+    if relative is not None:
+        shift, unit = relative
+        if unit == "year":
+            return year_period(today.year + shift)
+        months = today.year * 12 + today.month - 1 + shift
+        return month_period(months % 12 + 1, months // 12)
+
+    text = _YEAR_SUFFIX_RE.sub("", text)
+
+    if text.isdigit():
+        number = int(text)
+        if len(text) <= 2 and 1 <= number <= 12:
+            return month_period(number, today.year)
+        if len(text) == 4:
+            return year_period(number)
+        return None
+
+    match = _MONTH_YEAR_RE.match(text)
+    if match:
+        month, year = int(match.group(1)), int(match.group(2))
+    else:
+        match = _YEAR_MONTH_RE.match(text)
+        if match:
+            year, month = int(match.group(1)), int(match.group(2))
+        else:
+            match = _NAME_YEAR_RE.match(text)
+            if match is None or match.group(1) not in MONTH_BY_NAME:
+                return None
+            month = MONTH_BY_NAME[match.group(1)]
+            year = int(match.group(2)) if match.group(2) else today.year
+
+    if not 1 <= month <= 12:
+        return None
+    return month_period(month, year)
+
+
+def parse_period(text: str, today: Optional[date] = None) -> Optional[Period]:
+    """
+    Разбирает период из текста. Месяц без года - в текущем году.
+    Результаты кэшируются (ключ - нормализованный текст и текущая дата).
+    :return: Period или None, если текст не является периодом.
+    """
+    return _parse_normalized(normalize(text), today or date.today())
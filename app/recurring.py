@@ -0,0 +1,78 @@
+import asyncio
+import calendar
+import logging
+from datetime import date, datetime, time, timedelta
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# """
+# Регулярные расходы (аренда, подписки, коммунальные платежи).
+# Правило задает день месяца или день недели. Планировщик раз в сутки переносит в 'out'
+# все наступившие платежи по всем правилам с даты последнего запуска, поэтому после
+# простоя бота пропущенные дни догоняются; повторная вставка исключена (см. materialize_recurring).
+# """
+
+# Дни недели для недельных правил (date.weekday()).
+WEEKDAYS = {"пн": 0, "вт": 1, "ср": 2, "чт": 3, "пт": 4, "сб": 5, "вс": 6}
+WEEKDAY_NAMES = {number: name for name, number in WEEKDAYS.items()}
+
+# Время ежедневного запуска планировщика (местное время процесса).
+RECURRING_RUN_AT = time(0, 5)
+
+
+def due_dates(day_of_month: Optional[int], weekday: Optional[int], after: date, until: date) -> List[date]:
+    """
+    Даты платежей правила в интервале (after, until].
+    Для ежемесячного правила день больше длины месяца переносится на последний день (31 -> 30 апреля).
+    """
+    dates = []
+    if weekday is not None:
+        current = after + timedelta(days=(weekday - after.weekday() - 1) % 7 + 1)
+        while current <= until:
+            dates.append(current)
+            current += timedelta(days=7)
+        return dates
+
+    year, month = after.year, after.month
+    while (year, month) <= (until.year, until.month):
+        day = min(day_of_month, calendar.monthrange(year, month)[1])
+        current = date(year, month, day)
+        if after < current <= until:
+            dates.append(current)
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return dates
+
+
+def next_due_date(day_of_month: Optional[int], weekday: Optional[int], today: date) -> date:
+    """Ближайший платеж правила после today."""
+    return due_dates(day_of_month, weekday, today, today + timedelta(days=62))[0]
+
+
+def seconds_until_next_run(now: datetime) -> float:
+    """Секунды до следующего ежедневного запуска в RECURRING_RUN_AT."""
+    next_run = datetime.combine(now.date(), RECURRING_RUN_AT)
+    if next_run <= now:
+        next_run += timedelta(days=1)
+    return (next_run - now).total_seconds()
+
+
+async def recurring_worker(storage):
+    """
+    Фоновая задача: при старте догоняет пропущенные платежи, затем запускается раз в сутки.
+    :param storage: Хранилище (app.storage.Storage).
+    """
+    # Импорт здесь: crud импортирует хранилище, которое импортирует этот модуль (due_dates).
+    from app import crud
+
+    while True:
+        try:
+            created = await storage.materialize_recurring(date.today())
+            logger.info("Регулярные расходы: добавлено %d записей у %d пользователей.",
+                        sum(created.values()), len(created))
+            # Записи добавлены в обход crud.add_note: версия данных этих пользователей увеличивается,
+            # и кэши, которые от нее зависят (сводки, итоги групп, графики), строятся заново.
+            crud.bump_data_versions(created)
+        except Exception as ex:
+            logger.error("Ошибка создания регулярных расходов: %s", ex, exc_info=True)
+        await asyncio.sleep(seconds_until_next_run(datetime.now()))
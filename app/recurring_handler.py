@@ -0,0 +1,102 @@
+from datetime import date
+
+from aiogram import types
+
+from app.money import format_money
+from app.parser import split_message
+from app.recurring import WEEKDAYS, WEEKDAY_NAMES, next_due_date
+from app.storage import Storage
+
+# Слова команды удаления правила.
+DELETE_WORDS = ("удалить", "delete")
+
+USAGE_TEXT = (
+    "Добавить: /recurring <сумма> <категория> [подкатегория] <день месяца или день недели>\n"
+    "например: /recurring 25000 Жилье Аренда 5 или /recurring 500 Спорт Бассейн пн\n"
+    "Удалить: /recurring удалить <номер>"
+)
+
+
+class RecurringHandler:
+    def __init__(self, message: types.Message, storage: Storage):
+        self.message = message                      # Сообщение из тг, для ответа и ид юзера.
+        self.user_id = self.message.from_user.id    # Получаем ID пользователя.
+        self.storage = storage                      # Хранилище записей.
+        self.report_text = None                     # Готовый текст ответа для пользователя
+
+    async def handle(self):
+        """
+        /recurring - список правил, /recurring <правило> - добавить, /recurring удалить <номер> - удалить.
+        """
+        args = self.message.text.split()[1:]
+        if not args:
+            await self._send_rules()
+        elif args[0].lower() in DELETE_WORDS:
+            await self._delete_rule(args[1:])
+        else:
+            await self._add_rule(args)
+        return self.report_text
+
+    @staticmethod
+    def _format_schedule(day_of_month, weekday) -> str:
+        if weekday is not None:
+            return f"каждую неделю ({WEEKDAY_NAMES[weekday]})"
+        return f"каждый месяц {day_of_month} числа"
+
+    async def _send_rules(self):
+        rules = await self.storage.get_recurring(user_tg_id=self.user_id)
+        if not rules:
+            self.report_text = "Регулярных расходов нет.\n\n" + USAGE_TEXT
+        else:
+            self.report_text = "🔁 Регулярные расходы:\n\n"
+            for rule in rules:
+                self.report_text += (
+                    f"#{rule['id']} {rule['description']}: {format_money(rule['summ'])} руб., "
+                    f"{self._format_schedule(rule['day_of_month'], rule['weekday'])}\n"
+                )
+            self.report_text += "\nУдалить: /recurring удалить <номер>"
+        await self.message.reply(self.report_text)
+
+    async def _add_rule(self, args):
+        # Последнее слово - расписание: число месяца (1-31) или день недели (пн-вс).
+        schedule = args[-1].lower()
+        day_of_month, weekday = None, None
+        if schedule in WEEKDAYS:
+            weekday = WEEKDAYS[schedule]
+        elif schedule.isdigit() and 1 <= int(schedule) <= 31:
+            day_of_month = int(schedule)
+
+        summ, category, sub_category, description = await split_message(" ".join(args[:-1]))
+        if (day_of_month is None and weekday is None) or not summ:
+            self.report_text = "Не удалось разобрать правило.\n\n" + USAGE_TEXT
+            await self.message.reply(self.report_text)
+            return
+
+        # Платежи начинаются со следующего дня: за сегодня расход обычно уже записан вручную.
+        today = date.today()
+        rule_id = await self.storage.add_recurring(
+            user_tg_id=self.user_id,
+            category=category,
+            sub_category=sub_category,
+            summ=summ,
+            description=description,
+            day_of_month=day_of_month,
+            weekday=weekday,
+            start_date=today
+        )
+        first_date = next_due_date(day_of_month, weekday, today)
+        self.report_text = (
+            f"Правило #{rule_id} добавлено: {description} {format_money(summ)} руб., "
+            f"{self._format_schedule(day_of_month, weekday)}. "
+            f"Первая запись - {first_date.strftime('%d.%m.%Y')}."
+        )
+        await self.message.reply(self.report_text)
+
+    async def _delete_rule(self, args):
+        if not args or not args[0].lstrip("#").isdigit():
+            self.report_text = "Укажите номер правила, например: /recurring удалить 3"
+        elif await self.storage.delete_recurring(user_tg_id=self.user_id, rule_id=int(args[0].lstrip("#"))):
+            self.report_text = f"Правило #{args[0].lstrip('#')} удалено."
+        else:
+            self.report_text = f"Правило #{args[0].lstrip('#')} не найдено."
+        await self.message.reply(self.report_text)
@@ -1,24 +1,32 @@
+import logging
 from datetime import datetime
-from typing import Callable, Awaitable, Any, Dict, List
 
-import aiosqlite
 from aiogram import types
 
-from config import MONTH_MAP
+from app import crud
+from app.groups import find_group, member_name
+from app.money import format_money
+from app.periods import Period, month_period, parse_period
+from app.storage import Storage
+
+logger = logging.getLogger(__name__)
 
 
 class ReportHandler:
-    def __init__(self, message: types.Message, db_conn: aiosqlite.Connection,
-                 crud_func: Callable[..., Awaitable[List[Dict[str, Any]]]]):
+    def __init__(self, message: types.Message, storage: Storage):
         self.message = message                      # Сообщение из тг, для ответа и ид юзера.
         self.month_name = None                      # Название месяца, для ответа.
         self.month_number = None                    # Номер месяца(1-12) для получения записей отчета
         self.current_year = None                    # Год для получения записей отчета.
+        self.period = None                          # Период отчета (app.periods.Period)
         self.user_id = self.message.from_user.id    # Получаем ID пользователя.
-        self.db_conn = db_conn                      # Соединение.
-        self.crud_func = crud_func                  # Функция из CRUD.
-        self.notes = None                           # Записи из БД по нашему запросу.
+        self.storage = storage                      # Хранилище записей.
+        self.notes_count = 0                        # Количество записей за период.
         self.category_sums = {}                     # Собранный отчет по категориям
+        self.daily_sums = {}                        # Суммы по дням (для графика)
+        self.group = None                           # Общая группа учета (app.groups), если отчет по группе
+        self.member_sums = {}                       # Суммы по участникам группы
+        self.comparison = None                      # Сравнение категорий с прошлым месяцем и годом (/compare)
         self.report_text = None                     # Готовый текст ответа для пользователя
 
     async def get_month_report(self):
@@ -27,14 +35,13 @@ class ReportHandler:
         if self.month_number is None:
             return None
 
-        # Получение записей из БД
-        await self._get_notes()
-        if not self.notes:  # Проверка, найдены ли записи. _get_notes() уже отправил сообщение об их отсутствии
-            return None
-
-        # Сборка отчета по категориям
-        await self._process_notes()
-        if self.category_sums is None:
+        # Записи из БД читаются потоком и сразу собираются в суммы по категориям
+        if self.group:
+            await self._aggregate_group()
+        else:
+            await self._aggregate_notes()
+        if not self.notes_count:
+            await self.message.reply(f"Записи для {self.month_name.capitalize()} {self.current_year} года не найдены.")
             return None
 
         # Подготовка и отправка теста отчета.
@@ -44,58 +51,121 @@ class ReportHandler:
         else:
             return None
 
+    async def get_compare_report(self):
+        """
+        Сравнение расходов по категориям: выбранный месяц против предыдущего месяца
+        и того же месяца год назад, с разницей.
+        """
+        await self._get_month()
+        if self.month_number is None:
+            return None
+
+        self.comparison = await self.storage.get_category_comparison(
+            user_tg_id=self.user_id,
+            month=self.month_number,
+            year=self.current_year
+        )
+        if not self.comparison:
+            await self.message.reply(
+                f"Нет записей для сравнения с {self.month_name.capitalize()} {self.current_year} года."
+            )
+            return None
+
+        await self._send_compare_report()
+        return self.report_text
+
+    def get_chart_data(self) -> dict:
+        """
+        Агрегированные данные отчета для графиков (app.charts).
+        Только простые типы: данные передаются в процесс пула.
+        """
+        return {
+            "title": f"{(self.month_name or '').capitalize()} {self.current_year or ''}".strip(),
+            "categories": sorted(self.category_sums.items(), key=lambda item: item[1], reverse=True),
+            # Дата записи в формате дд.мм.гггг, внутри одного месяца сортируется по дню.
+            "daily": sorted(self.daily_sums.items()),
+        }
+
+    @property
+    def chart_owner(self):
+        """Владелец графиков в ключе кэша (app.charts): пользователь или группа."""
+        return ("group", self.group) if self.group else self.user_id
+
+    @property
+    def data_version(self) -> int:
+        """Версия данных отчета для кэша графиков."""
+        return crud.get_group_data_version(self.group) if self.group else crud.get_data_version(self.user_id)
+
+    @staticmethod
+    def _format_category_line(category: str, summ: int) -> str:
+        """Строка отчета по категории (summ в копейках)."""
+        return f"🏷️ {category.capitalize()}: {format_money(summ)} руб.\n"
 
     async def _get_month(self):
         args = self.message.text.split(maxsplit=1)  # Разделить только по первому пробелу
-        # TODO тут идет всегда текущий год
-        self.current_year = datetime.now().year  # Всегда получаем текущий год по умолчанию
+
+        # Отчет группы: "/report семья" или "/report семья март".
+        if len(args) == 2:
+            group_args = args[1].split(maxsplit=1)
+            self.group = find_group(self.user_id, group_args[0])
+            if self.group:
+                args = [args[0], *group_args[1:]]
 
         if len(args) < 2:
             # Если месяц не указан, используем текущий
-            self.month_number = datetime.now().month
-            # Получим название месяца для ответа
-            self.month_name = list(MONTH_MAP.keys())[list(MONTH_MAP.values()).index(self.month_number)]
+            today = datetime.now()
+            self._set_period(month_period(today.month, today.year))
             await self.message.reply(f"Месяц не указан. Формирую отчет за {self.month_name.capitalize()} {self.current_year} года.")
         else:
-            # Если месяц указан, обрабатываем его как раньше
-            self.month_name = args[1].lower()
-            self.month_number = MONTH_MAP.get(self.month_name)
-            if self.month_number is None:
+            # Месяц в любой форме, сокращение, номер, "3.2024" или "прошлый месяц" (см. app.periods).
+            period = parse_period(args[1])
+            if period is None or period.month is None:
                 await self.message.reply(
-                    "Не удалось распознать месяц. Пожалуйста, используйте полное название месяца (например, 'июль')."
+                    "Не удалось распознать месяц. Пожалуйста, укажите месяц, например: "
+                    "'июль', 'мар 2024', '03.2024' или 'прошлый месяц'."
                 )
                 return
+            self._set_period(period)
 
-    async def _get_notes(self):
-        # Вызов функции из CRUD для получения данных
-        self.notes = await self.crud_func(
-            conn=self.db_conn,
-            user_tg_id=self.user_id,
-            month=self.month_number,
-            year=self.current_year      # TODO Пока всегда текущий год
-        )
-
-        if not self.notes:
-            await self.message.reply(f"Записи для {self.month_name.capitalize()} {self.current_year} года не найдены.")
-            return
+    def _set_period(self, period: Period):
+        self.period = period
+        self.month_number = period.month
+        self.current_year = period.year
+        self.month_name = period.month_name
 
-    async def _process_notes(self):
+    async def _aggregate_notes(self):
         """
-        Обрабатывает записи (self.notes) и собирает суммы по категориям.
-        Возвращает словарь: {category: total_sum}.
+        Читает записи периода потоком (Storage.iter_notes_by_user_and_period) и сразу собирает
+        суммы по категориям и дням. Список записей в памяти не хранится.
+        Суммы целые (копейки), поэтому итог не накапливает ошибок округления.
         """
-        for note in self.notes:
+        async for note in self.storage.iter_notes_by_user_and_period(
+                user_tg_id=self.user_id,
+                start_date=self.period.start,
+                end_date=self.period.end):
+            self.notes_count += 1
             try:
-                # Предполагаем, что 'summ' и 'category' - ключи в словаре note
-                summ_float = float(note['summ'])
-                category = note['category']
-                self.category_sums[category] = self.category_sums.get(category, 0.0) + summ_float
-            except (ValueError, TypeError, KeyError) as e:
+                summ = int(note.summ)
+                self.category_sums[note.category] = self.category_sums.get(note.category, 0) + summ
+                if note.date:
+                    self.daily_sums[note.date] = self.daily_sums.get(note.date, 0) + summ
+            except (ValueError, TypeError) as e:
                 # Логирование ошибки для некорректных данных
-                print(f"Warning: Failed to process note: {note}. Error: {e}")  # Замените на ваш logger
+                logger.warning("Не удалось обработать запись %s: %s", note, e)
                 # Пропускаем некорректную запись
                 continue
 
+    async def _aggregate_group(self):
+        """
+        Итоги группы за период (crud.get_group_totals): записи всех участников
+        одним запросом к хранилищу или из кэша, если новых записей не было.
+        """
+        totals = await crud.get_group_totals(self.group, self.period)
+        self.notes_count = totals.count
+        self.category_sums = dict(totals.categories)
+        self.daily_sums = dict(totals.daily)
+        self.member_sums = dict(totals.members)
+
     async def _send_report(self):
         """
         Формирует и отправляет отчет пользователю.
@@ -110,24 +180,57 @@ class ReportHandler:
             # return "Отчет не сформирован из-за отсутствия сумм."
 
         # Формирование ответа
+        owner = f"Отчет группы {self.group}" if self.group else "Ваш отчет"
         self.report_text = (
-            f"Ваш отчет за {self.month_name.capitalize()} {self.current_year} года по категориям:\n\n"
+            f"{owner} за {self.month_name.capitalize()} {self.current_year} года по категориям:\n\n"
         )
-        total_report_summ = 0.0
+        total_report_summ = 0
 
         # Сортируем категории по сумме (от большей к меньшей)
         sorted_sums = sorted(self.category_sums.items(), key=lambda item: item[1], reverse=True)
 
         for category, summ in sorted_sums:
-            sum_as_int = int(summ)
-            self.report_text += f"🏷️ {category.capitalize()}: {sum_as_int} руб.\n"
+            self.report_text += self._format_category_line(category, summ)
             total_report_summ += summ
 
-        total_report_summ_int = int(total_report_summ)
-        self.report_text += f"\nОбщая сумма по всем категориям: {total_report_summ_int} руб."
-        # self.report_text += f"\n{'Общая сумма по всем категориям:'} {f'{total_report_summ:.2f}'} руб."
+        if self.member_sums:
+            self.report_text += "\nПо участникам:\n"
+            for user_tg_id, summ in sorted(self.member_sums.items(), key=lambda item: item[1], reverse=True):
+                self.report_text += f"👤 {member_name(user_tg_id)}: {format_money(summ)} руб.\n"
+
+        self.report_text += f"\nОбщая сумма по всем категориям: {format_money(total_report_summ)} руб."
 
         # Отправляем сообщение пользователю
         await self.message.reply(self.report_text)
 
         # return self.report_text  # Возвращаем текст для возможного логирования или дальнейшего использования
+
+    async def _send_compare_report(self):
+        """Формирует и отправляет отчет сравнения (self.comparison) пользователю."""
+        previous_name = "прошлый месяц"
+        last_year_name = f"{self.month_name.capitalize()} {self.current_year - 1}"
+
+        self.report_text = (
+            f"Сравнение расходов за {self.month_name.capitalize()} {self.current_year} года по категориям:\n\n"
+        )
+        totals = {"current": 0, "previous": 0, "last_year": 0}
+        for row in self.comparison:
+            self.report_text += self._format_category_line(row["category"], row["current"])
+            self.report_text += (
+                f"    {previous_name}: {format_money(row['previous'])} руб. "
+                f"({format_money(row['current'] - row['previous'], signed=True)})\n"
+                f"    {last_year_name}: {format_money(row['last_year'])} руб. "
+                f"({format_money(row['current'] - row['last_year'], signed=True)})\n"
+            )
+            for key in totals:
+                totals[key] += row[key]
+
+        self.report_text += (
+            f"\nОбщая сумма: {format_money(totals['current'])} руб.\n"
+            f"{previous_name.capitalize()}: {format_money(totals['previous'])} руб. "
+            f"({format_money(totals['current'] - totals['previous'], signed=True)})\n"
+            f"{last_year_name}: {format_money(totals['last_year'])} руб. "
+            f"({format_money(totals['current'] - totals['last_year'], signed=True)})"
+        )
+
+        await self.message.reply(self.report_text)
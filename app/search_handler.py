@@ -0,0 +1,81 @@
+from aiogram import types
+
+from app.money import format_money
+from app.periods import parse_period
+from app.storage import Storage
+
+# Максимум записей в ответе. Сумма и количество считаются по всем найденным.
+SEARCH_LIMIT = 20
+
+# Период "за все время".
+ALL_TIME = ("0001-01-01", "9999-12-31")
+
+
+class SearchHandler:
+    def __init__(self, message: types.Message, storage: Storage):
+        self.message = message                      # Сообщение из тг, для ответа и ид юзера.
+        self.user_id = self.message.from_user.id    # Получаем ID пользователя.
+        self.storage = storage                      # Хранилище записей.
+        self.terms = []                             # Слова для поиска.
+        self.start_date, self.end_date = ALL_TIME   # Период поиска [start_date, end_date) в формате date_iso.
+        self.period_name = "все время"              # Название периода, для ответа.
+        self.result = None                          # Результат поиска из хранилища.
+        self.report_text = None                     # Готовый текст ответа для пользователя
+
+    async def search(self):
+        # Разбор слов и периода
+        await self._parse_args()
+        if not self.terms:
+            return None
+
+        self.result = await self.storage.search_notes(
+            user_tg_id=self.user_id,
+            terms=self.terms,
+            start_date=self.start_date,
+            end_date=self.end_date,
+            limit=SEARCH_LIMIT
+        )
+        if not self.result["count"]:
+            await self.message.reply(f"По запросу «{' '.join(self.terms)}» за {self.period_name} ничего не найдено.")
+            return None
+
+        await self._send_result()
+        return self.report_text
+
+    async def _parse_args(self):
+        """
+        /search <слова> [период]. Период - одно или два последних слова в формате app.periods:
+        год (2024), месяц ("март", "мар 2024", "03.2024") или "прошлый месяц". Без периода поиск идет за все время.
+        Число без года ("такси 10") остается словом для поиска.
+        """
+        args = self.message.text.split()[1:]
+        # Сначала два слова ("март 2024", "прошлый месяц"), затем одно; хотя бы одно слово остается для поиска.
+        for size in (2, 1):
+            # Одно число периодом считается только как год: "/search такси 10" ищет "10", а не октябрь.
+            if size == 1 and args and args[-1].isdigit() and len(args[-1]) != 4:
+                continue
+            if len(args) > size:
+                period = parse_period(" ".join(args[-size:]))
+                if period is not None:
+                    self.start_date, self.end_date = period.start, period.end
+                    self.period_name = period.name
+                    args = args[:-size]
+                    break
+
+        self.terms = args
+        if not self.terms:
+            await self.message.reply(
+                "Укажите, что искать, например: /search стоматолог 2024"
+            )
+
+    async def _send_result(self):
+        """Формирует и отправляет список найденных записей с итоговой суммой."""
+        count = self.result["count"]
+        self.report_text = f"🔎 Найдено записей по запросу «{' '.join(self.terms)}» за {self.period_name}: {count}\n\n"
+        for note in self.result["notes"]:
+            self.report_text += f"{note['date']} {note['description']}: {format_money(note['summ'])} руб.\n"
+        if count > len(self.result["notes"]):
+            self.report_text += f"... показаны последние {len(self.result['notes'])}\n"
+        self.report_text += f"\nИтого: {format_money(self.result['total'])} руб."
+
+        await self.message.reply(self.report_text)
@@ -0,0 +1,254 @@
+import os
+import sys
+import zlib
+import asyncio
+import logging
+from typing import List
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# """Модуль распределения пользователей по файлам БД (шардам)"""
+
+
+def get_shard_count() -> int:
+    """
+    Количество шардов из config.DATABASE_SHARDS.
+    Если параметр не задан, используется один файл config.DATABASE_NAME.
+    """
+    return max(1, int(getattr(config, "DATABASE_SHARDS", 1)))
+
+
+def shard_for_user(user_tg_id: int) -> int:
+    """
+    Номер шарда для пользователя.
+    crc32 стабилен между запусками и версиями Python, в отличие от hash().
+    """
+    shard_count = get_shard_count()
+    if shard_count == 1:
+        return 0
+    return zlib.crc32(str(user_tg_id).encode()) % shard_count
+
+
+def shard_path(shard: int) -> str:
+    """
+    Путь к файлу шарда.
+    При одном шарде это сам config.DATABASE_NAME, иначе "<имя>.shard<N><расширение>".
+    """
+    shard_count = get_shard_count()
+    if not 0 <= shard < shard_count:
+        raise ValueError(f"Шард {shard} вне диапазона 0..{shard_count - 1}")
+    if shard_count == 1:
+        return config.DATABASE_NAME
+    base, ext = os.path.splitext(config.DATABASE_NAME)
+    return f"{base}.shard{shard}{ext or '.db'}"
+
+
+def archive_path(shard: int) -> str:
+    """
+    Путь к файлу архива закрытых лет для шарда (см. app.archive):
+    "<файл шарда без расширения>.archive<расширение>".
+    """
+    base, ext = os.path.splitext(shard_path(shard))
+    return f"{base}.archive{ext or '.db'}"
+
+
+def all_shards() -> List[int]:
+    """Номера всех шардов."""
+    return list(range(get_shard_count()))
+
+
+# Таблицы данных шарда: перенос выполняется, только если все они пустые (повторный запуск ничего не задвоит).
+# Курсы (rates) сюда не входят: бот заполняет их при каждом запуске, при переносе они заменяются.
+REBALANCE_TABLES = ("out", "income", "balance", "recurring")
+
+
+async def _copy_read_only(path: str, copy_path: str):
+    """
+    Копия файла БД для переноса. Исходный файл открывается только для чтения:
+    миграции (в том числе перевод сумм в копейки) применяются к копии.
+    """
+    import aiosqlite
+    from pathlib import Path
+
+    async with aiosqlite.connect(f"{Path(path).absolute().as_uri()}?mode=ro", uri=True) as source, \
+            aiosqlite.connect(copy_path) as copy:
+        await source.backup(copy)
+
+
+async def _move_notes(source, schema: str, batch_size: int, moved: dict):
+    """
+    Раскладывает записи таблицы 'out' исходного соединения по шардам пачками по rowid:
+    в основную таблицу шарда (schema "main") или в архив шарда (app.archive.ARCHIVE_SCHEMA).
+    """
+    from app.archive import ARCHIVE_COLUMNS, ARCHIVE_SCHEMA, attach_archive
+    from app.database import get_async_sqlite_session
+
+    last_rowid = 0
+    while True:
+        cursor = await source.execute(
+            f"SELECT rowid, {ARCHIVE_COLUMNS} FROM out WHERE rowid > ? ORDER BY rowid LIMIT ?",
+            (last_rowid, batch_size)
+        )
+        rows = await cursor.fetchall()
+        await cursor.close()
+        if not rows:
+            break
+        last_rowid = rows[-1][0]
+
+        by_shard = {}
+        for row in rows:
+            by_shard.setdefault(shard_for_user(row[1]), []).append(row[1:])
+
+        for shard, shard_rows in by_shard.items():
+            async with get_async_sqlite_session(shard=shard) as conn:
+                if schema == ARCHIVE_SCHEMA:
+                    await attach_archive(conn, shard)
+                await conn.executemany(
+                    f"INSERT INTO {schema}.out ({ARCHIVE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    shard_rows
+                )
+                await conn.commit()
+            moved[shard] += len(shard_rows)
+
+
+async def rebalance_from_single(source_path: str, batch_size: int = 5000) -> dict:
+    """
+    Переносит записи из одного файла БД (и его архива закрытых лет, если он есть) по шардам.
+    Запускать при остановленном боте: исходные файлы открываются только для чтения и не изменяются
+    (старая схема обновляется во временной копии, см. _copy_read_only), в шардах и их архивах
+    должны быть пустые таблицы данных (REBALANCE_TABLES), иначе перенос не выполняется.
+    :return: Словарь {номер шарда: количество перенесенных записей о расходах, включая архив}.
+    """
+    # Импорт здесь, чтобы избежать циклического импорта с app.database.
+    from app.archive import ARCHIVE_SCHEMA, attach_archive
+    from app.database import get_async_sqlite_session, update_tables
+    import aiosqlite
+    import tempfile
+    from app.migrations import run_migrations
+
+    if get_shard_count() == 1:
+        logger.info("Шардирование не включено (DATABASE_SHARDS <= 1), переносить нечего.")
+        return {}
+
+    await update_tables()
+    moved = {shard: 0 for shard in all_shards()}
+
+    # Проверяем, что шарды пустые, чтобы повторный запуск не задвоил записи.
+    for shard in all_shards():
+        async with get_async_sqlite_session(shard=shard) as conn:
+            tables = [f"main.{table}" for table in REBALANCE_TABLES]
+            if await attach_archive(conn, shard):
+                tables.append(f"{ARCHIVE_SCHEMA}.out")
+            for table in tables:
+                cursor = await conn.execute(f"SELECT 1 FROM {table} LIMIT 1")
+                if await cursor.fetchone() is not None:
+                    raise RuntimeError(f"Шард {shard_path(shard)} уже содержит данные ({table}), перенос отменен.")
+
+    base, ext = os.path.splitext(source_path)
+    source_archive_path = f"{base}.archive{ext or '.db'}"
+
+    with tempfile.TemporaryDirectory() as copy_dir:
+        # Копии лежат рядом, как исходные файлы ("<имя>.db" и "<имя>.archive.db"): миграция баланса
+        # основной БД находит архив по имени файла. Миграции - в том же порядке, что и при запуске
+        # бота (update_tables): сначала основная БД, затем архив.
+        copy_path = os.path.join(copy_dir, "source.db")
+        copy_archive_path = os.path.join(copy_dir, "source.archive.db")
+        await _copy_read_only(source_path, copy_path)
+        if os.path.exists(source_archive_path):
+            await _copy_read_only(source_archive_path, copy_archive_path)
+        for path in (copy_path, copy_archive_path):
+            if os.path.exists(path):
+                async with aiosqlite.connect(path) as copy:
+                    await run_migrations(copy)
+        await _rebalance_copy(copy_path, copy_archive_path, batch_size, moved)
+
+    logger.info("Перенос по шардам завершен: %s", moved)
+    return moved
+
+
+async def _rebalance_copy(source_path: str, source_archive_path: str, batch_size: int, moved: dict):
+    """Раскладывает по шардам данные копии исходного файла (и копии его архива, если она есть)."""
+    from app.archive import ARCHIVE_SCHEMA, attach_archive
+    from app.currency import base_summ_sql
+    from app.database import get_async_sqlite_session
+    import aiosqlite
+    from app.migrations import run_migrations
+
+    source = await aiosqlite.connect(source_path)
+    try:
+        # Курсы - первыми: триггер баланса пересчитывает вставленные записи в базовую валюту по курсам шарда.
+        cursor = await source.execute("SELECT currency, date_iso, rate FROM rates")
+        rates = await cursor.fetchall()
+        await cursor.close()
+        for shard in all_shards():
+            async with get_async_sqlite_session(shard=shard) as conn:
+                await conn.executemany(
+                    "INSERT OR REPLACE INTO rates (currency, date_iso, rate) VALUES (?, ?, ?)", rates
+                )
+                await conn.commit()
+
+        await _move_notes(source, "main", batch_size, moved)
+
+        # Архив закрытых лет переезжает в архивы шардов. Триггеры архива меняют только его собственный
+        # баланс, поэтому расходы из архива добавляются в баланс шарда отдельно (как их учла миграция v9).
+        if os.path.exists(source_archive_path):
+            async with aiosqlite.connect(source_archive_path) as source_archive:
+                for shard in all_shards():
+                    async with aiosqlite.connect(archive_path(shard)) as archive_conn:
+                        await run_migrations(archive_conn)
+                archived = dict(moved)
+                await _move_notes(source_archive, ARCHIVE_SCHEMA, batch_size, moved)
+            for shard in all_shards():
+                if moved[shard] == archived[shard]:
+                    continue
+                async with get_async_sqlite_session(shard=shard) as conn:
+                    await attach_archive(conn, shard)
+                    await conn.execute(
+                        f"""
+                        INSERT INTO main.balance (user_tg_id, expense)
+                        SELECT user_tg_id, SUM({base_summ_sql('archived')}) FROM {ARCHIVE_SCHEMA}.out AS archived
+                        WHERE true GROUP BY user_tg_id
+                        ON CONFLICT (user_tg_id) DO UPDATE SET expense = expense + excluded.expense
+                        """
+                    )
+                    await conn.commit()
+
+        # Доходы переезжают в шард пользователя; баланс шарда обновляют триггеры на вставку.
+        cursor = await source.execute(
+            "SELECT user_tg_id, category, summ, description, date, date_iso FROM income ORDER BY rowid"
+        )
+        incomes = await cursor.fetchall()
+        await cursor.close()
+        for shard in all_shards():
+            shard_incomes = [row for row in incomes if shard_for_user(row[0]) == shard]
+            if shard_incomes:
+                async with get_async_sqlite_session(shard=shard) as conn:
+                    await conn.executemany(
+                        "INSERT INTO income (user_tg_id, category, summ, description, date, date_iso) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        shard_incomes
+                    )
+                    await conn.commit()
+
+        # Правила регулярных расходов переезжают в шард пользователя со своими id,
+        # на которые ссылается out.recurring_id.
+        cursor = await source.execute("SELECT * FROM recurring")
+        rules = await cursor.fetchall()
+        await cursor.close()
+        for rule in rules:
+            async with get_async_sqlite_session(shard=shard_for_user(rule[1])) as conn:
+                await conn.execute(f"INSERT INTO recurring VALUES ({', '.join('?' * len(rule))})", tuple(rule))
+                await conn.commit()
+    finally:
+        await source.close()
+
+
+if __name__ == "__main__":
+    # Использование: python -m app.sharding rebalance [путь к исходному файлу БД]
+    if len(sys.argv) < 2 or sys.argv[1] != "rebalance":
+        print("Использование: python -m app.sharding rebalance [исходный_файл.db]")
+        sys.exit(1)
+    source_file = sys.argv[2] if len(sys.argv) > 2 else config.DATABASE_NAME
+    asyncio.run(rebalance_from_single(source_file))
@@ -0,0 +1,915 @@
+import re
+import logging
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from bisect import bisect_left, bisect_right
+from datetime import date as date_type, datetime
+from typing import (Any, AsyncContextManager, AsyncIterator, Callable, Coroutine, Dict, Iterator, List, NamedTuple,
+                    Optional, Tuple)
+
+import aiosqlite
+
+import config
+from app.archive import ARCHIVE_SCHEMA, attach_archive, archive_worker, hot_cutoff
+from app.logging_setup import SAMPLED
+from app.backup import backup_worker
+from app.currency import BASE_CURRENCY, RateRow, base_summ_sql, get_rate_cache
+from app import dbstats
+from app.periods import month_bounds
+from app.database import get_async_sqlite_session, get_shard_write_lock, fan_out, update_tables, wait_for_writes
+from app.groups import get_groups
+from app.recurring import due_dates
+from app.sharding import shard_for_user
+
+logger = logging.getLogger(__name__)
+
+# Фабрика соединений: (user_tg_id=None, shard=None) -> async with ... as connection
+SessionFactory = Callable[..., AsyncContextManager[aiosqlite.Connection]]
+
+
+def build_fts_query(terms: List[str]) -> str:
+    """
+    Запрос FTS5 из слов пользователя: каждое слово в кавычках (без операторов FTS5)
+    и с поиском по префиксу, чтобы "стоматолог" находил и "стоматологу".
+    """
+    return " ".join('"' + term.replace('"', '""') + '"*' for term in terms)
+
+
+def comparison_periods(month: int, year: int) -> Dict[str, Tuple[str, str]]:
+    """
+    Периоды для сравнения: выбранный месяц, предыдущий месяц и тот же месяц год назад.
+    :return: {"current": (start, end), "previous": (start, end), "last_year": (start, end)}
+    """
+    previous_month, previous_year = (12, year - 1) if month == 1 else (month - 1, year)
+    return {
+        "current": month_bounds(month, year),
+        "previous": month_bounds(previous_month, previous_year),
+        "last_year": month_bounds(month, year - 1),
+    }
+
+
+# Размер пачки строк при потоковом чтении записей (iter_notes_by_user_and_period).
+NOTES_CHUNK_SIZE = 500
+
+
+class StorageError(Exception):
+    """Хранилище недоступно или запрос к нему не выполнен. Обработчики бота отвечают "попробуйте позже"."""
+
+
+@contextmanager
+def storage_errors(message: str, *args) -> Iterator[None]:
+    """
+    Пишет ошибку хранилища в лог (message - с %-аргументами args) и поднимает вместо нее StorageError.
+    """
+    try:
+        yield
+    except StorageError:
+        raise
+    except Exception as ex:
+        logger.error(message + ": %s", *args, ex, exc_info=True)
+        raise StorageError(message % args) from ex
+
+
+class NoteRecord(NamedTuple):
+    """Запись о расходе при потоковом чтении: кортеж без словаря на каждую строку. summ - в базовой валюте."""
+    user_tg_id: int
+    category: str
+    summ: int
+    description: str
+    date: str
+
+
+class Storage(ABC):
+    """
+    Интерфейс хранилища записей.
+    crud и ReportHandler работают только через него и не знают, где лежат данные.
+    Ошибка базы данных в любом методе поднимает StorageError, а не возвращает пустой результат:
+    пустой список или нулевой баланс нельзя отличить от настоящих данных.
+    """
+
+    @abstractmethod
+    async def add_note(self, user_tg_id: int, category: str, sub_category: str, summ: int,
+                       description: str, date: datetime, currency: Optional[str] = None) -> bool:
+        """
+        Добавляет запись о расходе. Возвращает True после записи.
+        summ - в копейках (app.money), как и все суммы хранилища.
+        currency - код валюты суммы (None - базовая валюта). Отчеты, поиск и баланс
+        получают суммы уже пересчитанными в базовую валюту по курсу на дату записи.
+        """
+
+    @abstractmethod
+    async def get_notes_by_user_and_month(self, user_tg_id: int, month: int, year: int) -> List[Dict[str, Any]]:
+        """Записи пользователя за месяц (ключи: user_tg_id, category, summ, description, date)."""
+
+    @abstractmethod
+    async def add_income(self, user_tg_id: int, category: str, summ: int, description: str, date: datetime) -> bool:
+        """Добавляет запись о доходе. Возвращает True после записи."""
+
+    @abstractmethod
+    async def get_balance(self, user_tg_id: int) -> Dict[str, int]:
+        """Баланс пользователя за всю историю: {"income", "expense", "balance"}."""
+
+    @abstractmethod
+    def iter_notes_by_user_and_period(self, user_tg_id: int, start_date: str, end_date: str,
+                                      chunk_size: int = NOTES_CHUNK_SIZE) -> AsyncIterator[NoteRecord]:
+        """
+        Записи пользователя за период [start_date, end_date) по одной (async for).
+        В памяти одновременно не больше chunk_size строк, для больших периодов и агрегации.
+        """
+
+    @abstractmethod
+    async def get_totals_by_month(self, month: int, year: int) -> Dict[int, int]:
+        """Суммы расходов всех пользователей за месяц: {user_tg_id: сумма}."""
+
+    async def prepare(self):
+        """Подготавливает хранилище к работе (схема БД и т.п.). Вызывается при старте бота."""
+
+    @abstractmethod
+    async def search_notes(self, user_tg_id: int, terms: List[str], start_date: str, end_date: str,
+                           limit: int = 20) -> Dict[str, Any]:
+        """
+        Полнотекстовый поиск по описанию, категории и подкатегории за период [start_date, end_date).
+        Каждое слово из terms ищется как префикс слова в записи, все слова должны совпасть.
+        :return: {"notes": последние limit записей (новые первыми), "count": всего найдено, "total": их сумма}
+        """
+
+    @abstractmethod
+    async def get_category_comparison(self, user_tg_id: int, month: int, year: int) -> List[Dict[str, Any]]:
+        """
+        Суммы по категориям за месяц, предыдущий месяц и тот же месяц год назад (см. comparison_periods).
+        :return: Строки {"category", "current", "previous", "last_year"}, по убыванию current.
+        """
+
+    @abstractmethod
+    async def sync_groups(self, groups: Dict[str, List[int]]):
+        """Заменяет состав общих групп учета (app.groups): {название: [user_tg_id участников]}."""
+
+    @abstractmethod
+    async def get_group_totals(self, group: str, start_date: str, end_date: str) -> List[Dict[str, Any]]:
+        """
+        Суммы расходов участников группы за период [start_date, end_date).
+        :return: Строки {"user_tg_id", "category", "date", "total", "notes"} - по участнику, категории и дню.
+        """
+
+    @abstractmethod
+    async def get_category_usage(self, user_tg_id: int) -> List[Dict[str, Any]]:
+        """
+        Использование категорий пользователя для подсказок (app.suggestions).
+        :return: Строки {"category", "sub_category", "uses", "last_date"}; last_date - "ГГГГ-ММ-ДД".
+        """
+
+    @abstractmethod
+    async def add_recurring(self, user_tg_id: int, category: str, sub_category: str, summ: int, description: str,
+                            day_of_month: Optional[int], weekday: Optional[int], start_date: date_type) -> int:
+        """
+        Добавляет правило регулярного расхода: ежемесячно в день day_of_month или еженедельно в день weekday.
+        Платежи создаются за даты после start_date.
+        :return: Номер правила.
+        """
+
+    @abstractmethod
+    async def get_recurring(self, user_tg_id: int) -> List[Dict[str, Any]]:
+        """
+        Правила пользователя (ключи: id, category, sub_category, summ, description, day_of_month, weekday).
+        """
+
+    @abstractmethod
+    async def delete_recurring(self, user_tg_id: int, rule_id: int) -> bool:
+        """Удаляет правило пользователя. Уже созданные записи остаются."""
+
+    @abstractmethod
+    async def materialize_recurring(self, today: date_type) -> Dict[int, int]:
+        """
+        Создает записи по всем правилам всех пользователей за даты до today включительно,
+        которые еще не были созданы. Повторный вызов за тот же день ничего не добавляет.
+        :return: Количество созданных записей по пользователям: {user_tg_id: записей} (только с новыми записями).
+        """
+
+    @abstractmethod
+    async def is_processed(self, chat_id: int, message_id: int) -> bool:
+        """Было ли сообщение (chat_id, message_id) уже обработано (ключ записан mark_processed)."""
+
+    @abstractmethod
+    async def mark_processed(self, chat_id: int, message_id: int, processed_at: int) -> bool:
+        """
+        Запоминает успешно обработанное сообщение (chat_id, message_id) (processed_at - unix-время).
+        :return: False, если ключ уже записан (сообщение одновременно обработал другой процесс).
+        """
+
+    @abstractmethod
+    async def expire_processed(self, before: int) -> int:
+        """
+        Удаляет ключи обработанных сообщений с processed_at < before.
+        :return: Количество удаленных ключей.
+        """
+
+    def background_jobs(self) -> List[Coroutine[Any, Any, None]]:
+        """Фоновые задачи обслуживания хранилища, которые бот запускает после старта."""
+        return []
+
+    async def close(self):
+        """Освобождает ресурсы хранилища."""
+
+
+class SQLiteStorage(Storage):
+    """Хранилище в файлах SQLite (с учетом шардов из app.sharding)."""
+
+    # SQL-запросы хранилища.
+    # Фильтр по диапазону date_iso ("ГГГГ-ММ-ДД") использует индекс (user_tg_id, date_iso),
+    # в отличие от вычисления STRFTIME по каждой строке.
+    SQL_INSERT_NOTE = (
+        "INSERT INTO out (user_tg_id, category, sub_category, summ, description, date, date_iso, currency) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+    )
+    # {out} - источник записей: основная таблица или она же вместе с архивом (см. _out_source).
+    # Суммы в валюте пересчитываются в базовую в том же запросе (base_summ_sql, курс из таблицы rates).
+    SQL_NOTES_BY_USER_AND_PERIOD = f"""
+                SELECT user_tg_id, category, {base_summ_sql('note')} AS summ, description, date
+                FROM {{out}} AS note
+                WHERE user_tg_id = ?
+                  AND date_iso >= ?
+                  AND date_iso < ?;
+            """
+    SQL_TOTALS_BY_PERIOD = (
+        f"SELECT user_tg_id, SUM({base_summ_sql('note')}) AS total FROM {{out}} AS note "
+        "WHERE date_iso >= ? AND date_iso < ? GROUP BY user_tg_id"
+    )
+
+    # Поиск по полнотекстовому индексу. {schema} - main или архив.
+    # Оконные функции считают количество и сумму по всем совпадениям до LIMIT.
+    SQL_SEARCH_NOTES = f"""
+                SELECT date, date_iso, category, sub_category, {base_summ_sql('note')} AS summ, description,
+                       COUNT(*) OVER () AS match_count,
+                       SUM({base_summ_sql('note')}) OVER () AS match_total
+                FROM {{schema}}.out AS note
+                WHERE rowid IN (SELECT rowid FROM {{schema}}.out_fts WHERE out_fts MATCH ?)
+                  AND user_tg_id = ?
+                  AND date_iso >= ?
+                  AND date_iso < ?
+                ORDER BY date_iso DESC, rowid DESC
+                LIMIT ?;
+            """
+
+    # Сравнение периодов одним запросом: условная агрегация по категориям.
+    # Предыдущий и текущий месяц идут подряд, поэтому читаются одним диапазоном индекса,
+    # месяц год назад - вторым (каждое условие OR содержит user_tg_id, чтобы использовать индекс).
+    SQL_CATEGORY_COMPARISON = f"""
+                SELECT category,
+                       SUM(CASE WHEN date_iso >= :current_start AND date_iso < :current_end
+                                THEN {base_summ_sql('note')} ELSE 0 END) AS current,
+                       SUM(CASE WHEN date_iso >= :previous_start AND date_iso < :previous_end
+                                THEN {base_summ_sql('note')} ELSE 0 END) AS previous,
+                       SUM(CASE WHEN date_iso >= :last_year_start AND date_iso < :last_year_end
+                                THEN {base_summ_sql('note')} ELSE 0 END) AS last_year
+                FROM {{out}} AS note
+                WHERE (user_tg_id = :user_tg_id AND date_iso >= :previous_start AND date_iso < :current_end)
+                   OR (user_tg_id = :user_tg_id AND date_iso >= :last_year_start AND date_iso < :last_year_end)
+                GROUP BY category
+                ORDER BY current DESC, previous DESC, category;
+            """
+
+    # Общие группы учета (app.groups). Записи всех участников читаются одним запросом:
+    # IN по участникам группы дает по диапазону индекса (user_tg_id, date_iso) на участника.
+    # {schema} - main или архив (как в SQL_SEARCH_NOTES): через объединение с архивом IN не доходит до индекса.
+    SQL_DELETE_GROUP_MEMBERS = "DELETE FROM group_members"
+    SQL_INSERT_GROUP_MEMBER = "INSERT INTO group_members (group_name, user_tg_id) VALUES (?, ?)"
+    SQL_GROUP_TOTALS = f"""
+                SELECT user_tg_id, category, date, SUM({base_summ_sql('note')}) AS total, COUNT(*) AS notes
+                FROM {{schema}}.out AS note
+                WHERE user_tg_id IN (SELECT user_tg_id FROM main.group_members WHERE group_name = ?)
+                  AND date_iso >= ?
+                  AND date_iso < ?
+                GROUP BY user_tg_id, category, date;
+            """
+
+    # Частота категорий и подкатегорий для подсказок (app.suggestions). Читаются только горячие данные:
+    # категории закрытых лет для подсказок не нужны.
+    SQL_CATEGORY_USAGE = (
+        "SELECT category, sub_category, COUNT(*) AS uses, MAX(date_iso) AS last_date FROM out "
+        "WHERE user_tg_id = ? GROUP BY category, sub_category"
+    )
+
+    # Доходы и баланс. Строку balance обновляют триггеры на вставку в out и income (миграция 8).
+    SQL_INSERT_INCOME = (
+        "INSERT INTO income (user_tg_id, category, summ, description, date, date_iso) VALUES (?, ?, ?, ?, ?, ?)"
+    )
+    SQL_BALANCE_BY_USER = "SELECT income, expense FROM balance WHERE user_tg_id = ?"
+
+    # Обработанные сообщения (app.dedupe). Повтор отклоняется первичным ключом (chat_id, message_id).
+    SQL_MARK_PROCESSED = (
+        "INSERT OR IGNORE INTO processed_updates (chat_id, message_id, processed_at) VALUES (?, ?, ?)"
+    )
+    SQL_IS_PROCESSED = "SELECT 1 FROM processed_updates WHERE chat_id = ? AND message_id = ?"
+    SQL_EXPIRE_PROCESSED = "DELETE FROM processed_updates WHERE processed_at < ?"
+
+    # Курсы валют (app.currency): таблица целиком заменяется содержимым файла курсов.
+    SQL_DELETE_RATES = "DELETE FROM rates"
+    SQL_INSERT_RATE = "INSERT INTO rates (currency, date_iso, rate) VALUES (?, ?, ?)"
+
+    # Регулярные расходы (app.recurring).
+    SQL_INSERT_RECURRING = (
+        "INSERT INTO recurring (user_tg_id, category, sub_category, summ, description, day_of_month, weekday, "
+        "last_date) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+    )
+    SQL_RECURRING_BY_USER = (
+        "SELECT id, category, sub_category, summ, description, day_of_month, weekday "
+        "FROM recurring WHERE user_tg_id = ? ORDER BY id"
+    )
+    SQL_DELETE_RECURRING = "DELETE FROM recurring WHERE id = ? AND user_tg_id = ?"
+    SQL_DUE_RECURRING = (
+        "SELECT id, user_tg_id, category, sub_category, summ, description, day_of_month, weekday, last_date "
+        "FROM recurring WHERE last_date < ?"
+    )
+    # OR IGNORE вместе с уникальным индексом (recurring_id, date_iso) исключает дубли при повторном запуске.
+    SQL_INSERT_RECURRING_NOTE = (
+        "INSERT OR IGNORE INTO out (user_tg_id, category, sub_category, summ, description, date, date_iso, "
+        "recurring_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+    )
+    SQL_UPDATE_RECURRING_LAST_DATE = "UPDATE recurring SET last_date = ? WHERE id = ?"
+    # Записи по правилам к исполнению (last_date < ?) за даты после last_date до ? включительно, по пользователям:
+    # разница до и после вставки - число созданных записей (по уникальному индексу (recurring_id, date_iso)).
+    SQL_RECURRING_NOTE_COUNTS = (
+        "SELECT recurring.user_tg_id, COUNT(*) AS notes FROM recurring "
+        "JOIN out ON out.recurring_id = recurring.id AND out.date_iso > recurring.last_date AND out.date_iso <= ? "
+        "WHERE recurring.last_date < ? GROUP BY recurring.user_tg_id"
+    )
+
+    def __init__(self, session_factory: Optional[SessionFactory] = None):
+        # Если фабрика не передана, используется get_async_sqlite_session.
+        self._session_factory = session_factory
+
+    async def prepare(self):
+        # Миграции схемы на всех шардах, курсы валют из файла и состав групп из config.GROUPS.
+        await update_tables()
+        await self.sync_rates(get_rate_cache().rows())
+        await self.sync_groups(get_groups())
+
+    async def sync_rates(self, rates: List[RateRow]):
+        """Заменяет курсы в таблице rates всех шардов (одна транзакция на шард)."""
+        async def sync_on_shard(connection: aiosqlite.Connection, shard: int):
+            async with self._write_lock(shard=shard):
+                cursor = await dbstats.execute(connection, "SQL_DELETE_RATES", self.SQL_DELETE_RATES)
+                await cursor.close()
+                cursor = await dbstats.execute_many(connection, "SQL_INSERT_RATE", self.SQL_INSERT_RATE, rates)
+                await cursor.close()
+                await connection.commit()
+
+        await fan_out(sync_on_shard, session_factory=self._session)
+
+    async def sync_groups(self, groups: Dict[str, List[int]]):
+        # Состав групп нужен на каждом шарде: участники группы могут жить в разных шардах.
+        members = [(group, user_tg_id) for group, users in groups.items() for user_tg_id in users]
+
+        async def sync_on_shard(connection: aiosqlite.Connection, shard: int):
+            async with self._write_lock(shard=shard):
+                cursor = await dbstats.execute(connection, "SQL_DELETE_GROUP_MEMBERS", self.SQL_DELETE_GROUP_MEMBERS)
+                await cursor.close()
+                cursor = await dbstats.execute_many(
+                    connection, "SQL_INSERT_GROUP_MEMBER", self.SQL_INSERT_GROUP_MEMBER, members
+                )
+                await cursor.close()
+                await connection.commit()
+
+        await fan_out(sync_on_shard, session_factory=self._session)
+
+    def background_jobs(self) -> List[Coroutine[Any, Any, None]]:
+        # Перенос закрытых лет в архив (app.archive) и резервные копии (app.backup).
+        return [archive_worker(), backup_worker()]
+
+    async def close(self):
+        # Соединения открываются на время запроса, поэтому достаточно дождаться начатых записей:
+        # после этого открытых соединений для записи не остается.
+        await wait_for_writes()
+
+    @staticmethod
+    def _out_source(with_archive: bool) -> str:
+        """Таблица для FROM: только горячие данные или объединение с архивом закрытых лет."""
+        if not with_archive:
+            return "out"
+        return f"(SELECT * FROM main.out UNION ALL SELECT * FROM {ARCHIVE_SCHEMA}.out)"
+
+    @staticmethod
+    async def _use_archive(connection: aiosqlite.Connection, start_date: str, shard: int) -> bool:
+        """Подключает архив, если период начинается раньше границы горячих данных."""
+        return start_date < hot_cutoff() and await attach_archive(connection, shard)
+
+    def _session(self, user_tg_id: Optional[int] = None, shard: Optional[int] = None):
+        # Время получения соединения учитывается в статистике запросов (app.dbstats).
+        factory = self._session_factory or get_async_sqlite_session
+        return dbstats.track_wait(factory(user_tg_id=user_tg_id, shard=shard))
+
+    @staticmethod
+    def _write_lock(user_tg_id: Optional[int] = None, shard: Optional[int] = None):
+        return dbstats.track_wait(get_shard_write_lock(user_tg_id, shard))
+
+    async def add_note(self, user_tg_id: int, category: str, sub_category: str, summ: int,
+                       description: str, date: datetime, currency: Optional[str] = None) -> bool:
+        date_str = date.strftime("%d.%m.%Y")  # Формат даты: день, месяц, год
+        date_iso = date.strftime("%Y-%m-%d")  # Для выборок по диапазону дат через индекс
+        with storage_errors("Ошибка добавления данных в БД для пользователя ID %s", user_tg_id):
+            # Записи в один шард выполняются по очереди, в разные шарды - параллельно.
+            async with self._write_lock(user_tg_id), self._session(user_tg_id) as connection:
+                cursor = await dbstats.execute(
+                    connection, "SQL_INSERT_NOTE", self.SQL_INSERT_NOTE,
+                    (user_tg_id, category, sub_category, summ, description, date_str, date_iso,
+                     None if currency == BASE_CURRENCY else currency)
+                )
+                await cursor.close()
+                await connection.commit()
+
+        logger.info("Запись успешно добавлена для пользователя ID: %s.", user_tg_id, extra=SAMPLED)
+        return True
+
+    async def get_notes_by_user_and_month(self, user_tg_id: int, month: int, year: int) -> List[Dict[str, Any]]:
+        start_date, end_date = month_bounds(month, year)
+        with storage_errors("Ошибка асинхронного получения данных из БД для user_tg_id %s", user_tg_id):
+            async with self._session(user_tg_id) as connection:
+                with_archive = await self._use_archive(connection, start_date, shard_for_user(user_tg_id))
+                query = self.SQL_NOTES_BY_USER_AND_PERIOD.format(out=self._out_source(with_archive))
+                rows = await dbstats.fetch_all(
+                    connection, "SQL_NOTES_BY_USER_AND_PERIOD", query, (user_tg_id, start_date, end_date)
+                )
+
+        # row_factory = aiosqlite.Row, поэтому строка преобразуется в словарь.
+        notes = [dict(row) for row in rows]
+        logger.info("Получено %d записей для user_tg_id=%s за %s.%s.", len(notes), user_tg_id, month, year,
+                    extra=SAMPLED)
+        return notes
+
+    async def add_income(self, user_tg_id: int, category: str, summ: int, description: str, date: datetime) -> bool:
+        with storage_errors("Ошибка добавления дохода для пользователя ID %s", user_tg_id):
+            async with self._write_lock(user_tg_id), self._session(user_tg_id) as connection:
+                # Вставка и обновление баланса (триггер) фиксируются одним коммитом.
+                cursor = await dbstats.execute(
+                    connection, "SQL_INSERT_INCOME", self.SQL_INSERT_INCOME,
+                    (user_tg_id, category, summ, description, date.strftime("%d.%m.%Y"), date.strftime("%Y-%m-%d"))
+                )
+                await cursor.close()
+                await connection.commit()
+        logger.info("Доход добавлен для пользователя ID: %s.", user_tg_id, extra=SAMPLED)
+        return True
+
+    async def get_balance(self, user_tg_id: int) -> Dict[str, int]:
+        with storage_errors("Ошибка получения баланса для user_tg_id %s", user_tg_id):
+            async with self._session(user_tg_id) as connection:
+                rows = await dbstats.fetch_all(connection, "SQL_BALANCE_BY_USER", self.SQL_BALANCE_BY_USER,
+                                               (user_tg_id,))
+        income, expense = (rows[0]["income"], rows[0]["expense"]) if rows else (0, 0)
+        return {"income": income, "expense": expense, "balance": income - expense}
+
+    async def is_processed(self, chat_id: int, message_id: int) -> bool:
+        with storage_errors("Ошибка проверки ключа сообщения %s в чате %s", message_id, chat_id):
+            async with self._session(chat_id) as connection:
+                rows = await dbstats.fetch_all(connection, "SQL_IS_PROCESSED", self.SQL_IS_PROCESSED,
+                                               (chat_id, message_id))
+        return bool(rows)
+
+    async def mark_processed(self, chat_id: int, message_id: int, processed_at: int) -> bool:
+        with storage_errors("Ошибка записи ключа сообщения %s в чате %s", message_id, chat_id):
+            # Ключи лежат в шарде чата (для личного чата chat_id совпадает с user_tg_id).
+            async with self._write_lock(chat_id), self._session(chat_id) as connection:
+                cursor = await dbstats.execute(connection, "SQL_MARK_PROCESSED", self.SQL_MARK_PROCESSED,
+                                               (chat_id, message_id, processed_at))
+                inserted = cursor.rowcount > 0
+                await cursor.close()
+                await connection.commit()
+        return inserted
+
+    async def expire_processed(self, before: int) -> int:
+        async def expire_on_shard(connection: aiosqlite.Connection, shard: int) -> int:
+            async with self._write_lock(shard=shard):
+                cursor = await dbstats.execute(connection, "SQL_EXPIRE_PROCESSED", self.SQL_EXPIRE_PROCESSED,
+                                               (before,))
+                deleted = max(cursor.rowcount, 0)
+                await cursor.close()
+                await connection.commit()
+            return deleted
+
+        with storage_errors("Ошибка удаления устаревших ключей сообщений"):
+            return sum(await fan_out(expire_on_shard, session_factory=self._session))
+
+    async def iter_notes_by_user_and_period(self, user_tg_id: int, start_date: str, end_date: str,
+                                            chunk_size: int = NOTES_CHUNK_SIZE) -> AsyncIterator[NoteRecord]:
+        with storage_errors("Ошибка чтения записей из БД для user_tg_id %s", user_tg_id):
+            async with self._session(user_tg_id) as connection:
+                with_archive = await self._use_archive(connection, start_date, shard_for_user(user_tg_id))
+                query = self.SQL_NOTES_BY_USER_AND_PERIOD.format(out=self._out_source(with_archive))
+                # Строки сразу строятся как NoteRecord, без промежуточных aiosqlite.Row.
+                async for record in dbstats.iterate(connection, "SQL_NOTES_BY_USER_AND_PERIOD", query,
+                                                    (user_tg_id, start_date, end_date), chunk_size, NoteRecord._make):
+                    yield record
+
+    async def get_totals_by_month(self, month: int, year: int) -> Dict[int, int]:
+        start_date, end_date = month_bounds(month, year)
+
+        async def totals_on_shard(connection: aiosqlite.Connection, shard: int) -> Dict[int, int]:
+            with_archive = await self._use_archive(connection, start_date, shard)
+            query = self.SQL_TOTALS_BY_PERIOD.format(out=self._out_source(with_archive))
+            rows = await dbstats.fetch_all(connection, "SQL_TOTALS_BY_PERIOD", query, (start_date, end_date))
+            return {row['user_tg_id']: row['total'] for row in rows}
+
+        totals: Dict[int, int] = {}
+        with storage_errors("Ошибка получения сумм по всем пользователям за %s.%s", month, year):
+            for shard_totals in await fan_out(totals_on_shard, session_factory=self._session):
+                totals.update(shard_totals)
+        return totals
+
+    async def search_notes(self, user_tg_id: int, terms: List[str], start_date: str, end_date: str,
+                           limit: int = 20) -> Dict[str, Any]:
+        result = {"notes": [], "count": 0, "total": 0}
+        params = (build_fts_query(terms), user_tg_id, start_date, end_date, limit)
+        with storage_errors("Ошибка поиска записей для user_tg_id %s", user_tg_id):
+            async with self._session(user_tg_id) as connection:
+                schemas = ["main"]
+                if await self._use_archive(connection, start_date, shard_for_user(user_tg_id)):
+                    schemas.append(ARCHIVE_SCHEMA)
+
+                for schema in schemas:
+                    rows = await dbstats.fetch_all(
+                        connection, "SQL_SEARCH_NOTES", self.SQL_SEARCH_NOTES.format(schema=schema), params
+                    )
+                    if rows:
+                        result["count"] += rows[0]["match_count"]
+                        result["total"] += rows[0]["match_total"]
+                        result["notes"].extend(
+                            {key: row[key]
+                             for key in ("date", "date_iso", "category", "sub_category", "summ", "description")}
+                            for row in rows
+                        )
+
+        result["notes"].sort(key=lambda note: note["date_iso"], reverse=True)
+        del result["notes"][limit:]
+        return result
+
+    async def get_category_comparison(self, user_tg_id: int, month: int, year: int) -> List[Dict[str, Any]]:
+        periods = comparison_periods(month, year)
+        params = {"user_tg_id": user_tg_id}
+        for name, (start_date, end_date) in periods.items():
+            params[f"{name}_start"], params[f"{name}_end"] = start_date, end_date
+
+        with storage_errors("Ошибка получения сравнения по категориям для user_tg_id %s", user_tg_id):
+            async with self._session(user_tg_id) as connection:
+                with_archive = await self._use_archive(
+                    connection, periods["last_year"][0], shard_for_user(user_tg_id)
+                )
+                query = self.SQL_CATEGORY_COMPARISON.format(out=self._out_source(with_archive))
+                rows = await dbstats.fetch_all(connection, "SQL_CATEGORY_COMPARISON", query, params)
+        return [dict(row) for row in rows]
+
+    async def get_group_totals(self, group: str, start_date: str, end_date: str) -> List[Dict[str, Any]]:
+        # Один запрос на шард; при одном шарде - один запрос на весь отчет группы
+        # (второй - по архиву, если период начинается в закрытом году).
+        async def totals_on_shard(connection: aiosqlite.Connection, shard: int) -> List[Dict[str, Any]]:
+            schemas = ["main"]
+            if await self._use_archive(connection, start_date, shard):
+                schemas.append(ARCHIVE_SCHEMA)
+            totals = []
+            for schema in schemas:
+                query = self.SQL_GROUP_TOTALS.format(schema=schema)
+                rows = await dbstats.fetch_all(connection, "SQL_GROUP_TOTALS", query, (group, start_date, end_date))
+                totals.extend(dict(row) for row in rows)
+            return totals
+
+        with storage_errors("Ошибка получения итогов группы %s", group):
+            shard_totals = await fan_out(totals_on_shard, session_factory=self._session)
+        return [row for rows in shard_totals for row in rows]
+
+    async def get_category_usage(self, user_tg_id: int) -> List[Dict[str, Any]]:
+        with storage_errors("Ошибка получения категорий для user_tg_id %s", user_tg_id):
+            async with self._session(user_tg_id) as connection:
+                rows = await dbstats.fetch_all(connection, "SQL_CATEGORY_USAGE", self.SQL_CATEGORY_USAGE,
+                                               (user_tg_id,))
+        return [dict(row) for row in rows]
+
+    async def add_recurring(self, user_tg_id: int, category: str, sub_category: str, summ: int, description: str,
+                            day_of_month: Optional[int], weekday: Optional[int], start_date: date_type) -> int:
+        with storage_errors("Ошибка добавления регулярного расхода для user_tg_id %s", user_tg_id):
+            async with self._write_lock(user_tg_id), self._session(user_tg_id) as connection:
+                cursor = await dbstats.execute(
+                    connection, "SQL_INSERT_RECURRING", self.SQL_INSERT_RECURRING,
+                    (user_tg_id, category, sub_category, summ, description, day_of_month, weekday,
+                     start_date.isoformat())
+                )
+                rule_id = cursor.lastrowid
+                await cursor.close()
+                await connection.commit()
+        return rule_id
+
+    async def get_recurring(self, user_tg_id: int) -> List[Dict[str, Any]]:
+        with storage_errors("Ошибка получения регулярных расходов для user_tg_id %s", user_tg_id):
+            async with self._session(user_tg_id) as connection:
+                rows = await dbstats.fetch_all(connection, "SQL_RECURRING_BY_USER", self.SQL_RECURRING_BY_USER,
+                                               (user_tg_id,))
+        return [dict(row) for row in rows]
+
+    async def delete_recurring(self, user_tg_id: int, rule_id: int) -> bool:
+        with storage_errors("Ошибка удаления регулярного расхода %s для user_tg_id %s", rule_id, user_tg_id):
+            async with self._write_lock(user_tg_id), self._session(user_tg_id) as connection:
+                cursor = await dbstats.execute(connection, "SQL_DELETE_RECURRING", self.SQL_DELETE_RECURRING,
+                                               (rule_id, user_tg_id))
+                deleted = cursor.rowcount > 0
+                await cursor.close()
+                await connection.commit()
+        return deleted
+
+    async def materialize_recurring(self, today: date_type) -> Dict[int, int]:
+        today_iso = today.isoformat()
+
+        async def materialize_on_shard(connection: aiosqlite.Connection, shard: int) -> Dict[int, int]:
+            async with self._write_lock(shard=shard):
+                # Правила читаются и обновляются в одной транзакции с вставкой записей.
+                await connection.execute("BEGIN IMMEDIATE")
+                try:
+                    rules = await dbstats.fetch_all(connection, "SQL_DUE_RECURRING", self.SQL_DUE_RECURRING,
+                                                    (today_iso,))
+
+                    notes = [
+                        (rule["user_tg_id"], rule["category"], rule["sub_category"], rule["summ"],
+                         rule["description"], due.strftime("%d.%m.%Y"), due.isoformat(), rule["id"])
+                        for rule in rules
+                        for due in due_dates(rule["day_of_month"], rule["weekday"],
+                                             date_type.fromisoformat(rule["last_date"]), today)
+                    ]
+                    created = {}
+                    if notes:
+                        # Одна пакетная вставка на шард за запуск. Уже созданные платежи пропускает OR IGNORE,
+                        # поэтому новые записи по пользователям - разница счетчиков до и после вставки.
+                        counts = (today_iso, today_iso)
+                        before = await dbstats.fetch_all(
+                            connection, "SQL_RECURRING_NOTE_COUNTS", self.SQL_RECURRING_NOTE_COUNTS, counts
+                        )
+                        cursor = await dbstats.execute_many(
+                            connection, "SQL_INSERT_RECURRING_NOTE", self.SQL_INSERT_RECURRING_NOTE, notes
+                        )
+                        await cursor.close()
+                        after = await dbstats.fetch_all(
+                            connection, "SQL_RECURRING_NOTE_COUNTS", self.SQL_RECURRING_NOTE_COUNTS, counts
+                        )
+                        existing = {row["user_tg_id"]: row["notes"] for row in before}
+                        for row in after:
+                            if row["notes"] > existing.get(row["user_tg_id"], 0):
+                                created[row["user_tg_id"]] = row["notes"] - existing.get(row["user_tg_id"], 0)
+                    cursor = await dbstats.execute_many(
+                        connection, "SQL_UPDATE_RECURRING_LAST_DATE", self.SQL_UPDATE_RECURRING_LAST_DATE,
+                        [(today_iso, rule["id"]) for rule in rules]
+                    )
+                    await cursor.close()
+                    await connection.commit()
+                except Exception:
+                    await connection.rollback()
+                    raise
+            return created
+
+        created: Dict[int, int] = {}
+        with storage_errors("Ошибка создания регулярных расходов за %s", today_iso):
+            for shard_created in await fan_out(materialize_on_shard, session_factory=self._session):
+                created.update(shard_created)
+        return created
+
+
+# Слова для поиска в памяти (аналог токенизатора unicode61).
+_WORD_RE = re.compile(r"\w+")
+
+
+class _UserNotes:
+    """Записи одного пользователя в памяти: параллельные массивы, отсортированные по дате."""
+    __slots__ = ("dates", "rows")
+
+    def __init__(self):
+        self.dates: List[str] = []                              # date_iso, по возрастанию
+        self.rows: List[Tuple[str, str, int, str, str]] = []    # (category, sub_category, summ, description, date)
+
+    def insert(self, date_iso: str, row: Tuple[str, str, int, str, str]):
+        # Новая запись встает после записей с той же датой, порядок добавления сохраняется.
+        position = bisect_right(self.dates, date_iso)
+        self.dates.insert(position, date_iso)
+        self.rows.insert(position, row)
+
+    def bounds(self, start_date: str, end_date: str) -> Tuple[int, int]:
+        """Индексы [lo, hi) записей с датой в [start_date, end_date)."""
+        return bisect_left(self.dates, start_date), bisect_left(self.dates, end_date)
+
+    def between(self, start_date: str, end_date: str) -> List[Tuple[str, str, int, str, str]]:
+        lo, hi = self.bounds(start_date, end_date)
+        return self.rows[lo:hi]
+
+
+class MemoryStorage(Storage):
+    """
+    Хранилище в памяти процесса без ввода-вывода.
+    Для быстрых тестов и нагрузочного тестирования логики бота.
+    """
+
+    def __init__(self):
+        self._users: Dict[int, _UserNotes] = {}
+        self._recurring: Dict[int, Dict[str, Any]] = {}    # {id: правило}, как таблица recurring
+        self._recurring_dates: set = set()                 # (id правила, date_iso) уже созданных записей
+        self._next_recurring_id = 1
+        self._balances: Dict[int, List[int]] = {}          # {user_tg_id: [доходы, расходы]}, как таблица balance
+        self._processed: Dict[Tuple[int, int], int] = {}   # {(chat_id, message_id): processed_at}
+        self._groups: Dict[str, List[int]] = {}            # {название группы: участники}, как таблица group_members
+
+    async def add_note(self, user_tg_id: int, category: str, sub_category: str, summ: int,
+                       description: str, date: datetime, currency: Optional[str] = None) -> bool:
+        user_notes = self._users.get(user_tg_id)
+        if user_notes is None:
+            user_notes = self._users[user_tg_id] = _UserNotes()
+        date_iso = date.strftime("%Y-%m-%d")
+        # Курсы не меняются во время работы, поэтому сумма пересчитывается в базовую валюту сразу.
+        summ = get_rate_cache().convert(summ, currency, date_iso)
+        user_notes.insert(date_iso, (category, sub_category, summ, description, date.strftime("%d.%m.%Y")))
+        self._balances.setdefault(user_tg_id, [0, 0])[1] += summ
+        return True
+
+    async def add_income(self, user_tg_id: int, category: str, summ: int, description: str, date: datetime) -> bool:
+        # Сами записи о доходах в памяти не нужны: читается только баланс.
+        self._balances.setdefault(user_tg_id, [0, 0])[0] += summ
+        return True
+
+    async def get_balance(self, user_tg_id: int) -> Dict[str, int]:
+        income, expense = self._balances.get(user_tg_id, (0, 0))
+        return {"income": income, "expense": expense, "balance": income - expense}
+
+    async def is_processed(self, chat_id: int, message_id: int) -> bool:
+        return (chat_id, message_id) in self._processed
+
+    async def mark_processed(self, chat_id: int, message_id: int, processed_at: int) -> bool:
+        if (chat_id, message_id) in self._processed:
+            return False
+        self._processed[(chat_id, message_id)] = processed_at
+        return True
+
+    async def expire_processed(self, before: int) -> int:
+        expired = [key for key, processed_at in self._processed.items() if processed_at < before]
+        for key in expired:
+            del self._processed[key]
+        return len(expired)
+
+    async def get_notes_by_user_and_month(self, user_tg_id: int, month: int, year: int) -> List[Dict[str, Any]]:
+        user_notes = self._users.get(user_tg_id)
+        if user_notes is None:
+            return []
+        return [
+            {"user_tg_id": user_tg_id, "category": category, "summ": summ, "description": description, "date": date}
+            for category, _, summ, description, date in user_notes.between(*month_bounds(month, year))
+        ]
+
+    async def iter_notes_by_user_and_period(self, user_tg_id: int, start_date: str, end_date: str,
+                                            chunk_size: int = NOTES_CHUNK_SIZE) -> AsyncIterator[NoteRecord]:
+        user_notes = self._users.get(user_tg_id)
+        if user_notes is None:
+            return
+        lo, hi = user_notes.bounds(start_date, end_date)
+        # По индексам, без копии среза.
+        for index in range(lo, hi):
+            category, _, summ, description, date = user_notes.rows[index]
+            yield NoteRecord(user_tg_id, category, summ, description, date)
+
+    async def get_totals_by_month(self, month: int, year: int) -> Dict[int, int]:
+        start_date, end_date = month_bounds(month, year)
+        totals: Dict[int, int] = {}
+        for user_tg_id, user_notes in self._users.items():
+            rows = user_notes.between(start_date, end_date)
+            if rows:
+                totals[user_tg_id] = sum(row[2] for row in rows)
+        return totals
+
+    async def search_notes(self, user_tg_id: int, terms: List[str], start_date: str, end_date: str,
+                           limit: int = 20) -> Dict[str, Any]:
+        result = {"notes": [], "count": 0, "total": 0}
+        user_notes = self._users.get(user_tg_id)
+        if user_notes is None:
+            return result
+
+        prefixes = [term.lower() for term in terms]
+        lo, hi = user_notes.bounds(start_date, end_date)
+        # От новых записей к старым, как ORDER BY date_iso DESC в SQLite.
+        for index in range(hi - 1, lo - 1, -1):
+            category, sub_category, summ, description, date = user_notes.rows[index]
+            words = _WORD_RE.findall(f"{description} {category} {sub_category}".lower())
+            if all(any(word.startswith(prefix) for word in words) for prefix in prefixes):
+                result["count"] += 1
+                result["total"] += summ
+                if len(result["notes"]) < limit:
+                    result["notes"].append({
+                        "date": date, "date_iso": user_notes.dates[index], "category": category,
+                        "sub_category": sub_category, "summ": summ, "description": description,
+                    })
+        return result
+
+    async def get_category_comparison(self, user_tg_id: int, month: int, year: int) -> List[Dict[str, Any]]:
+        user_notes = self._users.get(user_tg_id)
+        if user_notes is None:
+            return []
+
+        sums: Dict[str, Dict[str, Any]] = {}
+        for name, (start_date, end_date) in comparison_periods(month, year).items():
+            for category, _, summ, _, _ in user_notes.between(start_date, end_date):
+                row = sums.get(category)
+                if row is None:
+                    row = sums[category] = {"category": category, "current": 0, "previous": 0, "last_year": 0}
+                row[name] += summ
+        return sorted(sums.values(), key=lambda row: (-row["current"], -row["previous"], row["category"]))
+
+    async def sync_groups(self, groups: Dict[str, List[int]]):
+        self._groups = {group: list(users) for group, users in groups.items()}
+
+    async def get_group_totals(self, group: str, start_date: str, end_date: str) -> List[Dict[str, Any]]:
+        totals: Dict[Tuple[int, str, str], Dict[str, Any]] = {}
+        for user_tg_id in self._groups.get(group, ()):
+            user_notes = self._users.get(user_tg_id)
+            if user_notes is None:
+                continue
+            for category, _, summ, _, date in user_notes.between(start_date, end_date):
+                row = totals.get((user_tg_id, category, date))
+                if row is None:
+                    row = totals[(user_tg_id, category, date)] = {
+                        "user_tg_id": user_tg_id, "category": category, "date": date, "total": 0, "notes": 0
+                    }
+                row["total"] += summ
+                row["notes"] += 1
+        return list(totals.values())
+
+    async def get_category_usage(self, user_tg_id: int) -> List[Dict[str, Any]]:
+        user_notes = self._users.get(user_tg_id)
+        if user_notes is None:
+            return []
+
+        usage: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        for date_iso, (category, sub_category, _, _, _) in zip(user_notes.dates, user_notes.rows):
+            row = usage.get((category, sub_category))
+            if row is None:
+                row = usage[(category, sub_category)] = {"category": category, "sub_category": sub_category, "uses": 0}
+            row["uses"] += 1
+            row["last_date"] = date_iso    # Записи отсортированы по дате.
+        return list(usage.values())
+
+    async def add_recurring(self, user_tg_id: int, category: str, sub_category: str, summ: int, description: str,
+                            day_of_month: Optional[int], weekday: Optional[int], start_date: date_type) -> int:
+        rule_id = self._next_recurring_id
+        self._next_recurring_id += 1
+        self._recurring[rule_id] = {
+            "id": rule_id, "user_tg_id": user_tg_id, "category": category, "sub_category": sub_category,
+            "summ": summ, "description": description, "day_of_month": day_of_month, "weekday": weekday,
+            "last_date": start_date,
+        }
+        return rule_id
+
+    async def get_recurring(self, user_tg_id: int) -> List[Dict[str, Any]]:
+        return [
+            {key: rule[key] for key in ("id", "category", "sub_category", "summ", "description", "day_of_month",
+                                        "weekday")}
+            for rule in self._recurring.values() if rule["user_tg_id"] == user_tg_id
+        ]
+
+    async def delete_recurring(self, user_tg_id: int, rule_id: int) -> bool:
+        rule = self._recurring.get(rule_id)
+        if rule is None or rule["user_tg_id"] != user_tg_id:
+            return False
+        del self._recurring[rule_id]
+        return True
+
+    async def materialize_recurring(self, today: date_type) -> Dict[int, int]:
+        created: Dict[int, int] = {}
+        for rule in self._recurring.values():
+            for due in due_dates(rule["day_of_month"], rule["weekday"], rule["last_date"], today):
+                key = (rule["id"], due.isoformat())
+                if key in self._recurring_dates:
+                    continue
+                self._recurring_dates.add(key)
+                await self.add_note(rule["user_tg_id"], rule["category"], rule["sub_category"], rule["summ"],
+                                    rule["description"], datetime.combine(due, datetime.min.time()))
+                created[rule["user_tg_id"]] = created.get(rule["user_tg_id"], 0) + 1
+            rule["last_date"] = max(rule["last_date"], today)
+        return created
+
+
+# Текущее хранилище процесса.
+_storage: Optional[Storage] = None
+
+
+def create_storage(backend: Optional[str] = None) -> Storage:
+    """
+    Создает хранилище по имени: "sqlite" (по умолчанию) или "memory".
+    Имя берется из config.STORAGE_BACKEND, если не передано явно.
+    """
+    backend = backend or getattr(config, "STORAGE_BACKEND", "sqlite")
+    if backend == "sqlite":
+        return SQLiteStorage()
+    if backend == "memory":
+        return MemoryStorage()
+    raise ValueError(f"Неизвестное хранилище: {backend}")
+
+
+def get_storage() -> Storage:
+    """Текущее хранилище (создается при первом обращении)."""
+    global _storage
+    if _storage is None:
+        _storage = create_storage()
+    return _storage
+
+
+def set_storage(storage: Optional[Storage]):
+    """Подменяет текущее хранилище (None - вернуться к хранилищу из config)."""
+    global _storage
+    _storage = storage
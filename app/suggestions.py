@@ -0,0 +1,199 @@
+import asyncio
+import difflib
+import logging
+from datetime import date
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# """
+# Подсказки категорий в памяти процесса.
+# Категории вводятся вручную, и варианты написания ("Еда"/"еда"/"Ед") дробят отчеты.
+# Для каждого пользователя хранится индекс его категорий и подкатегорий с весом по частоте и давности:
+# он строится из таблицы out один раз (при первом обращении), дальше дополняется crud.add_note.
+# По индексу echo_mess приводит написание к известной категории, предлагает дополнение префикса
+# или исправление опечатки (запись - после подтверждения кнопкой, повтор сообщения записывает его как есть)
+# и кнопки с частыми категориями, не обращаясь к БД.
+# """
+
+# Префикс короче этого не дополняется ("Ко" - и "Кофе", и "Коммуналка").
+MIN_PREFIX_LENGTH = 3
+# Опечатки исправляются только в словах не короче этого и при сходстве не меньше TYPO_CUTOFF (difflib).
+MIN_TYPO_LENGTH = 4
+TYPO_CUTOFF = 0.8
+
+
+def get_half_life() -> float:
+    """Период полураспада веса использования в днях из config.SUGGESTION_HALF_LIFE (по умолчанию 30)."""
+    return getattr(config, "SUGGESTION_HALF_LIFE", 30)
+
+
+def normalize(name: str) -> str:
+    """Ключ для сравнения: без пробелов по краям, без учета регистра, "ё" как "е"."""
+    return name.strip().casefold().replace("ё", "е")
+
+
+class Usage:
+    """
+    Вес названия: каждое использование добавляет 1, вес убывает вдвое за get_half_life() дней.
+    Хранится вес на день последнего использования, текущий считается при запросе.
+    """
+    __slots__ = ("name", "score", "day")
+
+    def __init__(self, name: str, day: int):
+        self.name = name
+        self.score = 0.0
+        self.day = day
+
+    def value(self, day: int) -> float:
+        return self.score * 0.5 ** ((day - self.day) / get_half_life())
+
+    def add(self, day: int, uses: float = 1):
+        if day >= self.day:
+            self.score = self.value(day) + uses
+            self.day = day
+        else:
+            # Использование раньше последнего (заполнение из БД в произвольном порядке).
+            self.score += uses * 0.5 ** ((self.day - day) / get_half_life())
+
+
+def _rank(usages: Iterable[Usage], day: int) -> List[Usage]:
+    return sorted(usages, key=lambda usage: (-usage.value(day), usage.name))
+
+
+def _exact(usages: Dict[str, Usage], word: str) -> Optional[str]:
+    """Известное название, совпадающее со словом без учета регистра и "ё"."""
+    usage = usages.get(normalize(word))
+    return usage.name if usage is not None else None
+
+
+def _resolve(usages: Dict[str, Usage], word: str, day: int) -> Optional[str]:
+    """Известное название для слова: точное совпадение, затем префикс, затем ближайшее по написанию."""
+    key = normalize(word)
+    if not key:
+        return None
+    if key in usages:
+        return usages[key].name
+    if len(key) >= MIN_PREFIX_LENGTH:
+        prefixed = [usage for name, usage in usages.items() if name.startswith(key)]
+        if prefixed:
+            return _rank(prefixed, day)[0].name
+    if len(key) >= MIN_TYPO_LENGTH:
+        close = difflib.get_close_matches(key, usages.keys(), n=3, cutoff=TYPO_CUTOFF)
+        if close:
+            return _rank((usages[name] for name in close), day)[0].name
+    return None
+
+
+class CategoryIndex:
+    """Категории и подкатегории одного пользователя с весами использования."""
+
+    def __init__(self):
+        self._categories: Dict[str, Usage] = {}
+        self._sub_categories: Dict[str, Dict[str, Usage]] = {}    # {ключ категории: {ключ подкатегории: вес}}
+
+    def __len__(self) -> int:
+        return len(self._categories)
+
+    def add(self, category: str, sub_category: str, day: date, uses: float = 1):
+        """Учитывает использование категории с подкатегорией (название - последнее встреченное написание)."""
+        ordinal = day.toordinal()
+        key = normalize(category)
+        usage = self._categories.get(key)
+        if usage is None:
+            usage = self._categories[key] = Usage(category, ordinal)
+        usage.add(ordinal, uses)
+
+        sub_key = normalize(sub_category)
+        sub_usages = self._sub_categories.setdefault(key, {})
+        sub_usage = sub_usages.get(sub_key)
+        if sub_usage is None:
+            sub_usage = sub_usages[sub_key] = Usage(sub_category, ordinal)
+        sub_usage.add(ordinal, uses)
+
+    def top(self, limit: int, today: Optional[date] = None) -> List[str]:
+        """Самые используемые категории с учетом давности."""
+        day = (today or date.today()).toordinal()
+        return [usage.name for usage in _rank(self._categories.values(), day)[:limit]]
+
+    def exact(self, category: str) -> Optional[str]:
+        """Известная категория, совпадающая с введенным словом (без учета регистра), или None."""
+        return _exact(self._categories, category)
+
+    def exact_sub(self, category: str, sub_category: str) -> Optional[str]:
+        """Известная подкатегория категории category, совпадающая с введенным словом, или None."""
+        return _exact(self._sub_categories.get(normalize(category), {}), sub_category)
+
+    def resolve(self, category: str, today: Optional[date] = None) -> Optional[str]:
+        """Известная категория для введенного слова или None (новая категория)."""
+        return _resolve(self._categories, category, (today or date.today()).toordinal())
+
+    def resolve_sub(self, category: str, sub_category: str, today: Optional[date] = None) -> Optional[str]:
+        """Известная подкатегория категории category для введенного слова или None."""
+        sub_usages = self._sub_categories.get(normalize(category), {})
+        return _resolve(sub_usages, sub_category, (today or date.today()).toordinal())
+
+
+# Загрузка истории пользователя: строки {"category", "sub_category", "uses", "last_date"} (Storage.get_category_usage).
+UsageLoader = Callable[[int], Awaitable[List[Dict]]]
+
+
+class CategorySuggestions:
+    """Индексы категорий по пользователям. Индекс пользователя заполняется из хранилища один раз."""
+
+    def __init__(self):
+        self._indexes: Dict[int, CategoryIndex] = {}
+        self._loading: Dict[int, asyncio.Task] = {}
+        # Последнее сообщение пользователя, на которое предложена другая категория.
+        self._asked: Dict[int, str] = {}
+
+    async def get(self, user_tg_id: int, load: UsageLoader) -> CategoryIndex:
+        index = self._indexes.get(user_tg_id)
+        if index is not None:
+            return index
+        # Одновременные запросы пользователя ждут одну загрузку, а не читают историю каждый.
+        task = self._loading.get(user_tg_id)
+        if task is None:
+            task = self._loading[user_tg_id] = asyncio.ensure_future(self._load(user_tg_id, load))
+        try:
+            return await asyncio.shield(task)
+        finally:
+            if task.done():
+                self._loading.pop(user_tg_id, None)
+
+    async def _load(self, user_tg_id: int, load: UsageLoader) -> CategoryIndex:
+        index = CategoryIndex()
+        # Каждая пара (категория, подкатегория) приходит одной строкой: все использования
+        # учитываются на дату последнего, этого хватает для порядка подсказок.
+        for row in await load(user_tg_id):
+            index.add(row["category"], row["sub_category"], date.fromisoformat(row["last_date"]), row["uses"])
+        self._indexes[user_tg_id] = index
+        logger.info("Индекс категорий пользователя %s загружен: %d категорий.", user_tg_id, len(index))
+        return index
+
+    def note_added(self, user_tg_id: int, category: str, sub_category: str, day: date):
+        """Учитывает новую запись, если индекс пользователя уже загружен (иначе она войдет в загрузку)."""
+        index = self._indexes.get(user_tg_id)
+        if index is not None:
+            index.add(category, sub_category, day)
+
+    def ask(self, user_tg_id: int, text: str):
+        """Запоминает сообщение, на которое предложена исправленная категория."""
+        self._asked[user_tg_id] = text
+
+    def confirmed(self, user_tg_id: int, text: str) -> bool:
+        """
+        True, если пользователь повторил сообщение, на которое предложена другая категория:
+        оно записывается как есть. Любое другое сообщение отменяет вопрос.
+        """
+        return self._asked.pop(user_tg_id, None) == text
+
+    def clear(self):
+        self._indexes.clear()
+        self._asked.clear()
+
+
+# Индексы процесса.
+category_suggestions = CategorySuggestions()
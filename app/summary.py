@@ -0,0 +1,100 @@
+import logging
+from datetime import date
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from app.money import format_money
+from app.periods import month_period
+
+logger = logging.getLogger(__name__)
+
+# """
+# Сводка расходов пользователя за текущий месяц в памяти процесса.
+# Нужна для inline-запросов: Telegram присылает запрос на каждое нажатие клавиши,
+# поэтому ответ строится из сводки, а не из записей в БД.
+# Сводка дополняется при каждой новой записи (crud.add_note) и строится заново при промахе кэша.
+# Сводка хранится с версией данных пользователя (crud.get_data_version): записи в обход add_note
+# (регулярные расходы) увеличивают версию, и сводка считается устаревшей.
+# """
+
+
+class MonthSummary:
+    """Итоги месяца: общая сумма, число записей и суммы по категориям (в копейках базовой валюты)."""
+    __slots__ = ("year", "month", "total", "count", "categories")
+
+    def __init__(self, year: int, month: int):
+        self.year = year
+        self.month = month
+        self.total = 0
+        self.count = 0
+        self.categories: Dict[str, int] = {}
+
+    def add(self, category: str, summ: int):
+        self.total += summ
+        self.count += 1
+        self.categories[category] = self.categories.get(category, 0) + summ
+
+    def covers(self, day: date) -> bool:
+        return (day.year, day.month) == (self.year, self.month)
+
+    def top_categories(self, limit: int = 3) -> List[Tuple[str, int]]:
+        """Категории с наибольшими суммами."""
+        return sorted(self.categories.items(), key=lambda item: (-item[1], item[0]))[:limit]
+
+    @property
+    def name(self) -> str:
+        """Название месяца для ответа: "Март 2025 года"."""
+        return month_period(self.month, self.year).name
+
+
+async def build_month_summary(notes: AsyncIterator, year: int, month: int) -> MonthSummary:
+    """Сводка из потока записей месяца (NoteRecord из Storage.iter_notes_by_user_and_period)."""
+    summary = MonthSummary(year, month)
+    async for note in notes:
+        summary.add(note.category, note.summ)
+    return summary
+
+
+class SummaryCache:
+    """
+    Сводки за текущий месяц по пользователям с версией данных, по которой они построены.
+    Сводка прошлого месяца или другой версии считается промахом.
+    """
+
+    def __init__(self):
+        self._summaries: Dict[int, Tuple[int, MonthSummary]] = {}
+
+    def get(self, user_tg_id: int, today: date, version: int) -> Optional[MonthSummary]:
+        cached = self._summaries.get(user_tg_id)
+        if cached is None or cached[0] != version or not cached[1].covers(today):
+            return None
+        return cached[1]
+
+    def put(self, user_tg_id: int, summary: MonthSummary, version: int):
+        self._summaries[user_tg_id] = (version, summary)
+
+    def note_added(self, user_tg_id: int, category: str, summ: int, day: date, version: int):
+        """
+        Учитывает новую запись (version - версия данных после нее), если сводка ее месяца уже в кэше
+        и актуальна до этой записи. Иначе сводка будет построена при запросе.
+        """
+        cached = self._summaries.get(user_tg_id)
+        if cached is not None and cached[0] == version - 1 and cached[1].covers(day):
+            cached[1].add(category, summ)
+            self._summaries[user_tg_id] = (version, cached[1])
+
+    def clear(self):
+        """Сбрасывает все сводки."""
+        self._summaries.clear()
+
+
+# Сводки процесса.
+month_summaries = SummaryCache()
+
+
+def format_summary(summary: MonthSummary, limit: int = 3) -> str:
+    """Текст сводки для ответа на inline-запрос."""
+    text = f"📅 {summary.name}: {format_money(summary.total)} руб. ({summary.count} зап.)"
+    top = summary.top_categories(limit)
+    if top:
+        text += "\n" + "\n".join(f"🏷️ {category}: {format_money(summ)} руб." for category, summ in top)
+    return text
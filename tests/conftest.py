@@ -0,0 +1,24 @@
+import pytest
+from pytest_asyncio import fixture as async_fixture
+
+from app.storage import MemoryStorage, SQLiteStorage, set_storage
+from tests.test_db_utils import get_test_db_session, setup_test_db, single_connection_factory
+
+
+@pytest.fixture(autouse=True)
+def reset_storage():
+    """После каждого теста возвращаем хранилище по умолчанию (из config)."""
+    yield
+    set_storage(None)
+
+
+# Одни и те же проверки выполняются для всех реализаций хранилища.
+@async_fixture(params=["sqlite", "memory"])
+async def storage(request):
+    if request.param == "sqlite":
+        conn = await get_test_db_session()
+        await setup_test_db(conn)
+        yield SQLiteStorage(session_factory=single_connection_factory(conn))
+        await conn.close()
+    else:
+        yield MemoryStorage()
@@ -0,0 +1,78 @@
+import os
+from datetime import date, datetime
+
+import pytest
+import aiosqlite
+
+import config
+from app.archive import hot_cutoff, archive_shard, archive_closed_years
+from app.database import get_async_sqlite_session
+from app.sharding import archive_path
+from app.storage import SQLiteStorage
+
+
+@pytest.fixture
+def db_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "bot.db"))
+    monkeypatch.setattr(config, "DATABASE_SHARDS", 1, raising=False)
+    return tmp_path
+
+
+def test_hot_cutoff_keeps_previous_month():
+    assert hot_cutoff(date(2025, 6, 15)) == "2025-01-01"
+    # В январе декабрь прошлого года еще горячий.
+    assert hot_cutoff(date(2025, 1, 10)) == "2024-01-01"
+
+
+async def count_rows(path: str) -> int:
+    async with aiosqlite.connect(path) as conn:
+        cursor = await conn.execute("SELECT COUNT(*) FROM out")
+        return (await cursor.fetchone())[0]
+
+
+# Старые записи переезжают в архив, отчеты по ним продолжают работать.
+@pytest.mark.asyncio
+async def test_archive_moves_closed_years_and_reports_still_work(db_file):
+    storage = SQLiteStorage()
+    await storage.prepare()
+    for day in range(1, 21):
+        await storage.add_note(1, "Еда", "Еда", 100, "Еда", datetime(2023, 3, day))
+    await storage.add_note(1, "Еда", "Еда", 700, "Еда", datetime(2024, 12, 31))
+    await storage.add_note(1, "Кино", "Кино", 300, "Кино", datetime(2025, 2, 1))
+
+    moved = await archive_shard(0, cutoff="2025-01-01", batch_size=3, pause=0)
+
+    assert moved == 21
+    assert await count_rows(config.DATABASE_NAME) == 1
+    assert await count_rows(archive_path(0)) == 21
+
+    # Исторический отчет читает архив, текущий - только основную таблицу.
+    march = await storage.get_notes_by_user_and_month(1, 3, 2023)
+    assert sum(note["summ"] for note in march) == 2000
+    assert [note["summ"] for note in await storage.get_notes_by_user_and_month(1, 12, 2024)] == [700]
+    assert [note["summ"] for note in await storage.get_notes_by_user_and_month(1, 2, 2025)] == [300]
+    assert await storage.get_totals_by_month(3, 2023) == {1: 2000}
+
+    # Полнотекстовый поиск находит записи и в архиве, и в основной таблице.
+    result = await storage.search_notes(1, ["еда"], "0001-01-01", "9999-12-31")
+    assert (result["count"], result["total"]) == (21, 2700)
+
+    # Повторный запуск ничего не переносит.
+    assert await archive_closed_years(cutoff="2025-01-01") == 0
+
+
+# Запрос по объединению с архивом использует индексы обеих таблиц.
+@pytest.mark.asyncio
+async def test_archive_union_query_uses_indexes(db_file):
+    storage = SQLiteStorage()
+    await storage.prepare()
+    await archive_shard(0, cutoff="2000-01-01", pause=0)
+    assert os.path.exists(archive_path(0))
+
+    async with get_async_sqlite_session(shard=0) as conn:
+        assert await SQLiteStorage._use_archive(conn, "2001-01-01", 0)
+        query = SQLiteStorage.SQL_NOTES_BY_USER_AND_PERIOD.format(out=SQLiteStorage._out_source(True))
+        cursor = await conn.execute(f"EXPLAIN QUERY PLAN {query}", (1, "2001-01-01", "2001-02-01"))
+        plan = " ".join(row[3] for row in await cursor.fetchall())
+
+    assert plan.count("idx_out_user_date_iso") == 2
@@ -0,0 +1,78 @@
+import os
+import time
+import sqlite3
+import asyncio
+
+import pytest
+
+import config
+from app.backup import backup_database, backup_all
+
+
+@pytest.fixture
+def db_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "bot.db"))
+    monkeypatch.setattr(config, "DATABASE_SHARDS", 1, raising=False)
+    monkeypatch.setattr(config, "BACKUP_DIR", str(tmp_path / "backups"), raising=False)
+
+    conn = sqlite3.connect(config.DATABASE_NAME)
+    conn.execute("CREATE TABLE out (rowid INTEGER PRIMARY KEY, summ INTEGER)")
+    conn.executemany("INSERT INTO out (summ) VALUES (?)", [(i,) for i in range(5000)])
+    conn.commit()
+    conn.close()
+    return config.DATABASE_NAME
+
+
+# Копия снимается по шагам, проверяется и содержит все данные.
+@pytest.mark.asyncio
+async def test_backup_database_creates_verified_copy(db_file):
+    result = await backup_database(db_file, pages=4, step_sleep=0)
+
+    assert result.ok
+    assert result.size == os.path.getsize(result.path) > 0
+    conn = sqlite3.connect(result.path)
+    assert conn.execute("SELECT COUNT(*) FROM out").fetchone()[0] == 5000
+    conn.close()
+
+
+# Старые копии удаляются, остаются keep последних.
+@pytest.mark.asyncio
+async def test_backup_rotation_keeps_last_copies(db_file):
+    paths = [(await backup_database(db_file, step_sleep=0, keep=2)).path for _ in range(4)]
+
+    remaining = sorted(os.listdir(config.BACKUP_DIR))
+    assert remaining == sorted(os.path.basename(path) for path in paths[-2:])
+
+
+# Ошибка во время копирования не оставляет временный файл в каталоге копий.
+@pytest.mark.asyncio
+async def test_failed_backup_removes_temp_file(db_file, monkeypatch):
+    def failing_backup(source, target, pages, step_sleep):
+        open(target, "wb").close()
+        raise sqlite3.OperationalError("database or disk is full")
+
+    monkeypatch.setattr("app.backup._backup_file", failing_backup)
+    with pytest.raises(sqlite3.OperationalError):
+        await backup_database(db_file, step_sleep=0)
+
+    assert os.listdir(config.BACKUP_DIR) == []
+
+
+# Запись в БД во время копирования не ждет окончания копии.
+@pytest.mark.asyncio
+async def test_backup_all_does_not_block_writers(db_file, monkeypatch):
+    monkeypatch.setattr("app.backup.BACKUP_PAGES_PER_STEP", 1)
+    monkeypatch.setattr("app.backup.BACKUP_STEP_SLEEP", 0.01)
+    backup_task = asyncio.create_task(backup_all())
+    await asyncio.sleep(0.05)
+
+    writer = sqlite3.connect(db_file, timeout=1)
+    started = time.perf_counter()
+    writer.execute("INSERT INTO out (summ) VALUES (1)")
+    writer.commit()
+    write_time = time.perf_counter() - started
+    writer.close()
+
+    results = await backup_task
+    assert write_time < 0.5
+    assert len(results) == 1 and results[0].ok
@@ -0,0 +1,103 @@
+import io
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import app.charts
+from app.charts import ChartRenderer
+from app.logging_setup import setup_logging, stop_logging
+from tests.test_db_utils import get_test_db_session, setup_test_db
+
+CHART_DATA = {"title": "Июль 2025", "categories": [("еда", 300.0)], "daily": [("01.07.2025", 300.0)]}
+
+
+def fake_render(data):
+    return f"png:{data['title']}".encode()
+
+
+def slow_render(data):
+    time.sleep(0.3)
+    return b"png"
+
+
+def failing_render(data):
+    raise RuntimeError("ошибка рисования")
+
+
+@pytest.fixture
+def executor():
+    executor = ThreadPoolExecutor(max_workers=4)
+    yield executor
+    executor.shutdown(wait=True)
+
+
+# Повторный запрос с тем же ключом берется из кэша, новая версия данных - рисуется заново.
+@pytest.mark.asyncio
+async def test_render_uses_cache_by_data_version(executor, monkeypatch):
+    calls = []
+
+    def counting_render(data):
+        calls.append(data)
+        return b"png"
+
+    monkeypatch.setattr(app.charts, "RENDERERS", {"categories": counting_render})
+    monkeypatch.setattr(app.charts, "charts_available", lambda: True)
+    renderer = ChartRenderer(executor=executor)
+
+    assert await renderer.render_report(1, (2025, 7), 0, CHART_DATA) == [b"png"]
+    assert await renderer.render_report(1, (2025, 7), 0, CHART_DATA) == [b"png"]
+    assert len(calls) == 1
+
+    await renderer.render_report(1, (2025, 7), 1, CHART_DATA)
+    assert len(calls) == 2
+
+
+# Задача дольше таймаута и ошибка рисования не ломают отчет: графика просто нет.
+@pytest.mark.asyncio
+async def test_render_timeout_and_error_return_none(executor, monkeypatch):
+    monkeypatch.setattr(app.charts, "RENDERERS", {"slow": slow_render, "broken": failing_render})
+    renderer = ChartRenderer(executor=executor, timeout=0.05)
+
+    assert await renderer.render((1,), "slow", CHART_DATA) is None
+    assert await renderer.render((1,), "broken", CHART_DATA) is None
+
+
+# Очередь ограничена: задачи сверх max_pending сразу отклоняются.
+@pytest.mark.asyncio
+async def test_render_rejects_when_queue_is_full(executor, monkeypatch):
+    monkeypatch.setattr(app.charts, "RENDERERS", {"slow": slow_render, "fast": fake_render})
+    renderer = ChartRenderer(executor=executor, max_pending=1)
+
+    results = await asyncio.gather(renderer.render((1,), "slow", CHART_DATA), renderer.render((2,), "fast", CHART_DATA))
+
+    assert results == [b"png", None]
+
+
+# Без matplotlib графики не строятся и пул не создается.
+@pytest.mark.asyncio
+async def test_render_report_without_matplotlib(monkeypatch):
+    monkeypatch.setattr(app.charts, "charts_available", lambda: False)
+    renderer = ChartRenderer()
+
+    assert await renderer.render_report(1, (2025, 7), 0, CHART_DATA) == []
+    assert renderer._executor is None
+
+
+# Пул процессов запускается через spawn: рисование работает, когда уже запущены поток логов
+# и потоки соединений aiosqlite (fork мог бы унаследовать их занятые блокировки).
+@pytest.mark.asyncio
+async def test_process_pool_renders_after_logging_and_storage_start(monkeypatch):
+    monkeypatch.setattr(app.charts, "RENDERERS", {"fake": fake_render})
+    setup_logging(stream=io.StringIO())
+    connection = await get_test_db_session()
+    await setup_test_db(connection)
+    renderer = ChartRenderer(timeout=60)
+    try:
+        assert await renderer.render((1,), "fake", CHART_DATA) == "png:Июль 2025".encode()
+        assert renderer._get_executor()._mp_context.get_start_method() == "spawn"
+    finally:
+        renderer.shutdown()
+        await connection.close()
+        stop_logging()
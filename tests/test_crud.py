@@ -6,7 +6,8 @@ from unittest.mock import patch, AsyncMock, MagicMock, Mock
 
 from app.crud import add_note
 from app.crud import get_notes_by_user_and_month
-from tests.test_db_utils import get_test_db_session, setup_test_db
+from app.storage import SQLiteStorage, StorageError, set_storage
+from tests.test_db_utils import get_test_db_session, setup_test_db, single_connection_factory
 
 
 # Константы для теста
@@ -20,17 +21,22 @@ TEST_DESCRIPTION = "Еда Обед"
 # Тест успешного добавления записи в БД.
 @pytest.mark.asyncio
 @patch('app.crud.datetime')
-@patch('app.crud.get_async_sqlite_session')
+@patch('app.storage.get_async_sqlite_session')
 async def test_crud_add_note_success(mock_get_session, mock_datetime):
     # 1. Настройка Моков.
 
     # Устанавливаем предсказуемую дату, которую crud.py будет использовать.
     #   Чтобы быть уверенным, что тест падает от реальной ошибки.
     fixed_date_str = "05.10.2025"
-    mock_datetime.now.return_value.strftime.return_value = fixed_date_str
+    fixed_date_iso = "2025-10-05"
+    mock_datetime.now.return_value.strftime.side_effect = (
+        lambda fmt: fixed_date_iso if fmt == "%Y-%m-%d" else fixed_date_str
+    )
 
     # Создаем мок объекта, который будет возвращен в 'as connection'
     mock_connection = AsyncMock()
+    # Курсор, который вернет execute (rowcount учитывается в статистике запросов app.dbstats).
+    mock_connection.execute.return_value = MagicMock(rowcount=1, close=AsyncMock())
 
     # Создаем мок, который будет вести себя как асинхронный контекстный менеджер
     #    Обычный MagicMock уже имеет методы __enter__ и __exit__,
@@ -65,8 +71,8 @@ async def test_crud_add_note_success(mock_get_session, mock_datetime):
 
     # Ожидаемый SQL-запрос и параметры.
     expected_sql = (
-        "INSERT INTO out (user_tg_id, category, sub_category, summ, description, date) "
-        "VALUES (?, ?, ?, ?, ?, ?)"
+        "INSERT INTO out (user_tg_id, category, sub_category, summ, description, date, date_iso, currency) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
     )
     expected_params = (
         TEST_USER_ID,
@@ -74,7 +80,9 @@ async def test_crud_add_note_success(mock_get_session, mock_datetime):
         TEST_SUB_CATEGORY,
         TEST_SUMM,
         TEST_DESCRIPTION,
-        fixed_date_str # Используем замоканную дату.
+        fixed_date_str, # Используем замоканную дату.
+        fixed_date_iso,
+        None            # Базовая валюта.
     )
 
     # Проверяем, что на мок-соединении вызвали execute с правильными данными.
@@ -98,6 +106,8 @@ async def test_get_notes_by_user_and_month_success():
     conn = await get_test_db_session()
     assert conn is not None
     await setup_test_db(conn)  # Создаем таблицу
+    # Хранилище SQLite поверх тестового соединения.
+    set_storage(SQLiteStorage(session_factory=single_connection_factory(conn)))
 
     # Дата для теста: 15.01.2025
     test_user_id = 12345
@@ -127,7 +137,7 @@ async def test_get_notes_by_user_and_month_success():
     await conn.commit()
 
     # 3. Вызов тестируемой функции и проверка
-    notes = await get_notes_by_user_and_month(conn, test_user_id, 1, 2025)
+    notes = await get_notes_by_user_and_month(test_user_id, 1, 2025)
 
     # Проверяем, что получено ровно 2 записи
     assert len(notes) == 2, f"Ожидалось 2 записи, получено {len(notes)}"
@@ -145,7 +155,7 @@ async def test_get_notes_by_user_and_month_success():
 
 # Тест обработки ошибки БД.
 @pytest.mark.asyncio
-@patch('app.crud.get_async_sqlite_session')
+@patch('app.storage.get_async_sqlite_session')
 async def test_crud_add_note_db_failure(mock_get_session):
     # 1. Настройка Моков.
     # Создаем мок объекта соединения.
@@ -167,14 +177,15 @@ async def test_crud_add_note_db_failure(mock_get_session):
     # Настраиваем патч, чтобы он возвращал наш контекстный менеджер
     mock_get_session.return_value = mock_context_manager
 
-    # 2. Выполнение
-    result = await add_note(
-        user_tg_id=TEST_USER_ID,
-        category=TEST_CATEGORY,
-        sub_category=TEST_SUB_CATEGORY,
-        summ=TEST_SUMM,
-        description=TEST_DESCRIPTION
-    )
+    # 2. Выполнение: ошибка БД выходит из хранилища как StorageError.
+    with pytest.raises(StorageError):
+        await add_note(
+            user_tg_id=TEST_USER_ID,
+            category=TEST_CATEGORY,
+            sub_category=TEST_SUB_CATEGORY,
+            summ=TEST_SUMM,
+            description=TEST_DESCRIPTION
+        )
 
     # 3. Проверка.
     # Проверяем, что execute была вызвана, но вызвала ошибку.
@@ -189,6 +200,3 @@ async def test_crud_add_note_db_failure(mock_get_session):
     # Проверяем, что соединение было закрыто (в блоке finally).
     # mock_connection.close.assert_called_once()
 
-    # Проверяем, что функция вернула False при ошибке.
-    assert result is False
-
@@ -0,0 +1,78 @@
+from datetime import datetime
+
+import pytest
+
+from app.currency import RateCache, load_rates_file, set_rate_cache
+from app.parser import split_currency
+from app.storage import MemoryStorage, SQLiteStorage
+from tests.test_db_utils import get_test_db_session, setup_test_db, single_connection_factory
+
+RATES = [("EUR", "2025-03-01", 100.0), ("EUR", "2025-03-10", 110.0), ("GEL", "2025-01-01", 33.3)]
+
+
+@pytest.fixture(autouse=True)
+def rate_cache():
+    set_rate_cache(RateCache(RATES))
+    yield
+    set_rate_cache(None)
+
+
+def test_load_rates_file_skips_bad_lines(tmp_path):
+    path = tmp_path / "rates.csv"
+    path.write_text("# дата,валюта,курс\n2025-03-01,eur,100.5\nне дата,EUR,1\n2025-03-02,USD\n", encoding="utf-8")
+
+    assert load_rates_file(str(path)) == [("EUR", "2025-03-01", 100.5)]
+    assert load_rates_file(str(tmp_path / "missing.csv")) == []
+
+
+# Курс - последний на дату записи; до первого курса - самый ранний.
+def test_rate_cache_uses_latest_rate_on_date():
+    cache = RateCache(RATES)
+
+    assert cache.rate_on("EUR", "2025-03-09") == 100.0
+    assert cache.rate_on("EUR", "2025-03-10") == 110.0
+    assert cache.rate_on("EUR", "2024-12-31") == 100.0
+    assert cache.rate_on("USD", "2025-03-10") is None
+    assert cache.convert(25, "EUR", "2025-03-15") == 2750
+    assert cache.convert(25, None, "2025-03-15") == 25
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("msg, expected", [
+    ("25eur Кофе", ("25 Кофе", "EUR")),
+    ("Такси 40₾", ("Такси 40", "GEL")),
+    ("100руб Еда", ("100 Еда", None)),
+    ("100 Еда", ("100 Еда", None)),
+    ("25abc Кофе", ("25abc Кофе", None)),
+])
+async def test_split_currency(msg, expected):
+    assert await split_currency(msg) == expected
+
+
+# SQLite (пересчет в запросе по таблице rates) и память (по RateCache) дают одни и те же суммы.
+@pytest.mark.asyncio
+@pytest.mark.parametrize("backend", ["sqlite", "memory"])
+async def test_reports_convert_to_base_currency(backend):
+    conn = None
+    if backend == "sqlite":
+        conn = await get_test_db_session()
+        await setup_test_db(conn)
+        storage = SQLiteStorage(session_factory=single_connection_factory(conn))
+        await storage.sync_rates(RATES)
+    else:
+        storage = MemoryStorage()
+
+    await storage.add_note(1, "Кафе", "Кофе", 3, "Кафе кофе", datetime(2025, 3, 5), currency="EUR")
+    await storage.add_note(1, "Кафе", "Обед", 20, "Кафе обед", datetime(2025, 3, 12), currency="EUR")
+    await storage.add_note(1, "Еда", "Еда", 500, "Еда", datetime(2025, 3, 12))
+
+    notes = await storage.get_notes_by_user_and_month(1, 3, 2025)
+    assert sorted(note["summ"] for note in notes) == [300, 500, 2200]
+    assert await storage.get_totals_by_month(3, 2025) == {1: 3000}
+    comparison = await storage.get_category_comparison(1, 3, 2025)
+    assert [(row["category"], row["current"]) for row in comparison] == [("Кафе", 2500), ("Еда", 500)]
+    assert (await storage.search_notes(1, ["кофе"], "2025-01-01", "2026-01-01"))["total"] == 300
+    assert (await storage.get_balance(1))["expense"] == 3000
+
+    if conn is not None:
+        await conn.close()
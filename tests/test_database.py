@@ -74,4 +74,15 @@ async def test_updates_tables_creates_table():
     assert table_exists is not None
     assert table_exists[0] == 'out'
 
-    await conn.close()
\ No newline at end of file
+    await conn.close()
+
+@pytest.mark.asyncio
+async def test_update_tables_raises_on_failed_migration(monkeypatch):
+    """Ошибка миграции не проглатывается: запуск бота прерывается."""
+    async def failing_migrations(connection):
+        raise aiosqlite.OperationalError("сбой миграции")
+
+    monkeypatch.setattr("app.database.run_migrations", failing_migrations)
+
+    with pytest.raises(aiosqlite.OperationalError):
+        await update_tables()
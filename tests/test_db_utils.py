@@ -1,5 +1,8 @@
 import aiosqlite
 from typing import Optional
+from contextlib import asynccontextmanager
+
+from app.migrations import run_migrations
 
 # Функция для тестовых соединений с БД.
 async def get_test_db_session() -> Optional[aiosqlite.Connection]:
@@ -15,16 +18,17 @@ async def get_test_db_session() -> Optional[aiosqlite.Connection]:
         return None
 
 async def setup_test_db(conn: aiosqlite.Connection):
-    """Создает необходимую таблицу 'out' для теста."""
-    await conn.execute("""
-        CREATE TABLE out (
-            id INTEGER PRIMARY KEY,
-            user_tg_id INTEGER,
-            category TEXT,
-            sub_category TEXT,
-            summ INTEGER,
-            description TEXT,
-            date TEXT
-        )
-    """)
-    await conn.commit()
+    """Создает необходимые таблицы для теста теми же миграциями, что и в рабочей БД."""
+    await run_migrations(conn)
+
+
+def single_connection_factory(conn: aiosqlite.Connection):
+    """
+    Фабрика соединений для SQLiteStorage, которая всегда отдает одно тестовое соединение
+    (in-memory БД живет, пока открыто соединение, поэтому оно не закрывается).
+    """
+    @asynccontextmanager
+    async def factory(user_tg_id: Optional[int] = None, shard: Optional[int] = None):
+        yield conn
+
+    return factory
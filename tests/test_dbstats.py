@@ -0,0 +1,85 @@
+import logging
+from datetime import datetime
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import config
+from app import dbstats
+from app.main import cmd_dbstats
+from app.storage import SQLiteStorage
+from tests.test_db_utils import get_test_db_session, setup_test_db, single_connection_factory
+
+
+@pytest.fixture(autouse=True)
+def clean_stats():
+    dbstats.reset_stats()
+    yield
+    dbstats.reset_stats()
+
+
+def test_redact_params_hides_user_data():
+    assert dbstats.redact_params((123456, "Еда обед", 500, "2025-03-01", None)) == [
+        "<int>", "<str:8>", "<int>", "2025-03-01", None
+    ]
+    assert dbstats.redact_params({"user_tg_id": 1, "current_start": "2025-03-01"}) == {
+        "user_tg_id": "<int>", "current_start": "2025-03-01"
+    }
+
+
+# Медленный запрос попадает в лог без данных пользователя.
+def test_slow_query_is_logged_with_redacted_params(caplog, monkeypatch):
+    monkeypatch.setattr(config, "SLOW_QUERY_MS", 50, raising=False)
+
+    with caplog.at_level(logging.WARNING, logger="app.dbstats"):
+        dbstats.record("SQL_FAST", 0.01, 1, (1, "секрет"))
+        dbstats.record("SQL_SLOW", 0.2, 3, (1, "секрет"))
+
+    assert len(caplog.records) == 1
+    message = caplog.records[0].getMessage()
+    assert "SQL_SLOW" in message and "200.0 мс" in message
+    assert "секрет" not in message and "<str:6>" in message
+
+
+# Запросы хранилища учитываются по имени: вызовы, строки, ожидание соединения.
+@pytest.mark.asyncio
+async def test_storage_statements_are_recorded():
+    conn = await get_test_db_session()
+    await setup_test_db(conn)
+    storage = SQLiteStorage(session_factory=single_connection_factory(conn))
+
+    await storage.add_note(1, "Еда", "Обед", 500, "Еда обед", datetime(2025, 1, 15))
+    await storage.add_note(1, "Кино", "Кино", 300, "Кино", datetime(2025, 1, 20))
+    await storage.get_notes_by_user_and_month(1, 1, 2025)
+    await conn.close()
+
+    stats = {stats.name: stats for stats in dbstats.get_stats()}
+    assert stats["SQL_INSERT_NOTE"].calls == 2
+    assert stats["SQL_INSERT_NOTE"].total_rows == 2
+    assert stats["SQL_NOTES_BY_USER_AND_PERIOD"].total_rows == 2
+    assert stats["SQL_INSERT_NOTE"].total_wait >= 0
+    assert "SQL_INSERT_NOTE" in dbstats.format_stats()
+
+
+def test_stats_are_ordered_by_total_time():
+    dbstats.record("SQL_A", 0.001, 1)
+    dbstats.record("SQL_B", 0.003, 1)
+    dbstats.record("SQL_A", 0.001, 1)
+
+    assert [stats.name for stats in dbstats.get_stats()] == ["SQL_B", "SQL_A"]
+    assert dbstats.get_stats(1)[0].percentile(95) == 0.003
+
+
+# /dbstats отвечает только администраторам.
+@pytest.mark.asyncio
+@pytest.mark.parametrize("admins, answered", [([42], True), ([], False)])
+async def test_dbstats_command_only_for_admins(admins, answered):
+    message = MagicMock()
+    message.from_user.id = 42
+    message.answer = AsyncMock()
+
+    with patch("app.main.config") as mock_config:
+        mock_config.ADMINS = admins
+        await cmd_dbstats(message)
+
+    assert message.answer.await_count == (1 if answered else 0)
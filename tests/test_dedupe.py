@@ -0,0 +1,114 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+import config
+from app.dedupe import DedupeMiddleware, UpdateDeduplicator
+from app.storage import MemoryStorage, StorageError
+
+
+@pytest.mark.asyncio
+async def test_mark_processed_rejects_duplicates_and_expires(storage):
+    assert not await storage.is_processed(1, 10)
+    assert await storage.mark_processed(1, 10, 1000)
+    assert await storage.is_processed(1, 10)
+    assert not await storage.mark_processed(1, 10, 2000)
+    assert await storage.mark_processed(2, 10, 3000)
+
+    assert await storage.expire_processed(2500) == 1
+    assert not await storage.is_processed(1, 10)
+    assert await storage.mark_processed(1, 10, 4000)
+
+
+# Повтор после перезапуска (пустой LRU) отклоняется по ключу в хранилище.
+@pytest.mark.asyncio
+async def test_duplicate_is_rejected_after_restart(storage):
+    deduplicator = UpdateDeduplicator(storage)
+    assert await deduplicator.claim(1, 10)
+    await deduplicator.complete(1, 10)
+
+    restarted = UpdateDeduplicator(storage)
+    assert not await restarted.claim(1, 10)
+    assert await restarted.claim(1, 11)
+
+
+# Повтор из LRU не обращается к хранилищу; LRU ограничен по размеру.
+@pytest.mark.asyncio
+async def test_recent_keys_are_served_from_bounded_lru():
+    storage = MemoryStorage()
+    storage.is_processed = AsyncMock(wraps=storage.is_processed)
+    deduplicator = UpdateDeduplicator(storage, cache_size=2)
+
+    for message_id in (1, 2, 3):
+        assert await deduplicator.claim(1, message_id)
+        await deduplicator.complete(1, message_id)
+    assert not await deduplicator.claim(1, 3)
+    assert storage.is_processed.await_count == 3
+
+    # Ключ 1 вытеснен из LRU, повтор отклоняет хранилище.
+    assert not await deduplicator.claim(1, 1)
+    assert storage.is_processed.await_count == 4
+
+
+def make_message(user_tg_id: int, message_id: int = 10):
+    message = MagicMock(message_id=message_id)
+    message.chat.id = user_tg_id
+    message.from_user.id = user_tg_id
+    return message
+
+
+@pytest.mark.asyncio
+async def test_middleware_skips_duplicates_and_releases_failed_messages():
+    middleware = DedupeMiddleware(UpdateDeduplicator(MemoryStorage()))
+    message = make_message(config.USERS[0])
+    handler = AsyncMock(side_effect=[RuntimeError("сбой"), "ok"])
+
+    with pytest.raises(RuntimeError):
+        await middleware(handler, message, {})
+    # Обработка не удалась: повторная доставка обрабатывается.
+    assert await middleware(handler, message, {}) == "ok"
+    # Успешно обработанное сообщение повторно не обрабатывается.
+    assert await middleware(handler, message, {}) is None
+    assert handler.await_count == 2
+
+
+# Ключ пишется в хранилище только после успешной обработки: после сбоя обработчика
+# и перезапуска бота (пустой LRU) повторная доставка записывает расход.
+@pytest.mark.asyncio
+async def test_failed_message_is_processed_after_restart(storage):
+    message = make_message(config.USERS[0])
+    handler = AsyncMock(side_effect=[RuntimeError("сбой"), "ok"])
+
+    with pytest.raises(RuntimeError):
+        await DedupeMiddleware(UpdateDeduplicator(storage))(handler, message, {})
+    assert not await storage.is_processed(message.chat.id, message.message_id)
+
+    restarted = DedupeMiddleware(UpdateDeduplicator(storage))
+    assert await restarted(handler, message, {}) == "ok"
+    assert await storage.is_processed(message.chat.id, message.message_id)
+
+
+# Ошибка записи ключа после успешной обработки не превращается в ошибку для пользователя.
+@pytest.mark.asyncio
+async def test_key_write_failure_keeps_handler_result():
+    storage = MemoryStorage()
+    storage.mark_processed = AsyncMock(side_effect=StorageError("Ошибка записи ключа"))
+    middleware = DedupeMiddleware(UpdateDeduplicator(storage))
+    message = make_message(config.USERS[0])
+    handler = AsyncMock(return_value="ok")
+
+    assert await middleware(handler, message, {}) == "ok"
+    # Повтор в этом процессе отклоняет LRU.
+    assert await middleware(handler, message, {}) is None
+    assert handler.await_count == 1
+
+
+# Сообщения неавторизованных пользователей передаются обработчику без записи ключа.
+@pytest.mark.asyncio
+async def test_middleware_does_not_record_unauthorized_senders():
+    storage = MemoryStorage()
+    middleware = DedupeMiddleware(UpdateDeduplicator(storage))
+    handler = AsyncMock(return_value="ok")
+
+    assert await middleware(handler, make_message(-1), {}) == "ok"
+    assert await middleware(handler, make_message(-1), {}) == "ok"
+    assert storage._processed == {}
@@ -0,0 +1,86 @@
+from datetime import datetime
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from app import crud
+from app.groups import find_group, group_totals
+from app.periods import month_period
+from app.report_handler import ReportHandler
+from app.storage import MemoryStorage, set_storage
+
+GROUPS = {"Семья": [1, 2], "Работа": [2, 3]}
+
+
+@pytest.fixture(autouse=True)
+def groups_config():
+    group_totals.clear()
+    with patch("app.groups.config", MagicMock(GROUPS=GROUPS, USER_NAMES={1: "Аня"})):
+        yield
+    group_totals.clear()
+
+
+def test_find_group_only_for_members():
+    assert find_group(1, "семья") == "Семья"
+    assert find_group(3, "семья") is None
+    assert find_group(1, "март") is None
+
+
+@pytest.mark.asyncio
+async def test_group_totals_by_member_category_and_day(storage):
+    await storage.sync_groups(GROUPS)
+    await storage.add_note(1, "Еда", "Обед", 50000, "Еда обед", datetime(2025, 3, 5))
+    await storage.add_note(1, "Еда", "Ужин", 20000, "Еда ужин", datetime(2025, 3, 5))
+    await storage.add_note(2, "Еда", "Еда", 30000, "Еда", datetime(2025, 3, 6))
+    await storage.add_note(2, "Кино", "Кино", 70000, "Кино", datetime(2025, 4, 1))
+    await storage.add_note(3, "Такси", "Такси", 90000, "Такси", datetime(2025, 3, 6))
+
+    rows = await storage.get_group_totals("Семья", "2025-03-01", "2025-04-01")
+
+    assert sorted((row["user_tg_id"], row["category"], row["date"], row["total"], row["notes"]) for row in rows) == [
+        (1, "Еда", "05.03.2025", 70000, 2),
+        (2, "Еда", "06.03.2025", 30000, 1),
+    ]
+    assert await storage.get_group_totals("Нет такой", "2025-03-01", "2025-04-01") == []
+
+
+# Итоги группы берутся из кэша, пока участники не добавили новых записей.
+@pytest.mark.asyncio
+async def test_group_totals_are_cached_until_member_adds_note():
+    storage = MemoryStorage()
+    set_storage(storage)
+    await storage.sync_groups(GROUPS)
+    await storage.add_note(1, "Еда", "Обед", 50000, "Еда обед", datetime.now())
+    storage.get_group_totals = AsyncMock(wraps=storage.get_group_totals)
+    today = datetime.now()
+    period = month_period(today.month, today.year)
+
+    first = await crud.get_group_totals("Семья", period)
+    assert await crud.get_group_totals("Семья", period) is first
+    await crud.add_note(3, "Такси", "Такси", 10000, "Такси")    # Не участник
+    assert await crud.get_group_totals("Семья", period) is first
+    assert storage.get_group_totals.await_count == 1
+
+    await crud.add_note(2, "Кино", "Кино", 30000, "Кино")
+    updated = await crud.get_group_totals("Семья", period)
+    assert storage.get_group_totals.await_count == 2
+    assert updated.members == {1: 50000, 2: 30000} and updated.count == 2
+
+
+@pytest.mark.asyncio
+async def test_group_report_lists_members():
+    storage = MemoryStorage()
+    set_storage(storage)
+    await storage.sync_groups(GROUPS)
+    await storage.add_note(1, "Еда", "Обед", 50000, "Еда обед", datetime(2025, 3, 5))
+    await storage.add_note(2, "Кино", "Кино", 30000, "Кино", datetime(2025, 3, 6))
+
+    message = AsyncMock(text="/report семья 03.2025")
+    message.from_user.id = 2
+    handler = ReportHandler(message=message, storage=storage)
+    report = await handler.get_month_report()
+
+    assert report.startswith("Отчет группы Семья за Март 2025 года по категориям:")
+    assert "👤 Аня: 500 руб.\n👤 2: 300 руб." in report
+    assert report.endswith("Общая сумма по всем категориям: 800 руб.")
+    assert handler.chart_owner == ("group", "Семья")
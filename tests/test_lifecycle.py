@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from app.lifecycle import Lifecycle
+from app.storage import MemoryStorage, set_storage
+
+
+@pytest.mark.asyncio
+async def test_track_update_counts_in_flight_handlers():
+    lifecycle = Lifecycle()
+    release = asyncio.Event()
+
+    async def handler(event, data):
+        await release.wait()
+        return "ok"
+
+    task = asyncio.create_task(lifecycle.track_update(handler, MagicMock(), {}))
+    await asyncio.sleep(0)
+
+    assert lifecycle.in_flight == 1
+    assert lifecycle.first_update_at is not None
+    assert not await lifecycle.wait_idle(0.01)
+
+    release.set()
+    assert await lifecycle.wait_idle(1)
+    assert await task == "ok" and lifecycle.in_flight == 0
+
+
+# Остановка: сначала завершаются обработчики, затем фоновые задачи и хранилище.
+@pytest.mark.asyncio
+async def test_shutdown_drains_handlers_before_closing_storage():
+    storage = MemoryStorage()
+    set_storage(storage)
+    lifecycle = Lifecycle()
+    order = []
+    storage.close = AsyncMock(side_effect=lambda: order.append("storage"))
+
+    async def handler(event, data):
+        await asyncio.sleep(0.05)
+        order.append("handler")
+
+    async def job():
+        try:
+            await asyncio.Event().wait()
+        finally:
+            order.append("job")
+
+    lifecycle.start_background(job())
+    handler_task = asyncio.create_task(lifecycle.track_update(handler, MagicMock(), {}))
+    await asyncio.sleep(0)
+
+    with patch("app.charts.get_chart_renderer") as renderer:
+        await lifecycle.on_shutdown()
+
+    assert order == ["handler", "job", "storage"]
+    renderer.return_value.shutdown.assert_called_once()
+    await handler_task
+
+
+@pytest.mark.asyncio
+async def test_startup_prepares_storage_and_defers_warm_up():
+    storage = MemoryStorage()
+    storage.prepare = AsyncMock()
+    set_storage(storage)
+    lifecycle = Lifecycle()
+    bot = MagicMock(delete_webhook=AsyncMock())
+
+    with patch("app.lifecycle.Lifecycle.warm_up", AsyncMock()) as warm_up, \
+            patch("app.charts.get_chart_renderer"):
+        await lifecycle.on_startup(bot)
+        storage.prepare.assert_awaited_once()
+        bot.delete_webhook.assert_awaited_once_with(drop_pending_updates=True)
+        # Прогрев и фоновые задачи идут отдельно и запуск не задерживают.
+        assert len(lifecycle._background_tasks) == 3
+        await lifecycle.on_shutdown()
+    warm_up.assert_called_once()
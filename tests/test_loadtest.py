@@ -0,0 +1,47 @@
+import pytest
+
+import config
+from app.loadtest import build_updates, run_load_test, LoadTestResult
+
+
+def test_build_updates_mix():
+    updates = build_updates(200, users=[1, 2], report_ratio=0.25, seed=1)
+    texts = [update["message"]["text"] for update in updates]
+
+    assert len(updates) == 200
+    assert 0 < texts.count("/report") < 200
+    assert {update["message"]["from"]["id"] for update in updates} <= {1, 2}
+
+
+def test_percentiles():
+    result = LoadTestResult(updates=100, concurrency=1, elapsed=2.0, errors=0, outgoing_calls=0,
+                            latencies_ms=[float(i) for i in range(1, 101)])
+
+    assert result.throughput == 50.0
+    assert result.percentile(50) == 50.0
+    assert result.percentile(99) == 99.0
+
+
+# Короткий прогон через настоящий Dispatcher и файл SQLite.
+@pytest.mark.asyncio
+async def test_run_load_test_against_sqlite(tmp_path):
+    users, database = config.USERS, config.DATABASE_NAME
+
+    result = await run_load_test(updates=40, concurrency=8, users=3, report_ratio=0.2,
+                                 db_path=str(tmp_path / "loadtest.db"))
+
+    assert result.errors == 0
+    assert len(result.latencies_ms) == 40
+    assert result.outgoing_calls > 0
+    # Настройки процесса восстановлены после прогона.
+    assert (config.USERS, config.DATABASE_NAME) == (users, database)
+
+
+# Повторный прогон в том же процессе обрабатывает те же сообщения заново (ключи дедупликации сброшены).
+@pytest.mark.asyncio
+async def test_repeated_load_test_is_not_deduplicated():
+    runs = [await run_load_test(updates=30, concurrency=4, users=2, report_ratio=0.2, storage="memory")
+            for _ in range(2)]
+
+    assert runs[0].outgoing_calls > 0
+    assert runs[1].outgoing_calls == runs[0].outgoing_calls
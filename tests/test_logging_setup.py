@@ -0,0 +1,53 @@
+import json
+import logging
+
+from app.logging_setup import JsonFormatter, SamplingFilter, LazyQueueHandler, SAMPLED
+
+
+def make_record(msg: str, *args, level: int = logging.INFO, name: str = "app.main", **extra) -> logging.LogRecord:
+    record = logging.LogRecord(name, level, __file__, 1, msg, args, None)
+    for key, value in extra.items():
+        setattr(record, key, value)
+    return record
+
+
+# Запись превращается в одну строку JSON с полями из extra.
+def test_json_formatter_outputs_structured_line():
+    record = make_record("Запрос от пользователя %s", 123, user_id=123)
+
+    entry = json.loads(JsonFormatter().format(record))
+
+    assert entry["level"] == "INFO"
+    assert entry["logger"] == "app.main"
+    assert entry["message"] == "Запрос от пользователя 123"
+    assert entry["user_id"] == 123
+
+
+# Помеченные INFO-записи прореживаются, предупреждения и обычные записи - нет.
+def test_sampling_filter_keeps_every_nth_sampled_info():
+    sampling = SamplingFilter(every=5)
+
+    kept = [sampling.filter(make_record("Запрос от пользователя %s", i, **SAMPLED)) for i in range(20)]
+    assert kept.count(True) == 4
+
+    assert all(sampling.filter(make_record("Бот запущен")) for _ in range(5))
+    assert all(sampling.filter(make_record("Ошибка %s", 1, level=logging.WARNING, **SAMPLED)) for _ in range(5))
+    assert [sampling.filter(make_record("Update id=%s", i, name="aiogram.event")) for i in range(3)] == \
+           [True, False, False]
+
+
+# Обработчик очереди не форматирует сообщение в вызывающем потоке.
+def test_lazy_queue_handler_does_not_format():
+    class Arg:
+        formatted = 0
+
+        def __str__(self):
+            Arg.formatted += 1
+            return "arg"
+
+    record = make_record("значение %s", Arg())
+    prepared = LazyQueueHandler(None).prepare(record)
+
+    assert prepared.args and Arg.formatted == 0
+    assert JsonFormatter().format(prepared)
+    assert Arg.formatted == 1
@@ -2,11 +2,13 @@ from datetime import datetime
 
 import pytest
 from unittest.mock import AsyncMock, patch, MagicMock
-from aiogram.types import Message, User  # Используем настоящий класс Message для имитации структуры
+from aiogram.types import ErrorEvent, Message, User  # Используем настоящий класс Message для имитации структуры
 
 from app.main import echo_mess
-from app.main import cmd_report
+from app.main import cmd_report, cmd_balance, dp
 from app.report_handler import ReportHandler
+from app.storage import StorageError
+from app.suggestions import CategoryIndex
 
 USER_ID = 123456  # ид пользователя для проверки авторизации
 
@@ -44,6 +46,8 @@ async def test_successful_note_creation(mock_split, mock_crud, mock_config):
     # 1. Настройка
     # Делаем add_note асинхронным моком
     mock_crud.add_note = AsyncMock(return_value=True)
+    # Истории категорий нет: категории записываются как введены.
+    mock_crud.get_category_index = AsyncMock(return_value=CategoryIndex())
 
     # Имитируем, что пользователь авторизован
     mock_config.USERS = [USER_ID]
@@ -67,10 +71,73 @@ async def test_successful_note_creation(mock_split, mock_crud, mock_config):
         category="Еда",
         sub_category="Обед",
         summ="100",
-        description="Еда Обед"
+        description="Еда Обед",
+        currency=None
     )
 
 
+# Доход "+сумма категория" записывается в доходы, а не в расходы.
+@pytest.mark.asyncio
+@patch('app.main.config')
+@patch('app.main.crud')
+async def test_income_message_creates_income(mock_crud, mock_config):
+    mock_crud.add_income = AsyncMock(return_value=True)
+    mock_crud.add_note = AsyncMock()
+    mock_config.USERS = [USER_ID]
+    message_mock = AsyncMock(spec=Message, text="+5000 Зарплата", from_user=AsyncMock(spec=User))
+    message_mock.from_user.id = USER_ID
+
+    await echo_mess(message_mock)
+
+    mock_crud.add_income.assert_called_once_with(
+        user_tg_id=USER_ID, category="Зарплата", summ=500000, description="Зарплата"
+    )
+    mock_crud.add_note.assert_not_called()
+
+
+# /balance отвечает одной строкой баланса.
+@pytest.mark.asyncio
+@patch('app.main.config')
+@patch('app.main.crud')
+async def test_balance_command(mock_crud, mock_config):
+    mock_crud.get_balance = AsyncMock(return_value={"income": 500000, "expense": 120050, "balance": 379950})
+    mock_config.USERS = [USER_ID]
+    message_mock = MagicMock()
+    message_mock.from_user.id = USER_ID
+    message_mock.answer = AsyncMock()
+
+    await cmd_balance(message_mock)
+
+    mock_crud.get_balance.assert_awaited_once_with(user_tg_id=USER_ID)
+    assert "3799.50 руб." in message_mock.answer.await_args.args[0]
+
+
+# Ошибка хранилища в обработчике: пользователь получает "попробуйте позже", а не пустой ответ.
+@pytest.mark.asyncio
+async def test_storage_error_answers_try_later():
+    message_mock = MagicMock()
+    message_mock.answer = AsyncMock()
+    update_mock = MagicMock(message=message_mock, inline_query=None)
+    event = ErrorEvent.model_construct(update=update_mock, exception=StorageError("Ошибка получения баланса"))
+
+    assert await dp.errors.trigger(event) is True
+
+    message_mock.answer.assert_awaited_once()
+    assert "попробуйте позже" in message_mock.answer.await_args.args[0]
+
+
+# Другие исключения обработчик ошибок хранилища не перехватывает.
+@pytest.mark.asyncio
+async def test_other_errors_are_not_answered():
+    message_mock = MagicMock()
+    message_mock.answer = AsyncMock()
+    event = ErrorEvent.model_construct(update=MagicMock(message=message_mock), exception=ValueError("bug"))
+
+    await dp.errors.trigger(event)
+
+    message_mock.answer.assert_not_awaited()
+
+
 # Парсер сообщения. Отправим сообщение с ошибкой.
 @pytest.mark.asyncio
 @patch('app.main.config')           # Конфиг со списком пользователей.
@@ -108,10 +175,10 @@ async def test_parsing_failure_sends_error_message(mock_split, mock_crud, mock_c
 # Запрос отчета за месяц
 @pytest.mark.asyncio
 @patch('app.main.config')           # Конфиг со списком пользователей.
-@patch('app.main.ReportHandler')    # Модуль взаимодействия с бд.
-@patch('app.main.crud.get_notes_by_user_and_month')
-@patch('app.main.get_async_sqlite_session', new_callable=MagicMock)
-async def test_get_report_for_month(mock_db_conn_context, mock_crud_func,  mock_report_handler_class, mock_config):
+@patch('app.report_handler.ReportHandler')    # Модуль взаимодействия с бд.
+@patch('app.main.get_storage')     # Текущее хранилище записей.
+@patch('app.charts.get_chart_renderer')   # Графики к отчету.
+async def test_get_report_for_month(mock_get_chart_renderer, mock_get_storage, mock_report_handler_class, mock_config):
     # 1. Настройка: Что должны возвращать наши моки
     # Имитируем, что пользователь авторизован
     # USER_ID = 123456 # ИД для теста
@@ -126,11 +193,11 @@ async def test_get_report_for_month(mock_db_conn_context, mock_crud_func,  mock_
     # Мок ответа бота
     mock_message.answer = AsyncMock()
     mock_message.reply = AsyncMock()
+    mock_message.answer_media_group = AsyncMock()
 
-    # Создаем мок для самого объекта соединения.
-    mock_db_conn = AsyncMock(name='db_conn')
-    # Настраиваем: при входе в контекстный менеджер (.__aenter__()) возвращается mock_db_conn.
-    mock_db_conn_context.return_value.__aenter__.return_value = mock_db_conn
+    # Создаем мок для хранилища.
+    mock_storage = MagicMock(name='storage')
+    mock_get_storage.return_value = mock_storage
 
     # Получаем фиктивный экземпляр класса ReportHandler, который вернется при ReportHandler()
     mock_report_handler_instance = mock_report_handler_class.return_value
@@ -141,23 +208,30 @@ async def test_get_report_for_month(mock_db_conn_context, mock_crud_func,  mock_
     expected_report_text = "Временный текст отчета"
     mock_report_handler_instance.get_month_report.return_value = expected_report_text
 
+    # Рендерер вернул две картинки.
+    mock_get_chart_renderer.return_value.render_report = AsyncMock(return_value=[b"png1", b"png2"])
+
     # 2. Выполнение
     await cmd_report(mock_message)
 
     # 3. Проверка
-    # Проверяем, что контекстный менеджер был вызван
-    mock_db_conn_context.assert_called_once()
+    # Проверяем, что хранилище было запрошено
+    mock_get_storage.assert_called_once()
 
     # Проверяем, что класс ReportHandler был вызван с новыми именованными аргументами!
     mock_report_handler_class.assert_called_once_with(
         message=mock_message,
-        db_conn=mock_db_conn,
-        crud_func=mock_crud_func
+        storage=mock_storage
     )
 
     # Проверяем, что метод get_month_report был вызван на экземпляре
     mock_report_handler_instance.get_month_report.assert_awaited_once()
 
+    # Графики отправлены одним альбомом.
+    mock_get_chart_renderer.return_value.render_report.assert_awaited_once()
+    mock_message.answer_media_group.assert_awaited_once()
+    assert len(mock_message.answer_media_group.await_args.args[0]) == 2
+
     # Мы ожидаем, что mock_message.reply или mock_message.answer будет вызван с текстом отчета.
     # mock_message.reply.assert_awaited_once_with(expected_report_text)
 
@@ -168,7 +242,9 @@ async def test_get_report_for_month(mock_db_conn_context, mock_crud_func,  mock_
 # Мокируем ТОЛЬКО асинхронный метод получения отчета, чтобы проверить
 # корректность создания экземпляра ReportHandler внутри cmd_report.
 @patch.object(ReportHandler, 'get_month_report', new_callable=AsyncMock)
-async def test_get_report_for_month_with_strict_constructor_check(mock_get_month_report, mock_config):
+@patch('app.charts.get_chart_renderer')
+async def test_get_report_for_month_with_strict_constructor_check(mock_get_chart_renderer, mock_get_month_report,
+                                                                  mock_config):
     # 1. Настройка
     mock_config.USERS = [USER_ID]
     user_mock = AsyncMock(spec=User)
@@ -179,6 +255,7 @@ async def test_get_report_for_month_with_strict_constructor_check(mock_get_month
     # Настраиваем возвращаемое значение мок-метода
     expected_report_text = "Временный текст отчета"
     mock_get_month_report.return_value = expected_report_text
+    mock_get_chart_renderer.return_value.render_report = AsyncMock(return_value=[])
 
     # 2. Выполнение команды
     try:
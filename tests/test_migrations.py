@@ -0,0 +1,162 @@
+import pytest
+
+from app.migrations import (
+    MIGRATIONS, run_migrations, get_schema_version, backfill_date_iso, backfill_balance, scale_amounts_to_minor_units
+)
+from tests.test_db_utils import get_test_db_session
+
+
+# Миграции на пустой БД доводят схему до последней версии.
+@pytest.mark.asyncio
+async def test_run_migrations_sets_user_version():
+    conn = await get_test_db_session()
+
+    version = await run_migrations(conn)
+
+    assert version == MIGRATIONS[-1].version
+    assert await get_schema_version(conn) == MIGRATIONS[-1].version
+
+    # Индекс для выборок по месяцу создан.
+    cursor = await conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='index' AND name='idx_out_user_date_iso'"
+    )
+    assert await cursor.fetchone() is not None
+
+    await conn.close()
+
+
+# Повторный запуск ничего не меняет и не падает.
+@pytest.mark.asyncio
+async def test_run_migrations_is_idempotent():
+    conn = await get_test_db_session()
+
+    first = await run_migrations(conn)
+    second = await run_migrations(conn)
+
+    assert first == second
+    await conn.close()
+
+
+# Старая БД (без date_iso) получает заполненную колонку.
+@pytest.mark.asyncio
+async def test_run_migrations_backfills_legacy_database():
+    conn = await get_test_db_session()
+
+    # Схема и данные, как до появления миграций (user_version = 0).
+    await conn.execute(MIGRATIONS[0].statements[0])
+    await conn.executemany(
+        "INSERT INTO out (user_tg_id, category, sub_category, summ, description, date) VALUES (?, ?, ?, ?, ?, ?)",
+        [(1, 'Еда', 'Еда', 100 + i, 'Еда', f"{i % 28 + 1:02d}.03.2024") for i in range(25)]
+    )
+    await conn.commit()
+
+    await run_migrations(conn)
+
+    cursor = await conn.execute("SELECT COUNT(*) FROM out WHERE date_iso IS NULL")
+    assert (await cursor.fetchone())[0] == 0
+    # Суммы переведены в копейки (миграция 12).
+    cursor = await conn.execute("SELECT date_iso FROM out WHERE summ = 10000")
+    assert (await cursor.fetchone())[0] == "2024-03-01"
+
+    await conn.close()
+
+
+# Заполнение идет пачками и обрабатывает все строки.
+@pytest.mark.asyncio
+async def test_backfill_date_iso_in_small_batches():
+    conn = await get_test_db_session()
+    await conn.execute(MIGRATIONS[0].statements[0])
+    await conn.execute("ALTER TABLE out ADD COLUMN date_iso TEXT")
+    await conn.executemany(
+        "INSERT INTO out (user_tg_id, summ, date) VALUES (?, ?, ?)",
+        [(1, i, "15.01.2025") for i in range(10)]
+    )
+    await conn.commit()
+
+    updated = await backfill_date_iso(conn, batch_size=3)
+
+    assert updated == 10
+    await conn.close()
+
+
+# Записи, вставленные без date_iso, заполняются триггером.
+@pytest.mark.asyncio
+async def test_trigger_fills_date_iso_on_insert():
+    conn = await get_test_db_session()
+    await run_migrations(conn)
+
+    await conn.execute(
+        "INSERT INTO out (user_tg_id, category, sub_category, summ, description, date) VALUES (?, ?, ?, ?, ?, ?)",
+        (1, 'Еда', 'Обед', 500, 'Еда обед', '31.12.2024')
+    )
+    await conn.commit()
+
+    cursor = await conn.execute("SELECT date_iso FROM out")
+    assert (await cursor.fetchone())[0] == "2024-12-31"
+    await conn.close()
+
+
+# Начальный баланс считается по расходам, записанным до появления таблицы balance.
+@pytest.mark.asyncio
+async def test_backfill_balance_from_existing_notes():
+    conn = await get_test_db_session()
+    await run_migrations(conn)
+    await conn.execute("DELETE FROM balance")
+    await conn.executemany(
+        "INSERT INTO income (user_tg_id, category, summ, description, date, date_iso) VALUES (?, ?, ?, ?, ?, ?)",
+        [(1, "Зарплата", 1000, "Зарплата", "01.03.2024", "2024-03-01")]
+    )
+    await conn.execute("DELETE FROM balance")
+    await conn.executemany(
+        "INSERT INTO out (user_tg_id, summ, date) VALUES (?, ?, ?)",
+        [(1, 100, "02.03.2024"), (1, 50, "03.03.2024"), (2, 30, "03.03.2024")]
+    )
+    await conn.execute("DELETE FROM balance")
+    await conn.commit()
+
+    assert await backfill_balance(conn) == 2
+    # Повторный пересчет не удваивает суммы.
+    await backfill_balance(conn)
+
+    cursor = await conn.execute("SELECT user_tg_id, income, expense FROM balance ORDER BY user_tg_id")
+    assert [tuple(row) for row in await cursor.fetchall()] == [(1, 1000, 150), (2, 0, 30)]
+    await conn.close()
+
+
+# Перевод в копейки, прерванный после первой пачки, продолжается без повторного умножения.
+@pytest.mark.asyncio
+async def test_scale_amounts_resumes_after_interruption():
+    conn = await get_test_db_session()
+    await run_migrations(conn)
+    await conn.executemany(
+        "INSERT INTO out (user_tg_id, summ, date) VALUES (?, ?, ?)",
+        [(1, 10, "15.01.2025") for _ in range(5)]
+    )
+    # Как до миграции 12: суммы в рублях, перевод еще не начинался.
+    await conn.execute("DELETE FROM migration_progress")
+    await conn.commit()
+
+    original_commit = conn.commit
+    commits = 0
+
+    async def failing_commit():
+        nonlocal commits
+        commits += 1
+        if commits == 3:
+            raise RuntimeError("прервано")
+        await original_commit()
+
+    conn.commit = failing_commit
+    with pytest.raises(RuntimeError):
+        await scale_amounts_to_minor_units(conn, batch_size=2)
+    await conn.rollback()
+    conn.commit = original_commit
+
+    await scale_amounts_to_minor_units(conn, batch_size=2)
+    await scale_amounts_to_minor_units(conn, batch_size=2)
+
+    cursor = await conn.execute("SELECT DISTINCT summ FROM out")
+    assert [row[0] for row in await cursor.fetchall()] == [1000]
+    cursor = await conn.execute("SELECT expense FROM balance WHERE user_tg_id = 1")
+    assert (await cursor.fetchone())[0] == 5000
+    await conn.close()
@@ -0,0 +1,24 @@
+import pytest
+
+from app.money import format_money, parse_amount
+
+
+@pytest.mark.parametrize("text, minor", [
+    ("149", 14900), ("149.90", 14990), ("149,9", 14990), ("0,05", 5),
+    ("149.999", None), ("-5", None), ("1e3", None), ("", None),
+])
+def test_parse_amount_in_kopecks(text, minor):
+    assert parse_amount(text) == minor
+
+
+@pytest.mark.parametrize("minor, signed, text", [
+    (280000, False, "2800"), (14990, False, "149.90"), (5, False, "0.05"),
+    (-1250, True, "-12.50"), (30000, True, "+300"), (0, True, "+0"),
+])
+def test_format_money(minor, signed, text):
+    assert format_money(minor, signed=signed) == text
+
+
+# Сумма многих записей с копейками точная: целые копейки не накапливают ошибок float.
+def test_many_decimal_amounts_sum_exactly():
+    assert format_money(sum(parse_amount("0.10") for _ in range(1000))) == "100"
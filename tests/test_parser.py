@@ -1,11 +1,11 @@
 import pytest
 
-from app.parser import split_message
+from app.parser import split_income_message, split_message
 
 @pytest.mark.asyncio
 async def test_split_message_sum_at_start_simple():
-    # Ожидаемый результат: (сумма, категория, подкатегория, описание)
-    expected = (100, "Еда", "Еда", "Еда")
+    # Ожидаемый результат: (сумма в копейках, категория, подкатегория, описание)
+    expected = (10000, "Еда", "Еда", "Еда")
     result = await split_message("100 Еда")
     assert result == expected
 
@@ -14,7 +14,7 @@ async def test_split_message_sum_at_start():
     # Сумма в начале, категория, описание
     msg = "500 Еда Обед с коллегами"
     summ, cat, sub_cat, descr = await split_message(msg)
-    assert summ == 500
+    assert summ == 50000
     assert cat == "Еда"
     assert sub_cat == "Обед"
     assert descr == "Еда Обед с коллегами"
@@ -24,7 +24,7 @@ async def test_split_message_sum_at_end():
     # Сумма в конце
     msg = "Кофе Завтрак 150"
     summ, cat, sub_cat, descr = await split_message(msg)
-    assert summ == 150
+    assert summ == 15000
     assert cat == "Кофе"
     assert sub_cat == "Завтрак"
     assert descr == "Кофе Завтрак"
@@ -34,7 +34,7 @@ async def test_split_message_sum_at_end_add_space():
     # Сумма в конце и дополнительные пробелы
     msg = "  Кофе  Завтрак 150   "
     summ, cat, sub_cat, descr = await split_message(msg)
-    assert summ == 150
+    assert summ == 15000
     assert cat == "Кофе"
     assert sub_cat == "Завтрак"
     assert descr == "Кофе Завтрак"
@@ -46,3 +46,25 @@ async def test_split_message_no_sum():
     summ, _, _, _ = await split_message(msg)
     assert summ is None
 
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("msg, summ", [
+    ("149.90 Кафе", 14990),
+    ("149,9 Кафе", 14990),
+    ("Кафе 0.05", 5),
+    ("149.999 Кафе", None),
+    ("149. Кафе", None),
+])
+async def test_split_message_decimal_sum_in_kopecks(msg, summ):
+    assert (await split_message(msg))[0] == summ
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("msg, expected", [
+    ("+5000 Зарплата", (500000, "Зарплата", "Зарплата")),
+    ("Премия за квартал +12000,50", (1200050, "Премия", "Премия за квартал")),
+    ("5000 Зарплата", (None, "", "")),
+    ("+5000", (None, "", "")),
+    ("+0 Зарплата", (None, "", "")),
+])
+async def test_split_income_message(msg, expected):
+    assert await split_income_message(msg) == expected
@@ -0,0 +1,49 @@
+from datetime import date
+
+import pytest
+
+from app.periods import MONTH_BY_NAME, MONTH_NAMES, Period, month_period, parse_period, year_period
+
+TODAY = date(2025, 1, 15)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("март", month_period(3, 2025)),
+    ("Марта", month_period(3, 2025)),
+    ("в марте", None),
+    ("марте", month_period(3, 2025)),
+    ("мар.", month_period(3, 2025)),
+    ("мар 2024", month_period(3, 2024)),
+    ("марта 2024 года", month_period(3, 2024)),
+    ("03", month_period(3, 2025)),
+    ("3", month_period(3, 2025)),
+    ("3.2024", month_period(3, 2024)),
+    ("03/2024", month_period(3, 2024)),
+    ("2024-03", month_period(3, 2024)),
+    ("2024", year_period(2024)),
+    ("2024 г", year_period(2024)),
+    ("прошлый месяц", month_period(12, 2024)),
+    ("этот месяц", month_period(1, 2025)),
+    ("прошлый год", year_period(2024)),
+    ("13", None),
+    ("13.2024", None),
+    ("кофе", None),
+    ("", None),
+])
+def test_parse_period(text, expected):
+    assert parse_period(text, TODAY) == expected
+
+
+def test_period_bounds_and_names():
+    period = parse_period("дек 2024", TODAY)
+
+    assert (period.start, period.end) == ("2024-12-01", "2025-01-01")
+    assert period.name == "Декабрь 2024 года"
+    assert year_period(2024) == Period("2024-01-01", "2025-01-01", year=2024)
+    assert year_period(2024).name == "2024 год"
+
+
+def test_every_month_has_forms():
+    for number, name in enumerate(MONTH_NAMES, start=1):
+        assert MONTH_BY_NAME[name] == number
+    assert sorted(set(MONTH_BY_NAME.values())) == list(range(1, 13))
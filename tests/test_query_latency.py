@@ -0,0 +1,144 @@
+import os
+import json
+import time
+import random
+import asyncio
+import sqlite3
+import statistics
+from datetime import date, timedelta
+from pathlib import Path
+
+import pytest
+import aiosqlite
+
+from app.migrations import run_migrations
+from app.storage import SQLiteStorage, build_fts_query, comparison_periods
+
+# Бюджеты задержки запросов на сгенерированной БД из BUDGETS["rows"] записей.
+# Генерация занимает около минуты, поэтому набор запускается только явно:
+#   CASHBOT_LATENCY_TESTS=1 pytest tests/test_query_latency.py
+LATENCY_ENV = "CASHBOT_LATENCY_TESTS"
+BUDGETS = json.loads(Path(__file__).with_name("query_budgets.json").read_text(encoding="utf-8"))
+RUNS = 5
+
+requires_latency = pytest.mark.skipif(os.getenv(LATENCY_ENV) != "1", reason=f"{LATENCY_ENV}=1 не задан")
+
+CATEGORIES = {
+    "Еда": ["Обед", "Ужин", "Продукты", "Кофе"],
+    "Транспорт": ["Такси", "Метро", "Бензин"],
+    "Здоровье": ["Стоматолог", "Аптека"],
+    "Жилье": ["Аренда", "Коммуналка"],
+    "Кино": ["Кино"],
+    "Подарки": ["Подарки"],
+}
+FIRST_DAY = date(2023, 1, 1)
+DAYS = 3 * 365
+
+# Параметры каждого запроса: пользователь 42 и месяц июнь 2025 внутри сгенерированных данных.
+COMPARISON_PARAMS = {"user_tg_id": 42}
+for _name, (_start, _end) in comparison_periods(6, 2025).items():
+    COMPARISON_PARAMS[f"{_name}_start"], COMPARISON_PARAMS[f"{_name}_end"] = _start, _end
+
+LATENCY_CASES = {
+    "SQL_INSERT_NOTE": (42, "Еда", "Обед", 500, "Еда Обед", "15.06.2025", "2025-06-15", None),
+    "SQL_NOTES_BY_USER_AND_PERIOD": (42, "2025-06-01", "2025-07-01"),
+    "SQL_TOTALS_BY_PERIOD": ("2025-06-01", "2025-07-01"),
+    "SQL_SEARCH_NOTES": (build_fts_query(["такси"]), 42, "2023-01-01", "2026-01-01", 20),
+    "SQL_CATEGORY_COMPARISON": COMPARISON_PARAMS,
+    "SQL_CATEGORY_USAGE": (42,),
+    "SQL_DELETE_GROUP_MEMBERS": (),
+    "SQL_INSERT_GROUP_MEMBER": ("Семья", 43),
+    "SQL_GROUP_TOTALS": ("Семья", "2025-06-01", "2025-07-01"),
+    "SQL_INSERT_INCOME": (42, "Зарплата", 50000, "Зарплата", "05.06.2025", "2025-06-05"),
+    "SQL_BALANCE_BY_USER": (42,),
+    "SQL_MARK_PROCESSED": (5, 1_000_001, 1_750_000_000),
+    "SQL_IS_PROCESSED": (5, 500),
+    "SQL_EXPIRE_PROCESSED": (1_700_000_100,),
+    "SQL_DELETE_RATES": (),
+    "SQL_INSERT_RATE": ("EUR", "2026-01-15", 98.0),
+    "SQL_INSERT_RECURRING": (42, "Жилье", "Аренда", 25000, "Жилье Аренда", 5, None, "2025-06-01"),
+    "SQL_RECURRING_BY_USER": (42,),
+    "SQL_DELETE_RECURRING": (42, 42),
+    "SQL_DUE_RECURRING": ("2025-06-15",),
+    "SQL_INSERT_RECURRING_NOTE": (42, "Жилье", "Аренда", 25000, "Жилье Аренда", "05.06.2025", "2025-06-05", 42),
+    "SQL_UPDATE_RECURRING_LAST_DATE": ("2025-06-15", 42),
+    "SQL_RECURRING_NOTE_COUNTS": ("2025-06-15", "2025-06-15"),
+}
+
+
+def generate_notes(rows: int, users: int):
+    """Записи со случайными пользователями, категориями и датами за три года (воспроизводимо)."""
+    rnd = random.Random(0)
+    categories = list(CATEGORIES.items())
+    for _ in range(rows):
+        category, sub_categories = rnd.choice(categories)
+        sub_category = rnd.choice(sub_categories)
+        day = FIRST_DAY + timedelta(days=rnd.randrange(DAYS))
+        # Каждая десятая запись - в евро, отчеты пересчитывают ее по курсу.
+        yield (rnd.randrange(1, users + 1), category, sub_category, rnd.randrange(50, 5000),
+               f"{category} {sub_category}", day.strftime("%d.%m.%Y"), day.isoformat(),
+               "EUR" if rnd.randrange(10) == 0 else None)
+
+
+@pytest.fixture(scope="module")
+def latency_db(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("latency") / "bot.db")
+
+    async def migrate():
+        async with aiosqlite.connect(path) as conn:
+            await run_migrations(conn)
+
+    asyncio.run(migrate())
+
+    conn = sqlite3.connect(path)
+    conn.executemany(SQLiteStorage.SQL_INSERT_NOTE, generate_notes(BUDGETS["rows"], BUDGETS["users"]))
+    # Ключи обработанных сообщений за двое суток: около 10 тысяч.
+    conn.executemany(
+        SQLiteStorage.SQL_MARK_PROCESSED,
+        [(user, message_id, 1_700_000_000 + message_id) for user in range(1, 11) for message_id in range(1000)]
+    )
+    conn.executemany(
+        SQLiteStorage.SQL_INSERT_RATE,
+        [("EUR", (FIRST_DAY + timedelta(days=day)).isoformat(), 90 + day % 20) for day in range(DAYS)]
+    )
+    # Семья из трех пользователей.
+    conn.executemany(SQLiteStorage.SQL_INSERT_GROUP_MEMBER, [("Семья", user) for user in (40, 41, 42)])
+    conn.executemany(
+        SQLiteStorage.SQL_INSERT_RECURRING,
+        [(user, "Жилье", "Аренда", 25000, "Жилье Аренда", 5, None, "2025-06-01")
+         for user in range(1, BUDGETS["users"] + 1)]
+    )
+    conn.commit()
+    conn.close()
+    return path
+
+
+def test_every_statement_has_budget():
+    statements = sorted(name for name in vars(SQLiteStorage) if name.startswith("SQL_"))
+    assert statements == sorted(BUDGETS["budgets_ms"]) == sorted(LATENCY_CASES)
+
+
+@requires_latency
+@pytest.mark.asyncio
+@pytest.mark.parametrize("name", sorted(LATENCY_CASES))
+async def test_statement_latency_within_budget(latency_db, name):
+    sql = getattr(SQLiteStorage, name).format(out=SQLiteStorage._out_source(False), schema="main")
+    params = LATENCY_CASES[name]
+
+    timings = []
+    async with aiosqlite.connect(latency_db) as conn:
+        # Первый запуск прогревает кэш страниц и не учитывается.
+        for run in range(RUNS + 1):
+            started = time.perf_counter()
+            cursor = await conn.execute(sql, params)
+            await cursor.fetchall()
+            await cursor.close()
+            elapsed = (time.perf_counter() - started) * 1000
+            # Изменяющие запросы откатываются, чтобы все запуски шли по одним и тем же данным.
+            await conn.rollback()
+            if run:
+                timings.append(elapsed)
+
+    median = statistics.median(timings)
+    budget = BUDGETS["budgets_ms"][name]
+    assert median <= budget, f"{name}: {median:.1f} мс при бюджете {budget} мс"
@@ -0,0 +1,119 @@
+import re
+
+import pytest
+import aiosqlite
+from pytest_asyncio import fixture as async_fixture
+
+from app.archive import ARCHIVE_SCHEMA
+from app.migrations import run_migrations
+from app.storage import SQLiteStorage
+
+# Индекс, который должен быть в плане каждого SQL-запроса SQLiteStorage (None - вставка, индекс не нужен).
+# Новый запрос без записи здесь роняет test_every_statement_has_plan_expectation.
+PLAN_EXPECTATIONS = {
+    "SQL_INSERT_NOTE": None,
+    "SQL_NOTES_BY_USER_AND_PERIOD": "idx_out_user_date_iso",
+    "SQL_TOTALS_BY_PERIOD": "idx_out_date_iso_user_currency",
+    "SQL_SEARCH_NOTES": "idx_out_user_date_iso",
+    "SQL_CATEGORY_COMPARISON": "idx_out_user_date_iso",
+    "SQL_CATEGORY_USAGE": "idx_out_user_date_iso",
+    "SQL_DELETE_GROUP_MEMBERS": None,
+    "SQL_INSERT_GROUP_MEMBER": None,
+    "SQL_GROUP_TOTALS": "idx_out_user_date_iso",
+    "SQL_INSERT_INCOME": None,
+    "SQL_BALANCE_BY_USER": "INTEGER PRIMARY KEY",
+    "SQL_MARK_PROCESSED": None,
+    "SQL_IS_PROCESSED": "PRIMARY KEY",
+    "SQL_EXPIRE_PROCESSED": "idx_processed_updates_at",
+    "SQL_DELETE_RATES": None,
+    "SQL_INSERT_RATE": None,
+    "SQL_INSERT_RECURRING": None,
+    "SQL_RECURRING_BY_USER": "idx_recurring_user",
+    "SQL_DELETE_RECURRING": "INTEGER PRIMARY KEY",
+    "SQL_DUE_RECURRING": None,
+    "SQL_INSERT_RECURRING_NOTE": None,
+    "SQL_UPDATE_RECURRING_LAST_DATE": "INTEGER PRIMARY KEY",
+    "SQL_RECURRING_NOTE_COUNTS": "idx_out_recurring_date",
+}
+
+# Полный просмотр допустим только для небольших служебных таблиц.
+# recurring: правила читаются целиком раз в сутки планировщиком; rates и group_members заменяются целиком при старте.
+FULL_SCAN_ALLOWED = {
+    "SQL_DUE_RECURRING": {"recurring"},
+    "SQL_RECURRING_NOTE_COUNTS": {"recurring"},
+    "SQL_DELETE_RATES": {"rates"},
+    "SQL_DELETE_GROUP_MEMBERS": {"group_members"},
+}
+
+# "SCAN out", "SCAN main.out USING INDEX ..." - просмотр всей таблицы или всего индекса.
+# Просмотр виртуальной таблицы FTS5 по MATCH и подзапросов полным просмотром не считается.
+FULL_SCAN_RE = re.compile(r"^SCAN (?:\w+\.)?(\w+)(?!.*VIRTUAL TABLE)")
+
+
+def get_statements():
+    return sorted(name for name in vars(SQLiteStorage) if name.startswith("SQL_"))
+
+
+def statement_variants(name: str):
+    """Текст запроса для основной таблицы и (если запрос читает {out}/{schema}) для объединения с архивом."""
+    sql = getattr(SQLiteStorage, name)
+    if "{out}" in sql:
+        yield "hot", sql.format(out=SQLiteStorage._out_source(False))
+        yield "archive", sql.format(out=SQLiteStorage._out_source(True))
+    elif "{schema}" in sql:
+        yield "hot", sql.format(schema="main")
+        yield "archive", sql.format(schema=ARCHIVE_SCHEMA)
+    else:
+        yield "hot", sql
+
+
+def make_params(sql: str):
+    """Параметры-заглушки: план SQLite без ANALYZE от значений не зависит."""
+    names = re.findall(r":(\w+)", sql)
+    if names:
+        return {name: 1 for name in names}
+    return (1,) * sql.count("?")
+
+
+@async_fixture
+async def plan_conn(tmp_path):
+    archive_file = str(tmp_path / "bot.archive.db")
+    async with aiosqlite.connect(archive_file) as archive_conn:
+        await run_migrations(archive_conn)
+
+    conn = await aiosqlite.connect(str(tmp_path / "bot.db"))
+    await run_migrations(conn)
+    await conn.execute(f"ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}", (archive_file,))
+    yield conn
+    await conn.close()
+
+
+def test_every_statement_has_plan_expectation():
+    assert get_statements() == sorted(PLAN_EXPECTATIONS)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("name", sorted(PLAN_EXPECTATIONS))
+async def test_statement_uses_index(plan_conn, name):
+    for variant, sql in statement_variants(name):
+        cursor = await plan_conn.execute(f"EXPLAIN QUERY PLAN {sql}", make_params(sql))
+        plan = [row[3] for row in await cursor.fetchall()]
+        await cursor.close()
+
+        # Просмотр результата подзапроса (CO-ROUTINE, например объединения с архивом "AS note") -
+        # не просмотр таблицы: сам подзапрос проверяется по своим строкам плана.
+        coroutines = {detail.split()[1] for detail in plan if detail.startswith("CO-ROUTINE")}
+        for detail in plan:
+            match = FULL_SCAN_RE.match(detail)
+            assert match is None or match.group(1) in coroutines | FULL_SCAN_ALLOWED.get(name, set()), (
+                f"{name} ({variant}): полный просмотр таблицы: {plan}"
+            )
+
+        index = PLAN_EXPECTATIONS[name]
+        if index is not None:
+            # Курс валюты и участники группы ищутся по первичному ключу в подзапросах, это не выборка записей.
+            searches = [detail for detail in plan if detail.startswith("SEARCH") and "out_fts" not in detail
+                        and not detail.startswith(("SEARCH rates", "SEARCH main.group_members"))]
+            assert searches and all(index in detail for detail in searches), (
+                f"{name} ({variant}): ожидался индекс {index}: {plan}"
+            )
@@ -0,0 +1,98 @@
+from datetime import date, datetime
+
+import pytest
+from aiogram import types
+from unittest.mock import AsyncMock, Mock
+
+from app.recurring import due_dates, seconds_until_next_run
+from app.recurring_handler import RecurringHandler
+from app.storage import SQLiteStorage, Storage
+from tests.test_db_utils import get_test_db_session, setup_test_db, single_connection_factory
+
+
+def create_mock_message(text: str) -> types.Message:
+    """Создает мок-объект для aiogram.types.Message."""
+    mock_message = Mock(spec=types.Message)
+    mock_message.text = text
+    mock_message.from_user = Mock(id=12345)
+    mock_message.reply = AsyncMock()
+    return mock_message
+
+
+def test_monthly_due_dates_clamp_to_month_end():
+    assert due_dates(31, None, date(2025, 1, 31), date(2025, 5, 1)) == [
+        date(2025, 2, 28), date(2025, 3, 31), date(2025, 4, 30)
+    ]
+    # Интервал (after, until]: день after не входит, день until входит.
+    assert due_dates(5, None, date(2025, 1, 5), date(2025, 2, 5)) == [date(2025, 2, 5)]
+    assert due_dates(5, None, date(2024, 12, 6), date(2025, 1, 4)) == []
+
+
+def test_weekly_due_dates():
+    # 06.01.2025 - понедельник.
+    assert due_dates(None, 0, date(2025, 1, 6), date(2025, 1, 20)) == [date(2025, 1, 13), date(2025, 1, 20)]
+    assert due_dates(None, 2, date(2025, 1, 6), date(2025, 1, 8)) == [date(2025, 1, 8)]
+
+
+def test_seconds_until_next_run():
+    assert seconds_until_next_run(datetime(2025, 1, 1, 0, 0)) == 5 * 60
+    assert seconds_until_next_run(datetime(2025, 1, 1, 12, 0)) == 12 * 3600 + 5 * 60
+
+
+# Уникальный индекс не дает задвоить платеж, даже если last_date правила откатился.
+@pytest.mark.asyncio
+async def test_recurring_unique_index_prevents_duplicates():
+    conn = await get_test_db_session()
+    await setup_test_db(conn)
+    storage = SQLiteStorage(session_factory=single_connection_factory(conn))
+    rule_id = await storage.add_recurring(1, "Жилье", "Аренда", 25000, "Жилье Аренда", 5, None, date(2025, 1, 1))
+
+    assert await storage.materialize_recurring(date(2025, 2, 10)) == {1: 2}
+    await conn.execute("UPDATE recurring SET last_date = '2025-01-01' WHERE id = ?", (rule_id,))
+    await conn.commit()
+    assert await storage.materialize_recurring(date(2025, 2, 10)) == {}
+
+    cursor = await conn.execute("SELECT COUNT(*) FROM out WHERE recurring_id = ?", (rule_id,))
+    assert (await cursor.fetchone())[0] == 2
+    await conn.close()
+
+
+@pytest.mark.asyncio
+async def test_handler_adds_weekly_rule():
+    mock_message = create_mock_message("/recurring 500 Спорт Бассейн пн")
+    mock_storage = Mock(spec=Storage)
+    mock_storage.add_recurring = AsyncMock(return_value=3)
+
+    report_text = await RecurringHandler(message=mock_message, storage=mock_storage).handle()
+
+    mock_storage.add_recurring.assert_awaited_once_with(
+        user_tg_id=12345, category="Спорт", sub_category="Бассейн", summ=50000, description="Спорт Бассейн",
+        day_of_month=None, weekday=0, start_date=date.today()
+    )
+    assert report_text.startswith("Правило #3 добавлено: Спорт Бассейн 500 руб., каждую неделю (пн).")
+
+
+@pytest.mark.asyncio
+async def test_handler_rejects_rule_without_schedule():
+    mock_message = create_mock_message("/recurring 25000 Жилье Аренда")
+    mock_storage = Mock(spec=Storage)
+    mock_storage.add_recurring = AsyncMock()
+
+    await RecurringHandler(message=mock_message, storage=mock_storage).handle()
+
+    mock_storage.add_recurring.assert_not_awaited()
+    assert mock_message.reply.await_args.args[0].startswith("Не удалось разобрать правило.")
+
+
+@pytest.mark.asyncio
+async def test_handler_lists_rules():
+    mock_message = create_mock_message("/recurring")
+    mock_storage = Mock(spec=Storage)
+    mock_storage.get_recurring = AsyncMock(return_value=[
+        {"id": 1, "category": "Жилье", "sub_category": "Аренда", "summ": 2500000, "description": "Жилье Аренда",
+         "day_of_month": 5, "weekday": None},
+    ])
+
+    report_text = await RecurringHandler(message=mock_message, storage=mock_storage).handle()
+
+    assert "#1 Жилье Аренда: 25000 руб., каждый месяц 5 числа" in report_text
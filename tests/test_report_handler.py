@@ -7,6 +7,7 @@ from unittest.mock import AsyncMock, patch, Mock
 
 from config import MONTH_MAP
 from app.report_handler import ReportHandler
+from app.storage import NoteRecord, Storage
 
 
 # Имитация объекта Message
@@ -29,6 +30,19 @@ def create_mock_message(text: str) -> types.Message:
     return mock_message
 
 
+# Имитация хранилища
+def create_mock_storage(notes: list) -> Storage:
+    """Создает мок-объект хранилища, который отдает переданные записи потоком."""
+    async def iter_notes(**kwargs):
+        for note in notes:
+            yield NoteRecord(user_tg_id=12345, category=note["category"], summ=note["summ"],
+                             description=note.get("description", note["category"]), date=note.get("date"))
+
+    mock_storage = Mock(spec=Storage)
+    mock_storage.iter_notes_by_user_and_period = Mock(side_effect=iter_notes)
+    return mock_storage
+
+
 @pytest.mark.asyncio
 async def test_reply_is_called_when_month_is_missing():
     """
@@ -40,14 +54,11 @@ async def test_reply_is_called_when_month_is_missing():
     # Создаем мок-сообщение, имитирующее команду без аргумента: /report
     mock_message = create_mock_message("/report")
 
-    # МОК для соединения с БД (пока достаточно простого Mock)
-    mock_db_conn = Mock()
-
-    # МОК для функции из CRUD
-    mock_crud_func = AsyncMock(return_value=[])
+    # МОК для хранилища без записей
+    mock_storage = create_mock_storage([])
 
     # Инициализируем обработчик, передавая мок-сообщение.
-    handler = ReportHandler(message=mock_message, db_conn=mock_db_conn, crud_func=mock_crud_func)
+    handler = ReportHandler(message=mock_message, storage=mock_storage)
 
     # 2. Выполнение.
     # Вызываем метод, который содержит логику проверки месяца и отправки ответа
@@ -86,18 +97,15 @@ async def test_get_month_report_includes_current_month_name():
     # Создаем мок-сообщение, имитирующее команду без аргумента: /report
     mock_message = create_mock_message("/report Июль")
 
-    # МОК для соединения с БД (пока достаточно простого Mock)
-    mock_db_conn = Mock()
-
-    # Мок-функция возвращает тестовые данные, чтобы ReportHandler мог посчитать записи
-    mock_crud_func = AsyncMock(return_value=[
-        {"summ": 1100, "category": "Еда"},
-        {"summ": 900, "category": "Еда"},
-        {"summ": 800, "category": "Продукты"}
+    # Мок-хранилище возвращает тестовые данные, чтобы ReportHandler мог посчитать записи
+    mock_storage = create_mock_storage([
+        {"summ": 110000, "category": "Еда"},
+        {"summ": 90000, "category": "Еда"},
+        {"summ": 80000, "category": "Продукты"}
     ])
 
     # Инициализируем обработчик, передавая мок-сообщение.
-    handler = ReportHandler(message=mock_message, db_conn=mock_db_conn, crud_func=mock_crud_func)
+    handler = ReportHandler(message=mock_message, storage=mock_storage)
 
     # Получаем текущее название месяца на английском
     # current_month_english = datetime.now().strftime("%B")
@@ -151,16 +159,14 @@ async def test_successful_report_generation_sends_reply():
     # Создаем мок-сообщение с указанием месяца
     mock_message = create_mock_message("/report Июль")
 
-    mock_db_conn = Mock()
-
-    # Мок-функция возвращает тестовые данные
-    mock_crud_func = AsyncMock(return_value=[
-        {"summ": 1100, "category": "Еда"},
-        {"summ": 900, "category": "Еда"},
-        {"summ": 800, "category": "Продукты"}
+    # Мок-хранилище возвращает тестовые данные
+    mock_storage = create_mock_storage([
+        {"summ": 110000, "category": "Еда"},
+        {"summ": 90000, "category": "Еда"},
+        {"summ": 80000, "category": "Продукты"}
     ])
 
-    handler = ReportHandler(message=mock_message, db_conn=mock_db_conn, crud_func=mock_crud_func)
+    handler = ReportHandler(message=mock_message, storage=mock_storage)
 
     report_year = 2025
     expected_full_report = (
@@ -194,3 +200,48 @@ async def test_successful_report_generation_sends_reply():
 
 
 
+
+
+# Отчет сравнения с прошлым месяцем и прошлым годом
+@pytest.mark.asyncio
+async def test_compare_report_formats_deltas():
+    mock_message = create_mock_message("/compare март")
+    mock_storage = Mock(spec=Storage)
+    mock_storage.get_category_comparison = AsyncMock(return_value=[
+        {"category": "Еда", "current": 150000, "previous": 120000, "last_year": 170000},
+        {"category": "Кино", "current": 0, "previous": 40000, "last_year": 0},
+    ])
+
+    handler = ReportHandler(message=mock_message, storage=mock_storage)
+    report_text = await handler.get_compare_report()
+
+    year = datetime.now().year
+    mock_storage.get_category_comparison.assert_awaited_once_with(user_tg_id=12345, month=3, year=year)
+    expected_report = (
+        f"Сравнение расходов за Март {year} года по категориям:\n\n"
+        f"🏷️ Еда: 1500 руб.\n"
+        f"    прошлый месяц: 1200 руб. (+300)\n"
+        f"    Март {year - 1}: 1700 руб. (-200)\n"
+        f"🏷️ Кино: 0 руб.\n"
+        f"    прошлый месяц: 400 руб. (-400)\n"
+        f"    Март {year - 1}: 0 руб. (+0)\n"
+        f"\nОбщая сумма: 1500 руб.\n"
+        f"Прошлый месяц: 1600 руб. (-100)\n"
+        f"Март {year - 1}: 1700 руб. (-200)"
+    )
+    assert report_text == expected_report
+    mock_message.reply.assert_called_once_with(expected_report)
+
+
+# Месяц можно указать в любой форме и с годом.
+@pytest.mark.asyncio
+async def test_report_month_with_year_in_genitive_form():
+    mock_message = create_mock_message("/report марта 2024")
+    mock_storage = create_mock_storage([{"summ": 500, "category": "Еда"}])
+
+    report_text = await ReportHandler(message=mock_message, storage=mock_storage).get_month_report()
+
+    mock_storage.iter_notes_by_user_and_period.assert_called_once_with(
+        user_tg_id=12345, start_date="2024-03-01", end_date="2024-04-01"
+    )
+    assert report_text.startswith("Ваш отчет за Март 2024 года по категориям:")
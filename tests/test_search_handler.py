@@ -0,0 +1,90 @@
+from datetime import datetime
+
+import pytest
+from aiogram import types
+from unittest.mock import AsyncMock, Mock
+
+from app.search_handler import SearchHandler
+from app.storage import Storage
+
+
+def create_mock_message(text: str) -> types.Message:
+    """Создает мок-объект для aiogram.types.Message."""
+    mock_message = Mock(spec=types.Message)
+    mock_message.text = text
+    mock_message.from_user = Mock(id=12345)
+    mock_message.reply = AsyncMock()
+    return mock_message
+
+
+def create_mock_storage(result: dict) -> Storage:
+    mock_storage = Mock(spec=Storage)
+    mock_storage.search_notes = AsyncMock(return_value=result)
+    return mock_storage
+
+
+# Год в конце команды задает период поиска.
+@pytest.mark.asyncio
+async def test_search_with_year_period():
+    mock_message = create_mock_message("/search стоматолог 2024")
+    mock_storage = create_mock_storage({
+        "notes": [{"date": "15.03.2024", "description": "Здоровье Стоматолог", "summ": 500000}],
+        "count": 1,
+        "total": 500000,
+    })
+
+    report_text = await SearchHandler(message=mock_message, storage=mock_storage).search()
+
+    mock_storage.search_notes.assert_awaited_once_with(
+        user_tg_id=12345, terms=["стоматолог"], start_date="2024-01-01", end_date="2025-01-01", limit=20
+    )
+    assert report_text == (
+        "🔎 Найдено записей по запросу «стоматолог» за 2024 год: 1\n\n"
+        "15.03.2024 Здоровье Стоматолог: 5000 руб.\n"
+        "\nИтого: 5000 руб."
+    )
+    mock_message.reply.assert_called_once_with(report_text)
+
+
+# Название месяца задает месяц текущего года.
+@pytest.mark.asyncio
+async def test_search_with_month_period():
+    mock_message = create_mock_message("/search кофе март")
+    mock_storage = create_mock_storage({"notes": [], "count": 0, "total": 0})
+
+    await SearchHandler(message=mock_message, storage=mock_storage).search()
+
+    year = datetime.now().year
+    kwargs = mock_storage.search_notes.call_args.kwargs
+    assert (kwargs["start_date"], kwargs["end_date"]) == (f"{year}-03-01", f"{year}-04-01")
+    mock_message.reply.assert_called_once()
+
+
+# Число без года - слово для поиска, а не месяц; MM.YYYY - месяц.
+@pytest.mark.asyncio
+@pytest.mark.parametrize("text, terms, period", [
+    ("/search такси 10", ["такси", "10"], ("0001-01-01", "9999-12-31")),
+    ("/search аптека 3", ["аптека", "3"], ("0001-01-01", "9999-12-31")),
+    ("/search аптека 03.2024", ["аптека"], ("2024-03-01", "2024-04-01")),
+])
+async def test_search_trailing_number_is_a_term(text, terms, period):
+    mock_message = create_mock_message(text)
+    mock_storage = create_mock_storage({"notes": [], "count": 0, "total": 0})
+
+    await SearchHandler(message=mock_message, storage=mock_storage).search()
+
+    kwargs = mock_storage.search_notes.call_args.kwargs
+    assert kwargs["terms"] == terms
+    assert (kwargs["start_date"], kwargs["end_date"]) == period
+
+
+# Без слов поиска хранилище не вызывается.
+@pytest.mark.asyncio
+async def test_search_without_terms_replies_usage():
+    mock_message = create_mock_message("/search")
+    mock_storage = create_mock_storage({"notes": [], "count": 0, "total": 0})
+
+    assert await SearchHandler(message=mock_message, storage=mock_storage).search() is None
+
+    mock_storage.search_notes.assert_not_called()
+    mock_message.reply.assert_called_once()
@@ -0,0 +1,176 @@
+import os
+
+import pytest
+import aiosqlite
+
+import config
+from app import crud
+from app.database import get_async_sqlite_session, update_tables, fan_out
+from app.migrations import MIGRATIONS, run_migrations
+from app.sharding import archive_path, shard_for_user, shard_path, all_shards, rebalance_from_single
+
+SHARDS = 4
+
+
+@pytest.fixture
+def sharded_db(tmp_path, monkeypatch):
+    """Временная БД из нескольких шардов."""
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "bot.db"))
+    monkeypatch.setattr(config, "DATABASE_SHARDS", SHARDS, raising=False)
+    return tmp_path
+
+
+# Один шард - это обычный файл config.DATABASE_NAME.
+def test_single_shard_uses_database_name(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DATABASE_NAME", str(tmp_path / "bot.db"))
+    monkeypatch.setattr(config, "DATABASE_SHARDS", 1, raising=False)
+
+    assert shard_for_user(123456) == 0
+    assert shard_path(0) == str(tmp_path / "bot.db")
+
+
+# Номер шарда стабилен и лежит в допустимом диапазоне.
+def test_shard_for_user_is_stable(sharded_db):
+    shards = {shard_for_user(user_id) for user_id in range(1000)}
+
+    assert shard_for_user(123456) == shard_for_user(123456)
+    assert shards == set(all_shards())
+    assert shard_path(2) == str(sharded_db / "bot.shard2.db")
+
+
+# Запись попадает в файл шарда пользователя, админский запрос собирает все шарды.
+@pytest.mark.asyncio
+async def test_add_note_routes_to_user_shard_and_fan_out(sharded_db):
+    await update_tables()
+    user_ids = [101, 202, 303, 404, 505]
+    for user_id in user_ids:
+        assert await crud.add_note(user_id, "Еда", "Обед", user_id, "Еда обед")
+
+    for user_id in user_ids:
+        async with get_async_sqlite_session(user_id) as conn:
+            cursor = await conn.execute("SELECT user_tg_id FROM out")
+            assert user_id in {row[0] for row in await cursor.fetchall()}
+
+    async def count_rows(conn, shard):
+        cursor = await conn.execute("SELECT COUNT(*) FROM out")
+        return (await cursor.fetchone())[0]
+
+    assert sum(await fan_out(count_rows)) == len(user_ids)
+
+
+# Перенос из одного файла раскладывает записи по шардам.
+@pytest.mark.asyncio
+async def test_rebalance_from_single_file(sharded_db):
+    source_path = str(sharded_db / "single.db")
+    source = await aiosqlite.connect(source_path)
+    await run_migrations(source)
+    await source.executemany(
+        "INSERT INTO out (user_tg_id, category, sub_category, summ, description, date) VALUES (?, ?, ?, ?, ?, ?)",
+        [(user_id, "Еда", "Еда", 100, "Еда", "01.02.2025") for user_id in range(50)]
+    )
+    await source.commit()
+    await source.close()
+
+    moved = await rebalance_from_single(source_path, batch_size=7)
+
+    assert sum(moved.values()) == 50
+    for shard in all_shards():
+        assert os.path.exists(shard_path(shard))
+
+    # Повторный запуск не задваивает записи.
+    with pytest.raises(RuntimeError):
+        await rebalance_from_single(source_path)
+
+
+# Курсы переносятся до записей, архив закрытых лет - в архивы шардов, баланс учитывает и архив.
+@pytest.mark.asyncio
+async def test_rebalance_moves_rates_and_archive_before_balance(sharded_db):
+    source_path = str(sharded_db / "single.db")
+    async with aiosqlite.connect(source_path) as source:
+        await run_migrations(source)
+        await source.execute("INSERT INTO rates (currency, date_iso, rate) VALUES ('USD', '2020-01-01', 90)")
+        await source.execute(
+            "INSERT INTO out (user_tg_id, category, sub_category, summ, description, date, currency) "
+            "VALUES (7, 'Еда', 'Еда', 100, 'Еда', '01.02.2025', 'USD')"
+        )
+        await source.execute(
+            "INSERT INTO income (user_tg_id, category, summ, description, date, date_iso) "
+            "VALUES (7, 'Зарплата', 50000, 'Зарплата', '01.02.2025', '2025-02-01')"
+        )
+        await source.commit()
+    async with aiosqlite.connect(str(sharded_db / "single.archive.db")) as source_archive:
+        await run_migrations(source_archive)
+        await source_archive.execute(
+            "INSERT INTO out (user_tg_id, category, sub_category, summ, description, date, currency) "
+            "VALUES (7, 'Еда', 'Еда', 10, 'Еда', '01.02.2023', 'USD')"
+        )
+        await source_archive.commit()
+
+    moved = await rebalance_from_single(source_path)
+
+    shard = shard_for_user(7)
+    assert moved[shard] == 2
+    async with aiosqlite.connect(archive_path(shard)) as archive_conn:
+        cursor = await archive_conn.execute("SELECT date FROM out")
+        assert [row[0] for row in await cursor.fetchall()] == ["01.02.2023"]
+    async with get_async_sqlite_session(shard=shard) as conn:
+        cursor = await conn.execute("SELECT income, expense FROM balance WHERE user_tg_id = 7")
+        assert tuple(await cursor.fetchone()) == (50000, 9900)
+
+
+# Любая непустая таблица данных в шарде отменяет перенос, а не только 'out'.
+@pytest.mark.asyncio
+async def test_rebalance_refuses_shard_with_income(sharded_db):
+    source_path = str(sharded_db / "single.db")
+    async with aiosqlite.connect(source_path) as source:
+        await run_migrations(source)
+    await update_tables()
+    assert await crud.add_income(7, "Зарплата", 50000, "Зарплата")
+
+    with pytest.raises(RuntimeError):
+        await rebalance_from_single(source_path)
+
+
+# Исходный файл старой схемы не меняется: миграции (перевод в копейки) применяются к копии.
+@pytest.mark.asyncio
+async def test_rebalance_does_not_modify_source(sharded_db):
+    source_path = str(sharded_db / "single.db")
+    async with aiosqlite.connect(source_path) as source:
+        await source.execute(MIGRATIONS[0].statements[0])
+        await source.execute("PRAGMA user_version = 1")
+        await source.execute(
+            "INSERT INTO out (user_tg_id, category, sub_category, summ, description, date) "
+            "VALUES (7, 'Еда', 'Еда', 100, 'Еда', '01.02.2025')"
+        )
+        await source.commit()
+    with open(source_path, "rb") as file:
+        original = file.read()
+
+    assert sum((await rebalance_from_single(source_path)).values()) == 1
+
+    with open(source_path, "rb") as file:
+        assert file.read() == original
+    async with get_async_sqlite_session(7) as conn:
+        cursor = await conn.execute("SELECT summ, date_iso FROM out")
+        assert tuple(await cursor.fetchone()) == (10000, "2025-02-01")
+
+
+# Курсы, которые бот записал при запуске, не мешают переносу: они заменяются курсами источника.
+@pytest.mark.asyncio
+async def test_rebalance_replaces_rates_filled_by_bot_start(sharded_db):
+    source_path = str(sharded_db / "single.db")
+    async with aiosqlite.connect(source_path) as source:
+        await run_migrations(source)
+        await source.execute("INSERT INTO rates (currency, date_iso, rate) VALUES ('USD', '2020-01-01', 90)")
+        await source.commit()
+    await update_tables()
+    for shard in all_shards():
+        async with get_async_sqlite_session(shard=shard) as conn:
+            await conn.execute("INSERT INTO rates (currency, date_iso, rate) VALUES ('USD', '2020-01-01', 80)")
+            await conn.commit()
+
+    await rebalance_from_single(source_path)
+
+    async with get_async_sqlite_session(shard=0) as conn:
+        cursor = await conn.execute("SELECT rate FROM rates")
+        assert [row[0] for row in await cursor.fetchall()] == [90]
@@ -0,0 +1,206 @@
+from datetime import date, datetime
+
+import pytest
+
+from app import crud
+from app.storage import NoteRecord, SQLiteStorage, StorageError, create_storage, set_storage
+from tests.test_db_utils import get_test_db_session, setup_test_db, single_connection_factory
+
+
+@pytest.mark.asyncio
+async def test_notes_by_month_are_filtered_by_user_and_period(storage):
+    await storage.add_note(1, "Еда", "Обед", 500, "Еда обед", datetime(2025, 1, 15))
+    await storage.add_note(1, "Кино", "Кино", 1200, "Кино", datetime(2025, 1, 31))
+    await storage.add_note(1, "Еда", "Ужин", 800, "Еда ужин", datetime(2025, 2, 1))
+    await storage.add_note(2, "Еда", "Ужин", 700, "Еда ужин", datetime(2025, 1, 20))
+
+    notes = await storage.get_notes_by_user_and_month(1, 1, 2025)
+
+    assert sorted(note["summ"] for note in notes) == [500, 1200]
+    assert {note["date"] for note in notes} == {"15.01.2025", "31.01.2025"}
+    assert await storage.get_notes_by_user_and_month(3, 1, 2025) == []
+
+
+@pytest.mark.asyncio
+async def test_december_range_does_not_leak_into_next_year(storage):
+    await storage.add_note(1, "Подарки", "Подарки", 3000, "Подарки", datetime(2024, 12, 31))
+    await storage.add_note(1, "Еда", "Еда", 100, "Еда", datetime(2025, 1, 1))
+
+    notes = await storage.get_notes_by_user_and_month(1, 12, 2024)
+
+    assert [note["summ"] for note in notes] == [3000]
+
+
+@pytest.mark.asyncio
+async def test_totals_by_month_for_all_users(storage):
+    await storage.add_note(1, "Еда", "Еда", 100, "Еда", datetime(2025, 3, 1))
+    await storage.add_note(1, "Еда", "Еда", 200, "Еда", datetime(2025, 3, 2))
+    await storage.add_note(2, "Еда", "Еда", 50, "Еда", datetime(2025, 3, 3))
+
+    assert await storage.get_totals_by_month(3, 2025) == {1: 300, 2: 50}
+
+
+# crud работает через текущее хранилище.
+@pytest.mark.asyncio
+async def test_crud_uses_current_storage():
+    storage = create_storage("memory")
+    set_storage(storage)
+
+    assert await crud.add_note(7, "Еда", "Обед", 250, "Еда обед")
+
+    now = datetime.now()
+    notes = await crud.get_notes_by_user_and_month(7, now.month, now.year)
+    assert [note["summ"] for note in notes] == [250]
+
+
+def test_create_storage_unknown_backend():
+    with pytest.raises(ValueError):
+        create_storage("postgres")
+
+
+@pytest.mark.asyncio
+async def test_search_notes_by_prefix_and_period(storage):
+    await storage.add_note(1, "Здоровье", "Стоматолог", 5000, "Здоровье Стоматолог пломба", datetime(2024, 3, 15))
+    await storage.add_note(1, "Здоровье", "Стоматолог", 3000, "Здоровье Стоматолог чистка", datetime(2024, 9, 1))
+    await storage.add_note(1, "Здоровье", "Стоматолог", 4000, "Здоровье Стоматолог", datetime(2025, 2, 1))
+    await storage.add_note(1, "Еда", "Обед", 500, "Еда Обед", datetime(2024, 3, 15))
+    await storage.add_note(2, "Здоровье", "Стоматолог", 9000, "Здоровье Стоматолог", datetime(2024, 5, 5))
+
+    result = await storage.search_notes(1, ["стомат"], "2024-01-01", "2025-01-01")
+
+    assert result["count"] == 2
+    assert result["total"] == 8000
+    # Новые записи первыми.
+    assert [note["summ"] for note in result["notes"]] == [3000, 5000]
+
+    # Все слова должны совпасть, лимит не влияет на количество и сумму.
+    result = await storage.search_notes(1, ["стоматолог", "пломба"], "0001-01-01", "9999-12-31")
+    assert (result["count"], result["total"]) == (1, 5000)
+    result = await storage.search_notes(1, ["Стоматолог"], "0001-01-01", "9999-12-31", limit=1)
+    assert (result["count"], result["total"], len(result["notes"])) == (3, 12000, 1)
+
+
+@pytest.mark.asyncio
+async def test_search_notes_ignores_fts_syntax(storage):
+    await storage.add_note(1, "Еда", "Обед", 500, "Еда Обед", datetime(2024, 3, 15))
+
+    result = await storage.search_notes(1, ['"', "OR", "еда"], "0001-01-01", "9999-12-31")
+
+    assert result["count"] == 0
+
+
+@pytest.mark.asyncio
+async def test_category_comparison_with_previous_month_and_last_year(storage):
+    await storage.add_note(1, "Еда", "Еда", 1000, "Еда", datetime(2025, 3, 5))
+    await storage.add_note(1, "Еда", "Еда", 500, "Еда", datetime(2025, 3, 25))
+    await storage.add_note(1, "Еда", "Еда", 1200, "Еда", datetime(2025, 2, 10))
+    await storage.add_note(1, "Еда", "Еда", 900, "Еда", datetime(2024, 3, 1))
+    await storage.add_note(1, "Кино", "Кино", 400, "Кино", datetime(2025, 2, 14))
+    # Вне периодов сравнения и чужие записи не учитываются.
+    await storage.add_note(1, "Еда", "Еда", 7777, "Еда", datetime(2025, 1, 31))
+    await storage.add_note(2, "Еда", "Еда", 5555, "Еда", datetime(2025, 3, 5))
+
+    rows = await storage.get_category_comparison(1, 3, 2025)
+
+    assert rows == [
+        {"category": "Еда", "current": 1500, "previous": 1200, "last_year": 900},
+        {"category": "Кино", "current": 0, "previous": 400, "last_year": 0},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_category_comparison_in_january_uses_previous_december(storage):
+    await storage.add_note(1, "Еда", "Еда", 300, "Еда", datetime(2024, 12, 31))
+
+    rows = await storage.get_category_comparison(1, 1, 2025)
+
+    assert rows == [{"category": "Еда", "current": 0, "previous": 300, "last_year": 0}]
+
+
+# Пропущенные платежи догоняются, повторный запуск ничего не дублирует.
+@pytest.mark.asyncio
+async def test_materialize_recurring_catches_up_idempotently(storage):
+    rent = await storage.add_recurring(1, "Жилье", "Аренда", 25000, "Жилье Аренда", 31, None, date(2025, 1, 10))
+    await storage.add_recurring(2, "Спорт", "Бассейн", 500, "Спорт Бассейн", None, 0, date(2025, 1, 10))
+
+    # Бот не работал до 5 марта: аренда за 31.01 и 28.02, бассейн по понедельникам.
+    assert await storage.materialize_recurring(date(2025, 3, 5)) == {1: 2, 2: 8}
+    assert await storage.materialize_recurring(date(2025, 3, 5)) == {}
+
+    notes = await storage.get_notes_by_user_and_month(1, 2, 2025)
+    assert [(note["summ"], note["date"]) for note in notes] == [(25000, "28.02.2025")]
+    assert await storage.get_totals_by_month(2, 2025) == {1: 25000, 2: 2000}
+
+    assert [rule["id"] for rule in await storage.get_recurring(1)] == [rent]
+    assert not await storage.delete_recurring(2, rent)
+    assert await storage.delete_recurring(1, rent)
+    assert await storage.get_recurring(1) == []
+    assert await storage.materialize_recurring(date(2025, 4, 1)) == {2: 4}
+
+
+# Потоковое чтение отдает те же записи, что и список, пачками заданного размера.
+@pytest.mark.asyncio
+async def test_iter_notes_by_user_and_period_streams_records(storage):
+    for day in range(1, 8):
+        await storage.add_note(1, "Еда", "Еда", day * 100, "Еда", datetime(2025, 4, day))
+    await storage.add_note(1, "Еда", "Еда", 999, "Еда", datetime(2025, 5, 1))
+    await storage.add_note(2, "Еда", "Еда", 999, "Еда", datetime(2025, 4, 1))
+
+    records = [note async for note in storage.iter_notes_by_user_and_period(1, "2025-04-01", "2025-05-01",
+                                                                           chunk_size=3)]
+
+    assert all(isinstance(note, NoteRecord) for note in records)
+    assert sorted(note.summ for note in records) == [100, 200, 300, 400, 500, 600, 700]
+    assert {note.date for note in records} >= {"01.04.2025", "07.04.2025"}
+    assert [note async for note in storage.iter_notes_by_user_and_period(3, "2025-04-01", "2025-05-01")] == []
+
+
+# Баланс обновляется при каждой записи: расходы, доходы и регулярные расходы.
+@pytest.mark.asyncio
+async def test_balance_follows_notes_and_income(storage):
+    assert await storage.get_balance(1) == {"income": 0, "expense": 0, "balance": 0}
+
+    await storage.add_income(1, "Зарплата", 50000, "Зарплата", datetime(2025, 1, 5))
+    await storage.add_note(1, "Еда", "Обед", 500, "Еда обед", datetime(2025, 1, 15))
+    await storage.add_note(2, "Еда", "Обед", 700, "Еда обед", datetime(2025, 1, 15))
+    await storage.add_recurring(1, "Жилье", "Аренда", 20000, "Жилье Аренда", 1, None, date(2025, 1, 10))
+    await storage.materialize_recurring(date(2025, 2, 1))
+
+    assert await storage.get_balance(1) == {"income": 50000, "expense": 20500, "balance": 29500}
+    assert await storage.get_balance(2) == {"income": 0, "expense": 700, "balance": -700}
+
+
+# Ошибка БД в любом методе SQLiteStorage пишется в лог и поднимает StorageError,
+# а не возвращает пустой результат, неотличимый от настоящих данных.
+@pytest.mark.asyncio
+async def test_sqlite_storage_raises_storage_error_on_database_errors():
+    conn = await get_test_db_session()
+    await setup_test_db(conn)
+    await conn.close()
+    storage = SQLiteStorage(session_factory=single_connection_factory(conn))
+
+    calls = [
+        storage.add_note(1, "Еда", "Обед", 500, "Еда обед", datetime(2025, 1, 15)),
+        storage.get_notes_by_user_and_month(1, 1, 2025),
+        storage.add_income(1, "Зарплата", 50000, "Зарплата", datetime(2025, 1, 5)),
+        storage.get_balance(1),
+        storage.mark_processed(1, 10, 1000),
+        storage.is_processed(1, 10),
+        storage.expire_processed(1000),
+        storage.get_totals_by_month(1, 2025),
+        storage.search_notes(1, ["еда"], "2025-01-01", "2025-02-01"),
+        storage.get_category_comparison(1, 1, 2025),
+        storage.get_group_totals("Семья", "2025-01-01", "2025-02-01"),
+        storage.get_category_usage(1),
+        storage.add_recurring(1, "Жилье", "Аренда", 20000, "Жилье Аренда", 1, None, date(2025, 1, 10)),
+        storage.get_recurring(1),
+        storage.delete_recurring(1, 1),
+        storage.materialize_recurring(date(2025, 2, 1)),
+    ]
+    for call in calls:
+        with pytest.raises(StorageError):
+            await call
+
+    with pytest.raises(StorageError):
+        async for _ in storage.iter_notes_by_user_and_period(1, "2025-01-01", "2025-02-01"):
+            pass
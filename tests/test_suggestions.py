@@ -0,0 +1,152 @@
+from datetime import date, datetime
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from app import crud
+from app.main import echo_mess
+from app.storage import MemoryStorage, set_storage
+from app.suggestions import CategoryIndex, category_suggestions
+
+TODAY = date(2025, 6, 15)
+
+
+@pytest.fixture(autouse=True)
+def memory_storage():
+    storage = MemoryStorage()
+    set_storage(storage)
+    category_suggestions.clear()
+    yield storage
+    category_suggestions.clear()
+    set_storage(None)
+
+
+def make_index() -> CategoryIndex:
+    index = CategoryIndex()
+    index.add("Продукты", "Овощи", date(2025, 6, 10), uses=5)
+    index.add("Прочее", "Прочее", date(2025, 6, 1), uses=2)
+    index.add("Такси", "Такси", date(2024, 6, 1), uses=20)
+    index.add("Кафе", "Кофе", date(2025, 6, 14))
+    return index
+
+
+def test_top_ranks_by_frequency_and_recency():
+    # Такси - чаще всех, но год назад: вес уменьшился в 2^12 раз.
+    assert make_index().top(3, TODAY) == ["Продукты", "Прочее", "Кафе"]
+
+
+@pytest.mark.parametrize("word, expected", [
+    ("продукты ", "Продукты"),  # Регистр и пробелы
+    ("Про", "Продукты"),        # Префикс двух категорий - более используемая
+    ("Прочее", "Прочее"),
+    ("Продукыт", "Продукты"),   # Опечатка
+    ("Пр", None),               # Слишком короткий префикс
+    ("Кино", None),             # Новая категория
+])
+def test_resolve_prefixes_and_typos(word, expected):
+    assert make_index().resolve(word, TODAY) == expected
+
+
+def test_exact_ignores_prefixes_and_typos():
+    index = make_index()
+    assert index.exact("продукты ") == "Продукты"
+    assert index.exact("Про") is None and index.exact("Продукыт") is None
+    assert index.exact_sub("продукты", "овощи") == "Овощи"
+    assert index.exact_sub("Продукты", "ово") is None
+
+
+def test_resolve_sub_within_category():
+    index = make_index()
+    assert index.resolve_sub("Продукты", "ово", TODAY) == "Овощи"
+    assert index.resolve_sub("Кафе", "ово", TODAY) is None
+
+
+# Индекс читается из хранилища один раз, дальше дополняется crud.add_note.
+@pytest.mark.asyncio
+async def test_index_is_loaded_once_and_updated_by_add_note(memory_storage):
+    await memory_storage.add_note(1, "Еда", "Обед", 50000, "Еда обед", datetime(2025, 6, 1))
+    memory_storage.get_category_usage = AsyncMock(wraps=memory_storage.get_category_usage)
+
+    first = await crud.get_category_index(1)
+    await crud.add_note(1, "Кино", "Кино", 30000, "Кино")
+    second = await crud.get_category_index(1)
+
+    assert memory_storage.get_category_usage.await_count == 1
+    assert second is first
+    assert second.resolve("кин") == "Кино"
+    assert second.resolve_sub("Еда", "обе") == "Обед"
+
+
+def make_message(text: str):
+    message = AsyncMock(text=text)
+    message.from_user.id = 1
+    return message
+
+
+# Префикс и опечатка не записываются сами: исправленное сообщение предлагается кнопкой.
+@pytest.mark.asyncio
+async def test_echo_mess_asks_before_rewriting_prefix(memory_storage):
+    await memory_storage.add_note(1, "Продукты", "Овощи", 50000, "Продукты овощи", datetime.now())
+
+    with patch("app.main.config", MagicMock(USERS=[1])):
+        message = make_message("300 прод ово рынок")
+        await echo_mess(message)
+
+    notes = [note async for note in memory_storage.iter_notes_by_user_and_period(1, "2000-01-01", "2100-01-01")]
+    assert [note.category for note in notes] == ["Продукты"]
+    assert message.answer.await_args.args[0].startswith("Записать в категорию Продукты?")
+    keyboard = message.answer.await_args.kwargs["reply_markup"]
+    assert [button.text for row in keyboard.keyboard for button in row] == [
+        "300 Продукты Овощи рынок", "300 прод ово рынок"
+    ]
+
+
+# Кнопка "как есть" (то же сообщение еще раз) записывает новую категорию без повторного вопроса.
+@pytest.mark.asyncio
+async def test_echo_mess_keeps_category_as_typed_after_repeat(memory_storage):
+    await memory_storage.add_note(1, "Кинотеатр", "Кинотеатр", 50000, "Кинотеатр", datetime.now())
+
+    with patch("app.main.config", MagicMock(USERS=[1])):
+        question = make_message("300 Кино")
+        await echo_mess(question)
+        keyboard = question.answer.await_args.kwargs["reply_markup"]
+        assert [button.text for row in keyboard.keyboard for button in row] == ["300 Кинотеатр", "300 Кино"]
+
+        repeated = make_message("300 Кино")
+        await echo_mess(repeated)
+        later = make_message("150 кино")
+        await echo_mess(later)
+
+    notes = [note async for note in memory_storage.iter_notes_by_user_and_period(1, "2000-01-01", "2100-01-01")]
+    assert [note.category for note in notes] == ["Кинотеатр", "Кино", "Кино"]
+    repeated.answer.assert_not_awaited()
+    later.answer.assert_not_awaited()
+
+
+# Точное совпадение (без учета регистра) записывается под известным написанием без вопроса.
+@pytest.mark.asyncio
+async def test_echo_mess_records_exact_match(memory_storage):
+    await memory_storage.add_note(1, "Продукты", "Овощи", 50000, "Продукты овощи", datetime.now())
+
+    with patch("app.main.config", MagicMock(USERS=[1])):
+        message = make_message("300 продукты овощи")
+        await echo_mess(message)
+
+    notes = [note async for note in memory_storage.iter_notes_by_user_and_period(1, "2000-01-01", "2100-01-01")]
+    assert [note.category for note in notes] == ["Продукты", "Продукты"]
+    assert (await memory_storage.get_category_usage(1))[0]["uses"] == 2
+    message.answer.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_echo_mess_offers_top_categories_for_bare_amount(memory_storage):
+    for category in ("Еда", "Еда", "Такси"):
+        await memory_storage.add_note(1, category, category, 10000, category, datetime.now())
+
+    with patch("app.main.config", MagicMock(USERS=[1], SUGGESTION_BUTTONS=6)):
+        message = make_message("250")
+        await echo_mess(message)
+
+    keyboard = message.answer.await_args.kwargs["reply_markup"]
+    assert [button.text for row in keyboard.keyboard for button in row] == ["250 Еда", "250 Такси"]
+    assert keyboard.one_time_keyboard
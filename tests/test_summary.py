@@ -0,0 +1,110 @@
+from datetime import date, datetime
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from app import crud
+from app.main import inline_month_summary
+from app.storage import MemoryStorage, set_storage
+from app.summary import MonthSummary, SummaryCache, format_summary, month_summaries
+
+
+@pytest.fixture(autouse=True)
+def memory_storage():
+    storage = MemoryStorage()
+    set_storage(storage)
+    month_summaries.clear()
+    yield storage
+    month_summaries.clear()
+    set_storage(None)
+
+
+def test_summary_cache_misses_after_month_change():
+    cache = SummaryCache()
+    summary = MonthSummary(2025, 3)
+    cache.put(1, summary, 0)
+
+    cache.note_added(1, "Еда", 100, date(2025, 3, 5), 1)
+    cache.note_added(1, "Еда", 999, date(2025, 2, 28), 2)
+
+    assert cache.get(1, date(2025, 3, 31), 1) is summary
+    assert summary.total == 100 and summary.count == 1
+    assert cache.get(1, date(2025, 4, 1), 1) is None
+
+
+# Записи в обход crud.add_note (регулярные расходы) увеличивают версию: сводка строится заново.
+@pytest.mark.asyncio
+async def test_month_summary_is_rebuilt_after_data_version_bump(memory_storage):
+    first = await crud.get_month_summary(1)
+    await memory_storage.add_note(1, "Жилье", "Аренда", 25000, "Жилье Аренда", datetime.now())
+
+    crud.bump_data_versions([1])
+    crud.bump_data_versions([1])
+    await crud.add_note(1, "Кино", "Кино", 300, "Кино")
+    second = await crud.get_month_summary(1)
+
+    assert second is not first
+    assert second.total == 25300
+
+
+def test_format_summary_lists_top_categories():
+    summary = MonthSummary(2025, 3)
+    for category, summ in [("Еда", 30000), ("Кино", 50000), ("Такси", 10050), ("Еда", 30000)]:
+        summary.add(category, summ)
+
+    text = format_summary(summary, limit=2)
+
+    assert text.startswith("📅 Март 2025 года: 1200.50 руб. (4 зап.)")
+    assert text.index("Еда: 600") < text.index("Кино: 500")
+    assert "Такси" not in text
+
+
+# Сводка строится из хранилища один раз, дальше дополняется crud.add_note.
+@pytest.mark.asyncio
+async def test_month_summary_is_built_once_and_updated_by_add_note(memory_storage):
+    await memory_storage.add_note(1, "Еда", "Обед", 500, "Еда обед", datetime.now())
+    iterate = MagicMock(wraps=memory_storage.iter_notes_by_user_and_period)
+
+    with patch.object(memory_storage, "iter_notes_by_user_and_period", iterate):
+        first = await crud.get_month_summary(1)
+        await crud.add_note(1, "Кино", "Кино", 300, "Кино")
+        second = await crud.get_month_summary(1)
+
+    assert iterate.call_count == 1
+    assert second is first
+    assert second.total == 800
+    assert dict(second.top_categories()) == {"Еда": 500, "Кино": 300}
+
+
+# Запись во время построения сводки: сводка не кэшируется и строится заново.
+@pytest.mark.asyncio
+async def test_month_summary_built_during_add_note_is_not_cached(memory_storage):
+    original = memory_storage.iter_notes_by_user_and_period
+
+    async def iterate_with_concurrent_note(**kwargs):
+        await crud.add_note(1, "Кино", "Кино", 300, "Кино")
+        async for note in original(**kwargs):
+            yield note
+
+    with patch.object(memory_storage, "iter_notes_by_user_and_period", iterate_with_concurrent_note):
+        await crud.get_month_summary(1)
+
+    assert month_summaries.get(1, date.today(), crud.get_data_version(1)) is None
+    assert (await crud.get_month_summary(1)).total == 300
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("users, answered_results", [([42], 1), ([], 0)])
+async def test_inline_query_answers_with_cache_time(users, answered_results):
+    inline_query = MagicMock()
+    inline_query.from_user.id = 42
+    inline_query.answer = AsyncMock()
+
+    with patch("app.main.config") as mock_config:
+        mock_config.USERS = users
+        mock_config.INLINE_CACHE_TIME = 15
+        await inline_month_summary(inline_query)
+
+    results = inline_query.answer.await_args.args[0]
+    assert len(results) == answered_results
+    assert inline_query.answer.await_args.kwargs == {"cache_time": 15, "is_personal": True}